@@ -555,54 +555,82 @@ $(function() {
 		//$("#output-directory-box").val(timestamp)
 	}
 
-	function showTinyTile(base64) {
+	function showTinyTile(item) {
 		var currentImages = $(".tile-strip img");
 
 		for(var i = 4; i < currentImages.length; i++) {
 			$(currentImages[i]).remove();
 		}
 
-		var image = $("<img/>").attr('src', "data:image/png;base64, " + base64)
+		var src = item.image_url ? item.image_url : "data:image/jpeg;base64, " + item.image;
+		var image = $("<img/>").attr('src', src)
 
 		var strip = $(".tile-strip");
 		strip.prepend(image)
 	}
-	// Function to poll the task status
-	async function pollTaskStatus() {
-	    try {
-	        // Call the /task-status endpoint
-	        var response = await $.ajax({
-	            url: "/task-status",
-	            async: true,
-	            timeout: 30 * 1000,
-	            type: "get",
-	            dataType: 'json',
-	        });
-			
-			if (response.code === 200) {
-				var status = response.message.status; // Extract the status field
-				console.log("Task status:", status); // Debugging log
-	
-				// Check the task status
-				if (status === "completed") {
-					logItemRaw("Gazebo world generated successfully.");
-					$("#stop-button").html("FINISH");
-					
-					// Add the launch pad marker when generation is complete
-					createLaunchPadMarker();
-				} else if (status === "in_progress") {
-					logItemRaw("World Generation Inprogress..");
-					setTimeout(() => pollTaskStatus(), 5000); // Poll every 5 seconds
-				} else {
-					logItemRaw("Unexpected status: " + status);
-				}
+	function formatBytes(bytes) {
+		var units = ["B", "KB", "MB", "GB"];
+		var i = 0;
+		while(bytes >= 1024 && i < units.length - 1) {
+			bytes /= 1024;
+			i++;
+		}
+		return bytes.toFixed(1) + " " + units[i];
+	}
+
+	// Follow the generation job through its Server-Sent Events stream
+	function watchTaskEvents(jobId) {
+		var source = new EventSource("/task-events?job_id=" + encodeURIComponent(jobId));
+		window.taskEventSource = source;
+
+		source.addEventListener("stage", function(e) {
+			var data = JSON.parse(e.data);
+			logItemRaw("Stage: " + data.stage);
+		});
+
+		source.addEventListener("progress", function(e) {
+			var data = JSON.parse(e.data);
+			if(data.total > 0) {
+				updateProgress(data.processed, data.total);
 			} else {
-				logItemRaw("Unexpected response code: " + response.code);
+				$("#progress-subtitle").html("");
 			}
-	    } catch (error) {
-	        logItemRaw("Error while checking task status: " + error.statusText);
-	        setTimeout(() => pollTaskStatus(taskId), 5000); // Retry after 5 seconds
-	    }
+			$("#progress-subtitle").append(
+				"<br/>" + data.stage + " <span>" + formatBytes(data.bytes_per_sec) + "/s, " +
+				data.items_per_sec + " items/s</span>"
+			);
+		});
+
+		source.addEventListener("status", function(e) {
+			var data = JSON.parse(e.data);
+			var status = data.status;
+			console.log("Task status:", status); // Debugging log
+
+			if (status === "completed") {
+				logItemRaw("Gazebo world generated successfully.");
+				$("#stop-button").html("FINISH");
+				
+				// Add the launch pad marker when generation is complete
+				createLaunchPadMarker();
+			} else if (status === "in_progress") {
+				logItemRaw("World Generation Inprogress..");
+			} else if (status === "failed") {
+				logItemRaw("World Generation failed: " + data.error);
+				$("#stop-button").html("FINISH");
+			} else if (status === "cancelled") {
+				logItemRaw("World Generation cancelled.");
+			}
+
+			if (status === "completed" || status === "failed" || status === "cancelled") {
+				window.currentJobId = null;
+				source.close();
+			}
+		});
+
+		source.onerror = function() {
+			// EventSource reconnects on its own, only report it
+			logItemRaw("Lost connection to task event stream, retrying..");
+		};
 	}
 	async function startDownloading() {
 
@@ -668,102 +696,105 @@ $(function() {
 			dataType: 'json',
 		})
 
-		let i = 0;
-		var iterator = async.eachLimit(allTiles, numThreads, function(item, done) {
-
-			if(cancellationToken) {
-				return;
-			}
-
-			var boxLayer = previewRect(item);
-
-			var url = "/download-tile";
-
-			var data = new FormData();
-			data.append('x', item.x)
-			data.append('y', item.y)
-			data.append('z', item.z)
-			data.append('quad', generateQuadKey(item.x, item.y, item.z))
-			data.append('outputDirectory', outputDirectory)
-			data.append('outputFile', outputFile)
-			data.append('outputType', outputType)
-			data.append('outputScale', outputScale)
-			data.append('timestamp', timestamp)
-			data.append('source', source)
-			data.append('bounds', boundsArray.join(","))
-			data.append('center', centerArray.join(","))
-			data.append('launchLocation', launchLocation.join(","))
-			data.append('area', area_rect)
-			data.append('includeBuildlings', includeBuildlings)
-
-			var request = $.ajax({
-				"url": url,
-				async: true,
-				timeout: 30 * 1000,
-				type: "post",
-			    contentType: false,
-			    processData: false,
-				data: data,
-				dataType: 'json',
-			}).done(function(data) {
-
-				if(cancellationToken) {
-					return;
-				}
+		var tileData = new FormData();
+		tileData.append('maxZoom', getMaxZoom());
+		tileData.append('outputDirectory', outputDirectory);
+		tileData.append('outputFile', outputFile);
+		tileData.append('outputScale', outputScale);
+		tileData.append('source', source);
+		tileData.append('timestamp', timestamp);
+		tileData.append('bounds', boundsArray.join(","));
+		tileData.append('workers', numThreads);
+		tileData.append('selection', JSON.stringify(draw.getAll().features[0].geometry));
+		tileData.append('preview', 'thumbnail');
+
+		var controller = new AbortController();
+		requests.push(controller);
 
-				if(data.code == 200) {
-					showTinyTile(data.image)
-					logItem(item.x, item.y, item.z, data.message);
-				} else {
-					logItem(item.x, item.y, item.z, data.code + " Error downloading tile");
-				}
+		let i = 0;
+		var total = allTiles.length;
+		try {
+			var response = await fetch("/download-tiles", {
+				method: "POST",
+				body: tileData,
+				signal: controller.signal,
+			});
 
-			}).fail(function(data, textStatus, errorThrown) {
+			// Tiles are streamed back as newline delimited JSON
+			var reader = response.body.getReader();
+			var decoder = new TextDecoder();
+			var buffer = "";
 
-				if(cancellationToken) {
-					return;
+			while(true) {
+				var chunk = await reader.read();
+				if(chunk.done) {
+					break;
 				}
 
-				logItem(item.x, item.y, item.z, "Error while relaying tile");
-				//allTiles.push(item);
-
-			}).always(function(data) {
-				i++;
-
-				removeLayer(boxLayer);
-				updateProgress(i, allTiles.length);
-
-				done();
-				
-				if(cancellationToken) {
-					return;
+				buffer += decoder.decode(chunk.value, {stream: true});
+				var lines = buffer.split("\n");
+				buffer = lines.pop();
+
+				for(var line of lines) {
+					if(line.trim() == "" || cancellationToken) {
+						continue;
+					}
+
+					var item = JSON.parse(line);
+
+					if(item.type == "start") {
+						total = item.total;
+						updateProgress(0, total);
+					} else if(item.type == "tile") {
+						// Final retry pass results refer to tiles already counted
+						if(!item.retry) {
+							i++;
+						}
+						if(item.code == 200) {
+							if(item.image || item.image_url) {
+								showTinyTile(item);
+							}
+							logItem(item.x, item.y, item.z, item.message);
+						} else {
+							logItem(item.x, item.y, item.z, item.code + " Error downloading tile");
+						}
+						updateProgress(i, total);
+					} else if(item.type == "end") {
+						logItemRaw(item.downloaded + " tiles downloaded, " + item.failed + " failed");
+					}
 				}
-			});
-
-			requests.push(request);
-
-		}, async function(err) {
-
-			var request = await $.ajax({
-				url: "/end-download",
-				async: true,
-				timeout: 30 * 1000,
-				type: "post",
-				contentType: false,
-				processData: false,
-				data: data,
-				dataType: 'json',
-			})
+			}
+		} catch(e) {
+			if(!cancellationToken) {
+				logItemRaw("Error while relaying tiles");
+			}
+		}
 
-			updateProgress(allTiles.length, allTiles.length);
-			logItemRaw("Starting World Generation");
-			pollTaskStatus(); // Start polling with the task ID
+		if(cancellationToken) {
+			return;
+		}
 
-		},
+		var request = await $.ajax({
+			url: "/end-download",
+			async: true,
+			timeout: 30 * 1000,
+			type: "post",
+			contentType: false,
+			processData: false,
+			data: data,
+			dataType: 'json',
+		})
 
+		updateProgress(total, total);
 
-	);
+		if(request.code != 200) {
+			logItemRaw(request.message);
+			return;
+		}
 
+		logItemRaw("Starting World Generation");
+		window.currentJobId = request.job_id;
+		watchTaskEvents(request.job_id); // Follow the job progress
 
 	}
 
@@ -823,6 +854,24 @@ $(function() {
 		// Otherwise, it's a regular stop operation during download
 		cancellationToken = true;
 
+		if(window.taskEventSource) {
+			window.taskEventSource.close();
+		}
+
+		if(window.currentJobId) {
+			var cancelData = new FormData();
+			cancelData.append('job_id', window.currentJobId);
+			$.ajax({
+				url: "/cancel-task",
+				type: "post",
+				contentType: false,
+				processData: false,
+				data: cancelData,
+				dataType: 'json',
+			});
+			window.currentJobId = null;
+		}
+
 		for(var i =0 ; i < requests.length; i++) {
 			var request = requests[i];
 			try {
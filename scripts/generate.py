@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+"""
+Generate Gazebo worlds without the web UI.
+
+Single region:
+    python generate.py --bounds 8.54,47.37,8.55,47.38 --zoom 17 --name zurich
+
+Batch of regions from a manifest:
+    python generate.py --manifest regions.json --jobs 2
+
+Only warm the imagery, DEM and vector tile caches, e.g. overnight:
+    python generate.py --manifest regions.json --prefetch --bandwidth 5
+
+A manifest is a JSON list of regions, or an object with a "regions" list and
+optional "defaults" applied to every region. Each region accepts the keys
+name, bounds [west, south, east, north] or polygon (GeoJSON geometry, feature
+or path to a GeoJSON file), zoom, launch_location [lon, lat], source,
+buildings and chunks.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from shapely.geometry import box, shape
+from pyproj import Geod
+from utils.jobManager import JobManager
+from utils.pipeline import DownloadExecutors, generate_region, prefetch_region
+from utils.tileFetcher import RateLimiter
+from utils.param import globalParam
+
+
+def load_geometry(polygon):
+    """
+    Load a shapely geometry from a GeoJSON object or file path.
+    """
+    if isinstance(polygon, str):
+        with open(polygon) as f:
+            polygon = json.load(f)
+    if polygon.get("type") == "FeatureCollection":
+        polygon = polygon["features"][0]
+    if polygon.get("type") == "Feature":
+        polygon = polygon["geometry"]
+    return shape(polygon)
+
+
+def resolve_region(region: dict) -> dict:
+    """
+    Fill in the derived fields of a region the way the UI does.
+
+    Polygons are reduced to their bounding box since the pipeline works on
+    rectangular areas.
+
+    Args:
+        region (dict): Region as given on the command line or in a manifest.
+
+    Returns:
+        dict: Region accepted by pipeline.generate_region.
+    """
+    if region.get("polygon") is not None:
+        geometry = load_geometry(region["polygon"])
+    elif region.get("bounds") is not None:
+        geometry = box(*map(float, region["bounds"]))
+    else:
+        raise ValueError(f"Region {region.get('name')} needs bounds or polygon")
+    if region.get("zoom") is None:
+        raise ValueError(f"Region {region.get('name')} needs a zoom level")
+
+    west, south, east, north = geometry.bounds
+    center = [(west + east) / 2, (south + north) / 2]
+    area = abs(Geod(ellps="WGS84").geometry_area_perimeter(geometry)[0])
+    launch_location = region.get("launch_location") or center
+
+    return {
+        "name": region.get("name") or str(int(time.time() * 1000)),
+        "bounds": [west, south, east, north],
+        "center": center,
+        "area": area,
+        "zoom": int(region["zoom"]),
+        "launch_location": [float(v) for v in launch_location],
+        "source": region.get("source") or globalParam.DEFAULT_TILE_SOURCE,
+        "buildings": bool(region.get("buildings", True)),
+        "chunks": max(1, int(region.get("chunks") or globalParam.TERRAIN_CHUNKS)),
+    }
+
+
+def load_manifest(path: str, defaults: dict) -> list:
+    """
+    Read the regions of a manifest, applying its defaults over the given ones.
+    Polygon files are resolved relative to the manifest.
+    """
+    with open(path) as f:
+        manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = {"regions": manifest}
+    defaults = dict(defaults, **manifest.get("defaults", {}))
+
+    regions = []
+    prefix = os.path.splitext(os.path.basename(path))[0]
+    for index, region in enumerate(manifest["regions"]):
+        region = dict(defaults, **region)
+        region.setdefault("name", f"{prefix}_{index}")
+        if isinstance(region.get("polygon"), str):
+            region["polygon"] = os.path.join(os.path.dirname(os.path.abspath(path)), region["polygon"])
+        regions.append(region)
+    return regions
+
+
+def parse_floats(value: str) -> list:
+    return [float(v) for v in value.split(",")]
+
+
+def watch(jobs: list) -> None:
+    """
+    Print stage and status changes of the jobs until all of them finished.
+    """
+    seen = {job.job_id: 0 for job in jobs}
+    while True:
+        # Read before draining, so the final status of a job finishing meanwhile is still printed
+        finished = all(job.finished for job in jobs)
+        for job in jobs:
+            events = job.events_since(seen[job.job_id])
+            seen[job.job_id] += len(events)
+            for event in events:
+                if event["event"] == "stage":
+                    print(f"[{job.name}] stage {event['stage']}")
+                elif event["event"] == "status":
+                    error = f": {event['error']}" if event.get("error") else ""
+                    print(f"[{job.name}] {event['status']}{error}")
+        if finished:
+            return
+        time.sleep(globalParam.SSE_PROGRESS_INTERVAL)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Generate Gazebo worlds from map tiles without the web UI.")
+    area = parser.add_mutually_exclusive_group(required=True)
+    area.add_argument("--bounds", type=parse_floats, help="Area as west,south,east,north")
+    area.add_argument("--polygon", help="GeoJSON file with the area, reduced to its bounding box")
+    area.add_argument("--manifest", help="JSON manifest with many regions")
+    parser.add_argument("--zoom", type=int, help="Imagery zoom level")
+    parser.add_argument("--name", help="Model name, defaults to a timestamp")
+    parser.add_argument("--launch", type=parse_floats, help="Launch location as lon,lat, defaults to the area center")
+    parser.add_argument("--source", help="Imagery tile URL template")
+    parser.add_argument("--buildings", action=argparse.BooleanOptionalAction, default=True,
+                        help="Generate buildings (default: on)")
+    parser.add_argument("--chunks", type=int,
+                        help="Split the terrain into an NxN grid of heightmap sub-models")
+    parser.add_argument("--jobs", type=int, default=globalParam.MAX_CONCURRENT_JOBS,
+                        help="Regions generated concurrently")
+    parser.add_argument("--workers", type=int, default=globalParam.TILE_DOWNLOAD_WORKERS,
+                        help="Concurrent imagery and building downloads, shared by all regions")
+    parser.add_argument("--prefetch", action="store_true",
+                        help="Only fill the tile caches of the regions, without generating worlds")
+    parser.add_argument("--bandwidth", type=float, default=globalParam.PREFETCH_BANDWIDTH / 1e6,
+                        help="Download limit in MB/s shared by all regions when prefetching, 0 for none")
+    args = parser.parse_args()
+
+    if args.manifest:
+        defaults = {"zoom": args.zoom, "source": args.source, "buildings": args.buildings, "chunks": args.chunks}
+        regions = load_manifest(args.manifest, {k: v for k, v in defaults.items() if v is not None})
+    else:
+        regions = [{
+            "name": args.name, "bounds": args.bounds, "polygon": args.polygon, "zoom": args.zoom,
+            "launch_location": args.launch, "source": args.source, "buildings": args.buildings,
+            "chunks": args.chunks,
+        }]
+
+    try:
+        regions = [resolve_region(region) for region in regions]
+    except (ValueError, KeyError, OSError) as e:
+        parser.error(str(e))
+
+    # Imagery fetcher and tile cache are process wide, and the download pools are
+    # created once here, so --jobs does not multiply the connections
+    manager = JobManager(max_workers=max(1, args.jobs), max_queued=len(regions))
+    executors = DownloadExecutors(args.workers)
+    if args.prefetch:
+        bandwidth = RateLimiter(args.bandwidth * 1e6)
+        jobs = [manager.submit(region["name"], prefetch_region, region, args.workers, bandwidth, executors) for region in regions]
+    else:
+        jobs = [manager.submit(region["name"], generate_region, region, args.workers, executors) for region in regions]
+
+    try:
+        watch(jobs)
+    except KeyboardInterrupt:
+        print("Cancelling, waiting for running stages to stop...")
+        for job in jobs:
+            job.cancel()
+        for job in jobs:
+            job.wait()
+    executors.shutdown()
+
+    failed = [job for job in jobs if job.status != "completed"]
+    if args.prefetch:
+        # Tiles that failed to download are not an error, the report shows what is left
+        for job in jobs:
+            for layer, counts in ((job.result or {}).get("coverage") or {}).items():
+                print(f"[{job.name}] {layer}: {counts['coverage']:.1%} covered, {counts['failed']} tiles failed")
+    print(f"{len(jobs) - len(failed)}/{len(jobs)} {'regions prefetched' if args.prefetch else 'worlds generated'}")
+    for job in failed:
+        print(f"[WARN] {job.name} {job.status}{': ' + job.error if job.error else ''}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
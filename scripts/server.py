@@ -1,57 +1,36 @@
 #!/usr/bin/env python
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context
 import threading
 import os
-import uuid
-import base64
+import json
+import time
 from pathlib import Path
 import mimetypes
-from utils.demTilesDownloader import download_dem_data
-from utils.buildingDownloader import download_steetmap_data
 from utils.fileWriter import FileWriter
-from utils.utils import Utils
-from utils.gazeboWorldGenerator import GazeboTerrianGenerator
 from utils.maptileUtils import maptile_utiles
+from utils.jobManager import JobManager, JobQueueFull
+from utils.tileFetcher import RETRYABLE_STATUS, RateLimiter
+from utils.tileStore import read_tile
+from utils.pipeline import DownloadExecutors, fetch_tile, download_region_tiles, write_metadata, generate_world, prefetch_region
 from utils.param import globalParam
+from utils import metrics
 import requests
 import mercantile
 app = Flask(__name__)
 lock = threading.Lock()
 
 
-task_status = {"status": "idle"}  # Global variable to track task status
+job_manager = JobManager()
+# Download pools shared by all jobs, so concurrent jobs do not multiply the connections
+download_executors = DownloadExecutors()
 
 
 outputdirectory = None
 
-def random_string():
-
-	return uuid.uuid4().hex.upper()[0:6]
-
-def process_end_download(bounds, zoom_level, outputDirectory, outputFile, filePath, include_buildings=False):
-	global task_status
-	try:
-		task_status["status"] = "in_progress"
-		#Perform the long-running task
-		FileWriter.close(lock, os.path.join(globalParam.OUTPUT_BASE_PATH, outputDirectory), filePath, zoom_level)
-		true_boundaries = maptile_utiles.get_true_boundaries(bounds, zoom_level)
-		download_dem_data(true_boundaries, globalParam.DEM_PATH)
-		orthodir_path = os.path.join(globalParam.OUTPUT_BASE_PATH, outputDirectory)
-		model_path =  os.path.join(globalParam.GAZEBO_MODEL_PATH,os.path.basename(orthodir_path))
-		if include_buildings:
-			print("Starting building data download...")
-			download_steetmap_data(true_boundaries, globalParam.BUILDING_PATH,model_path)
-
-		terrian_generator = GazeboTerrianGenerator(orthodir_path,include_buildings)
-		terrian_generator.generate_gazebo_world()
-		task_status["status"] = "completed"
-		print("Gazebo world generation completed successfully.")
-
-	except Exception as e:
-		task_status["status"] = "failed"
-		print(f"Error during processing: {e}")
-
+def process_end_download(job, bounds, zoom_level, outputDirectory, outputFile, filePath, include_buildings=False, chunks=globalParam.TERRAIN_CHUNKS):
+	#Perform the long-running task
+	generate_world(job, bounds, zoom_level, outputDirectory, outputFile, include_buildings, chunks, download_executors)
 
 def validate_mapbox_key(api_key):
     try:
@@ -81,57 +60,169 @@ def validate_mapbox_key(api_key):
 
 @app.route('/task-status', methods=['GET'])
 def task_status_endpoint():
-	global task_status
+	job_id = request.args.get('job_id')
+	job = job_manager.get(job_id) if job_id else job_manager.latest()
 	result = {}
-	result["code"] = 200
-	result["message"] = task_status
+	if job_id and job is None:
+		result["code"] = 404
+		result["message"] = {"status": "unknown", "job_id": job_id}
+	else:
+		result["code"] = 200
+		result["message"] = job.to_dict() if job else {"status": "idle"}
 	return jsonify(result)
 
+def format_sse(event, data):
+	return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/task-events', methods=['GET'])
+def task_events():
+	"""
+	Stream job progress as Server-Sent Events.
+
+	Emits "stage" and "status" events on transitions and coalesced "progress"
+	events carrying tile counts, bytes fetched and throughput. The stream ends
+	once the job reaches a final status.
+	"""
+	job_id = request.args.get('job_id')
+	job = job_manager.get(job_id) if job_id else job_manager.latest()
+	if job is None:
+		return jsonify({"code": 404, "message": {"status": "unknown", "job_id": job_id}})
+
+	def generate():
+		version = -1
+		event_index = 0
+		last_progress = None
+		yield format_sse("job", job.to_dict())
+		while True:
+			new_version = job.wait_for_update(version, globalParam.SSE_KEEPALIVE_INTERVAL)
+			if new_version == version:
+				yield ": keepalive\n\n"
+				continue
+			version = new_version
+			# Read before draining, a status set in between is then still sent before the stream ends
+			finished = job.finished
+
+			events = job.events_since(event_index)
+			event_index += len(events)
+			for event in events:
+				yield format_sse(event["event"], event)
+
+			progress = job.progress()
+			counters = (progress["stage"], progress["processed"], progress["total"], progress["bytes_fetched"])
+			if counters != last_progress:
+				last_progress = counters
+				yield format_sse("progress", progress)
+
+			if finished:
+				break
+			# Coalesce bursts of per-tile updates into one progress event
+			time.sleep(globalParam.SSE_PROGRESS_INTERVAL)
+
+	return Response(stream_with_context(generate()), mimetype='text/event-stream',
+					headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+	payload, content_type = metrics.render()
+	return Response(payload, content_type=content_type)
+
+@app.route('/cancel-task', methods=['POST'])
+def cancel_task():
+	job_id = request.form['job_id']
+	if job_manager.cancel(job_id):
+		return jsonify({"code": 200, "message": "Cancellation requested"})
+	return jsonify({"code": 404, "message": "No active job with that id"})
+
+@app.route('/prefetch', methods=['POST'])
+def prefetch():
+	# JSON body: {"regions": [{"name", "bounds": [west, south, east, north], "zoom", "source", "buildings"}],
+	#             "bandwidth": bytes per second shared by all regions}
+	postvars = request.get_json(force=True)
+	regions = postvars.get('regions', [])
+	if not regions or any('bounds' not in region or 'zoom' not in region for region in regions):
+		return jsonify({"code": 400, "message": "Every region needs bounds and zoom"})
+
+	bandwidth = RateLimiter(float(postvars.get('bandwidth', globalParam.PREFETCH_BANDWIDTH)))
+	jobs = []
+	try:
+		for index, region in enumerate(regions):
+			name = f"prefetch_{region.get('name', index)}"
+			jobs.append(job_manager.submit(name, prefetch_region, region, bandwidth=bandwidth, executors=download_executors).job_id)
+	except JobQueueFull as e:
+		return jsonify({"code": 503, "message": f"Generation queue is full: {e}", "job_ids": jobs})
+
+	return jsonify({"code": 200, "message": "Prefetch queued", "job_ids": jobs})
+
 @app.route('/download-tile', methods=['POST'])
 def download_tile():
 	postvars = request.form
 	x = int(postvars['x'])
 	y = int(postvars['y'])
 	z = int(postvars['z'])
-	quad = str(postvars['quad'])
 	timestamp = int(postvars['timestamp'])
 	outputDirectory = str(postvars['outputDirectory'])
 	outputFile = str(postvars['outputFile'])
 	outputScale = 1
 	source = str(postvars['source'])
+	preview = str(postvars.get('preview', 'thumbnail'))
+
+	result = fetch_tile(source, outputDirectory, outputFile, x, y, z, timestamp, outputScale, preview)
+	return jsonify(result)
+
+@app.route('/tiles/<path:directory>/<int:z>/<int:x>/<int:y>')
+def serve_tile(directory, z, x, y):
+	base = os.path.realpath(globalParam.OUTPUT_BASE_PATH)
+	root = os.path.realpath(os.path.join(base, directory))
+	# Only serve directories that already exist inside the output directory
+	if os.path.commonpath([base, root]) != base or not os.path.isdir(root):
+		return jsonify({"code": 404, "message": "Tile not found"}), 404
+	data = read_tile(root, z, x, y)
+	if data is None:
+		return jsonify({"code": 404, "message": "Tile not found"}), 404
+	mimetype = "image/png" if data[:4] == b"\x89PNG" else "image/jpeg"
+	return Response(data, mimetype=mimetype)
+
+@app.route('/download-tiles', methods=['POST'])
+def download_tiles():
+	"""
+	Download every imagery tile of a region in one request.
+
+	Tiles are enumerated server side, limited to the drawn selection when one
+	is sent, and fetched by a bounded worker pool.
+	Results are streamed back as newline delimited JSON, one object per tile,
+	framed by a "start" and an "end" record.
+	"""
+	postvars = request.form
+	zoom_level = int(postvars['maxZoom'])
+	timestamp = int(postvars['timestamp'])
+	outputDirectory = str(postvars['outputDirectory'])
+	outputFile = str(postvars['outputFile'])
+	outputScale = 1
+	source = str(postvars['source'])
+	preview = str(postvars.get('preview', 'thumbnail'))
+	bounds = list(map(float, postvars['bounds'].split(",")))
+	workers = int(postvars.get('workers', globalParam.TILE_DOWNLOAD_WORKERS))
+	workers = max(1, min(workers, globalParam.TILE_DOWNLOAD_WORKERS))
+	# GeoJSON geometry of the drawn selection, tiles outside it are not fetched
+	selection = json.loads(postvars['selection']) if postvars.get('selection') else None
 
-	replaceMap = {
-		"x": str(x),
-		"y": str(y),
-		"z": str(z),
-		"quad": quad,
-		"timestamp": str(timestamp),
-	}
-	for key, value in replaceMap.items():
-		outputDirectory = outputDirectory.replace(f"{{{key}}}", value)
-		outputFile = outputFile.replace(f"{{{key}}}", value)
+	tiles = maptile_utiles.get_tile_range(bounds, zoom_level, selection)
 
-	filePath = os.path.join(globalParam.OUTPUT_BASE_PATH, outputDirectory, outputFile)
+	def generate():
+		downloaded = failed = 0
+		yield json.dumps({"type": "start", "total": len(tiles)}) + "\n"
 
-	result = {}
-	if FileWriter.exists(filePath, x, y, z):
-		result["code"] = 200
-		result["message"] = 'Tile already exists'
-	else:
-		tempFile = random_string() + ".jpg"
-		tempFilePath = os.path.join(globalParam.TEMP_PATH, tempFile)
-		result["code"] = Utils.downloadFileScaled(source, tempFilePath, x, y, z, outputScale)
-
-		if os.path.isfile(tempFilePath):
-			FileWriter.addTile(lock, filePath, tempFilePath, x, y, z, outputScale)
-			with open(tempFilePath, "rb") as image_file:
-				result["image"] = base64.b64encode(image_file.read()).decode("utf-8")
-			os.remove(tempFilePath)
-			result["message"] = 'Tile Downloaded'
-		else:
-			result["message"] = 'Download failed'
+		for result in download_region_tiles(source, bounds, zoom_level, outputDirectory, outputFile, timestamp, workers, preview, outputScale,
+		                                    tiles=tiles):
+			if result["code"] == 200:
+				downloaded += 1
+			elif result.get("retry") or not (result["code"] == -1 or result["code"] in RETRYABLE_STATUS):
+				failed += 1
+			yield json.dumps(result) + "\n"
 
-	return jsonify(result)
+		yield json.dumps({"type": "end", "total": len(tiles), "downloaded": downloaded, "failed": failed}) + "\n"
+
+	return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 @app.route('/start-download', methods=['POST'])
 def start_download():
@@ -150,15 +241,7 @@ def start_download():
 
 	outputDirectory = outputDirectory.replace("{timestamp}", str(timestamp))
 	outputFile = outputFile.replace("{timestamp}", str(timestamp))
-	filePath = os.path.join(globalParam.OUTPUT_BASE_PATH, outputDirectory, outputFile)
-
-	FileWriter.addMetadata(
-		lock, os.path.join(globalParam.OUTPUT_BASE_PATH, outputDirectory), filePath, outputFile,
-		"Map Tiles Downloader via AliFlux", "jpg", bounds, center, area_rect,
-		zoom_level, "mercator", 256 * outputScale, launchLocation=launchLocation
-	)
-	global task_status
-	task_status = {"status": "idle"} 
+	write_metadata(outputDirectory, outputFile, bounds, center, area_rect, zoom_level, launchLocation, outputScale)
 	return jsonify({"code": 200, "message": "Metadata written"})
 
 @app.route('/end-download', methods=['POST'])
@@ -170,17 +253,20 @@ def end_download():
 	timestamp = int(postvars['timestamp'])
 	bounds = list(map(float, postvars['bounds'].split(",")))
 	include_buildings = postvars.get('includeBuildlings', 'true').lower() == 'true'
+	chunks = max(1, int(postvars.get('chunks', globalParam.TERRAIN_CHUNKS)))
 
 	outputDirectory = outputDirectory.replace("{timestamp}", str(timestamp))
 	outputFile = outputFile.replace("{timestamp}", str(timestamp))
 	filePath = os.path.join(globalParam.OUTPUT_BASE_PATH, outputDirectory, outputFile)
 
 	FileWriter.close(lock, os.path.join(globalParam.OUTPUT_BASE_PATH, outputDirectory), filePath, zoom_level)
-    # Start the long-running task in a background thread
-	thread = threading.Thread(target=process_end_download, args=(bounds, zoom_level, outputDirectory, outputFile, filePath, include_buildings))
-	thread.start()
+	# Queue the long-running generation on the job manager
+	try:
+		job = job_manager.submit(outputDirectory, process_end_download, bounds, zoom_level, outputDirectory, outputFile, filePath, include_buildings, chunks)
+	except JobQueueFull as e:
+		return jsonify({"code": 503, "message": f"Generation queue is full: {e}"})
 
-	return jsonify({"code": 200, "message": "Download ended"})
+	return jsonify({"code": 200, "message": "Download ended", "job_id": job.job_id})
 
 @app.route('/', defaults={'path': 'index.htm'})
 @app.route('/<path:path>')
@@ -1,15 +1,26 @@
 import os
 import json
-import requests
+from itertools import chain
 import mapbox_vector_tile
+import numpy as np
 from pathlib import Path
 from typing import List, Tuple, Dict, Any
+import shapely
+from shapely import wkb
 from shapely.geometry import shape, mapping
 from shapely.ops import unary_union
 from utils.param import globalParam
 from utils.maptileUtils import maptile_utiles
-import mercantile
-from multiprocessing import Pool, cpu_count
+from utils.tileFetcher import TileFetcher, RateLimiter
+from utils.negativeTileCache import NegativeTileCache
+from utils.fileWriter import FileWriter
+from utils import metrics
+import geopandas as gpd
+from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
+
+# Area buildings are kept in, set in each decode worker by _init_decode_worker
+_decode_boundary = None
 
 class BuildingDownloader:
     """
@@ -25,10 +36,17 @@ class BuildingDownloader:
             api_key: Mapbox API key. If None, uses the global parameter.
         """
 
+    # Only this layer of the streets tileset is ever decoded
+    BUILDING_LAYER = "building"
+
     @staticmethod
-    def download_tile(zoom : int, x: int, y: int, output_dir: str) -> Dict[str, Any]:
+    def download_tile(zoom : int, x: int, y: int, output_dir: str) -> int:
         """
-        Download a single vector tile containing building data and convert to GeoJSON.
+        Download a single vector tile and store the raw PBF as <output_dir>/<y>.pbf.
+
+        The tile is decoded later, when its buildings are read. With
+        BUILDING_DEBUG_JSON enabled the fully decoded tile is also written as JSON.
+        Tiles the provider does not have are recorded in the negative tile cache.
 
         Args:
             x: Tile X coordinate
@@ -36,30 +54,92 @@ class BuildingDownloader:
             z: Zoom level
 
         Returns:
-            GeoJSON FeatureCollection with building polygons
+            Number of bytes fetched, 0 if the download failed
         """
         base_url = "https://api.mapbox.com/v4/mapbox.mapbox-streets-v8"
 
         url = f"{base_url}/{zoom}/{x}/{y}.vector.pbf?access_token={globalParam.MAPBOX_API_KEY}"
 
         try:
-            response = requests.get(url, timeout=30)
-            response.raise_for_status()
-
-            # Decode the Protocol Buffer vector tile
-            tile_data = mapbox_vector_tile.decode(response.content)
-            json.dump(tile_data, open(f"{output_dir}/{y}.json", "w"), indent=2)  # For debugging
-            # Convert to GeoJSON
+            result = TileFetcher.shared().fetch(url, source="vector")
+            if NegativeTileCache.is_missing_response(result.status, result.content):
+                NegativeTileCache.shared().record("vector", zoom, x, y, result.status)
+                return 0
+            if not result.ok:
+                raise ConnectionError(result.error)
+
+            FileWriter.writeAtomic(os.path.join(output_dir, f"{y}.pbf"), result.content)
+            if globalParam.BUILDING_DEBUG_JSON:
+                with open(os.path.join(output_dir, f"{y}.json"), "w") as debug_file:
+                    json.dump(mapbox_vector_tile.decode(result.content), debug_file, indent=2)
+            return len(result.content)
         except Exception as e:
             print(f"Error while downloading tile {zoom}/{x}/{y}: {e}")
-            return {"type": "FeatureCollection", "features": []}
+            return 0
+
+    @staticmethod
+    def _download_tile_task(args: tuple, bandwidth: RateLimiter = None) -> int:
+        nbytes = BuildingDownloader.download_tile(*args)
+        if bandwidth is not None:
+            bandwidth.consume(nbytes)
+        return nbytes
+
+    @staticmethod
+    def decode_building_layer(pbf_data: bytes) -> Dict[str, Any]:
+        """
+        Decode only the building layer of a vector tile.
+
+        Args:
+            pbf_data: Raw vector tile
+
+        Returns:
+            Decoded building layer, or None if the tile has none
+        """
+        tile = mapbox_vector_tile.decoder.TileData(pbf_data)
+        # Drop the other layers before decoding, their features are never used
+        for index in reversed(range(len(tile.tile.layers))):
+            if tile.tile.layers[index].name != BuildingDownloader.BUILDING_LAYER:
+                del tile.tile.layers[index]
+        return tile.get_message().get(BuildingDownloader.BUILDING_LAYER)
+
+    @staticmethod
+    def _init_decode_worker(boundary_wkb: bytes) -> None:
+        global _decode_boundary
+        _decode_boundary = wkb.loads(boundary_wkb)
+        shapely.prepare(_decode_boundary)
+
+    @staticmethod
+    def _decode_tile_task(args: tuple) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Decode one stored tile and keep the buildings inside the boundary.
+
+        Runs in a decode worker, see _init_decode_worker.
+
+        Args:
+            args: (tile_path, x, y, zoom)
+
+        Returns:
+            (feature id, GeoJSON feature) pairs in tile order
+        """
+        tile_path, x, y, zoom = args
+        downloader = BuildingDownloader()
+        features = downloader._tile_to_geojson(tile_path, x, y, zoom)["features"]
+        if not features:
+            return []
+        # One vectorized test of all buildings against the prepared boundary
+        geometries = [shape(feature["geometry"]) for feature in features]
+        inside = shapely.intersects(geometries, _decode_boundary)
+        return [
+            (downloader._get_feature_id(feature), feature)
+            for feature, keep in zip(features, inside) if keep
+        ]
 
     def _tile_to_geojson(self, tile_path: str, x: int, y: int, z: int) -> Dict[str, Any]:
         """
-        Convert decoded vector tile data to GeoJSON.
+        Decode the building layer of a stored vector tile to GeoJSON.
 
         Args:
-            tile_data: Decoded vector tile data
+            tile_path: Path to the raw PBF tile
             x: Tile X coordinate
             y: Tile Y coordinate
             z: Zoom level
@@ -69,38 +149,90 @@ class BuildingDownloader:
         """
         features = []
 
-        tile_data = json.load(open(tile_path, "r"))
-        #print(f"Loaded tile data from {tile_path}")
+        with open(tile_path, "rb") as tile_file:
+            building_layer = self.decode_building_layer(tile_file.read())
         # Check if building layer exists
-        if 'building' not in tile_data:
+        if building_layer is None:
             return {"type": "FeatureCollection", "features": []}
 
-        building_layer = tile_data['building']
         extent = building_layer.get('extent', 4096)
 
-        ############### use map utils pkg for the same ##########
-        # Get tile bounds for coordinate conversion
-        bounds = mercantile.bounds(x, y, z)
-
-        for feature in building_layer.get('features', []):
-            # Convert tile coordinates to lat/lon
-            geojson_feature = self._feature_to_geojson(
-                feature, bounds, extent
-            )
-            if geojson_feature:
-                features.append(geojson_feature)
+        layer_features = [feature for feature in building_layer.get('features', []) if feature.get('geometry')]
+        # Convert the tile coordinates of the whole layer to lat/lon at once
+        layer_coords = self._tile_coords_to_lon_lat(
+            [feature['geometry']['coordinates'] for feature in layer_features], (x, y, z), extent
+        )
+        for feature, geojson_coords in zip(layer_features, layer_coords):
+            features.append(self._feature_to_geojson(feature, (x, y, z), extent, geojson_coords))
 
         return {"type": "FeatureCollection", "features": features}
 
-    def _feature_to_geojson(self, feature: Dict, bounds: mercantile.LngLatBbox,
-                           extent: int) -> Dict[str, Any]:
+    @staticmethod
+    def _tile_coords_to_lon_lat(geometries: List[list], tile: Tuple[int, int, int],
+                                extent: int) -> List[list]:
+        """
+        Convert the nested coordinates of many geometries from tile space to lon/lat.
+
+        All vertices are converted in one array operation, the nesting of every
+        geometry is kept.
+
+        Args:
+            geometries: GeoJSON style coordinates in tile space, one per geometry
+            tile: Tile as (x, y, zoom)
+            extent: Tile extent (usually 4096)
+
+        Returns:
+            Coordinates in lon/lat, one per geometry
+        """
+        sequences = []
+
+        # Replace every point sequence by its length, or None for a single point
+        def collect(coords):
+            if not coords:
+                return []
+            if isinstance(coords[0], (int, float)):
+                sequences.append([coords])
+                return None
+            if isinstance(coords[0][0], (int, float)):
+                sequences.append(coords)
+                return len(coords)
+            return [collect(c) for c in coords]
+
+        templates = [collect(coords) for coords in geometries]
+        if not sequences:
+            return templates
+
+        flat = chain.from_iterable(chain.from_iterable(sequences))
+        vertices = np.fromiter(flat, dtype=np.float64).reshape(-1, 2)
+        # mapbox-vector-tile library uses origin at bottom (y=0 at south)
+        x, y, zoom = tile
+        lons, lats = maptile_utiles.tile_fraction_to_lon_lat(x, y, zoom, vertices[:, 0] / extent, vertices[:, 1] / extent)
+        points = np.column_stack((lons, lats)).tolist()
+
+        offset = 0
+
+        def rebuild(template):
+            nonlocal offset
+            if template is None:
+                offset += 1
+                return points[offset - 1]
+            if isinstance(template, int):
+                offset += template
+                return points[offset - template:offset]
+            return [rebuild(t) for t in template]
+
+        return [rebuild(template) for template in templates]
+
+    def _feature_to_geojson(self, feature: Dict, tile: Tuple[int, int, int],
+                           extent: int, geojson_coords: list = None) -> Dict[str, Any]:
         """
         Convert a vector tile feature to GeoJSON.
 
         Args:
             feature: Vector tile feature
-            bounds: Tile bounds
+            tile: Tile as (x, y, zoom)
             extent: Tile extent (usually 4096)
+            geojson_coords: Coordinates already converted to lon/lat, if any
 
         Returns:
             GeoJSON feature
@@ -113,21 +245,8 @@ class BuildingDownloader:
 
         # Convert tile coordinates to geographic coordinates
         geom_type = geometry['type']
-        coordinates = geometry['coordinates']
-
-        def tile_to_lon(x):
-            return bounds.west + (x / extent) * (bounds.east - bounds.west)
-
-        def tile_to_lat(y):
-            # mapbox-vector-tile library uses origin at bottom (y=0 at south)
-            return bounds.south + (y / extent) * (bounds.north - bounds.south)
-
-        def convert_coords(coords):
-            if isinstance(coords[0], (int, float)):
-                return [tile_to_lon(coords[0]), tile_to_lat(coords[1])]
-            return [convert_coords(c) for c in coords]
-
-        geojson_coords = convert_coords(coordinates)
+        if geojson_coords is None:
+            geojson_coords = self._tile_coords_to_lon_lat([geometry['coordinates']], tile, extent)[0]
 
         return {
             "type": "Feature",
@@ -165,14 +284,32 @@ class BuildingDownloader:
             ]
         }
     
-    def download_buildings(
+    @staticmethod
+    def tile_range(bound_array: Dict[str, Any], zoom: int) -> Tuple[int, int, int, int]:
+        """
+        Inclusive range of the tiles covering the given bounds.
+
+        Returns:
+            (first x, last x, first y, last y)
+        """
+        nw_lat, nw_lon = map(float, bound_array["northwest"])
+        se_lat, se_lon = map(float, bound_array["southeast"])
+        return maptile_utiles.tile_range([nw_lon, se_lat, se_lon, nw_lat], zoom)
+
+    def download_tiles(
         self,
         bound_array: Dict[str, Any],
         zoom: int = globalParam.DEM_BUILDING_RESOLUTION,
-        output_directory: str = None
-    ) -> Dict[str, Any]:
+        output_directory: str = None,
+        progress=None,
+        workers: int = globalParam.TILE_DOWNLOAD_WORKERS,
+        bandwidth: RateLimiter = None,
+        executor=None
+    ) -> None:
         """
-        Download and read all buildings within the given bounds.
+        Download the vector tiles within the given bounds that are not stored yet.
+
+        Tiles are fetched on a thread pool since the work is network bound.
 
         Args:
             bound_array: {
@@ -180,23 +317,13 @@ class BuildingDownloader:
                 "southeast": [lat, lon]
             }
             zoom: Zoom level
-            output_directory: Directory to store tiles and optional output
-
-        Returns:
-            GeoJSON FeatureCollection with merged buildings
+            output_directory: Directory to store tiles
+            progress: Optional job receiving tile counts and fetched bytes
+            workers: Maximum number of tiles in flight, unused when executor is given
+            bandwidth: Optional limiter in bytes per second, shared with other downloads
+            executor: Optional pool shared with other downloads, a private one is used otherwise
         """
-
-        features_by_id = {}
-
-        # ---- Bounds → tile range (SOURCE OF TRUTH) ----
-        nw_lat, nw_lon = map(float, bound_array["northwest"])
-        se_lat, se_lon = map(float, bound_array["southeast"])
-
-        nw_tilex, nw_tiley = maptile_utiles.lat_lon_to_tile(nw_lat, nw_lon, zoom)
-        se_tilex, se_tiley = maptile_utiles.lat_lon_to_tile(se_lat, se_lon, zoom)
-
-        tilex_start, tilex_end = sorted((nw_tilex, se_tilex))
-        tiley_start, tiley_end = sorted((nw_tiley, se_tiley))
+        tilex_start, tilex_end, tiley_start, tiley_end = self.tile_range(bound_array, zoom)
 
         # ---- Directory setup ----
         maptile_utiles.dir_check(output_directory)
@@ -204,20 +331,79 @@ class BuildingDownloader:
         maptile_utiles.dir_check(zoom_dir)
 
         # ---- Prepare download tasks ----
+        misses = NegativeTileCache.shared()
         tasks = []
         for x in range(tilex_start, tilex_end + 1):
             x_dir = os.path.join(zoom_dir, str(x))
             maptile_utiles.dir_check(x_dir)
             for y in range(tiley_start, tiley_end + 1):
-                tile_path = os.path.join(x_dir, f"{y}.json")
-                if not os.path.isfile(tile_path):
+                tile_path = os.path.join(x_dir, f"{y}.pbf")
+                if not os.path.isfile(tile_path) and not misses.is_missing("vector", zoom, x, y):
                     tasks.append((zoom, x, y, x_dir))
 
         # ---- Download missing tiles ----
-        if tasks:
-            print(f"Downloading {len(tasks)} tiles…")
-            with Pool(processes=cpu_count()) as pool:
-                pool.starmap(BuildingDownloader.download_tile, tasks)
+        if progress is not None:
+            progress.set_total(len(tasks))
+        if not tasks:
+            return
+        print(f"Downloading {len(tasks)} tiles…")
+        owned = executor is None
+        if owned:
+            executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="vector")
+        futures = []
+        try:
+            futures = [executor.submit(BuildingDownloader._download_tile_task, task, bandwidth) for task in tasks]
+            for future in futures:
+                nbytes = future.result()
+                if progress is not None:
+                    progress.advance(1, nbytes)
+                    progress.check_cancelled()
+        finally:
+            # Drop queued tiles of this download only, a shared pool keeps serving other jobs
+            for future in futures:
+                future.cancel()
+            if owned:
+                executor.shutdown(wait=False)
+
+        # Final retry pass for tiles that still failed after per-request retries
+        failed = [task for task in tasks if not os.path.isfile(os.path.join(task[3], f"{task[2]}.pbf"))
+                  and not misses.is_missing("vector", *task[:3], count=False)]
+        if failed:
+            print(f"Retrying {len(failed)} failed building tiles")
+            for task in failed:
+                BuildingDownloader._download_tile_task(task, bandwidth)
+
+    def download_buildings(
+        self,
+        bound_array: Dict[str, Any],
+        zoom: int = globalParam.DEM_BUILDING_RESOLUTION,
+        output_directory: str = None,
+        progress=None,
+        executor=None
+    ) -> Dict[str, Any]:
+        """
+        Download and read all buildings within the given bounds.
+
+        Args:
+            bound_array: {
+                "northwest": [lat, lon],
+                "southeast": [lat, lon]
+            }
+            zoom: Zoom level
+            output_directory: Directory to store tiles and optional output
+            progress: Optional job receiving tile counts and fetched bytes
+            executor: Optional download pool shared with other downloads
+
+        Returns:
+            GeoJSON FeatureCollection with merged buildings
+        """
+
+        fragments_by_id = {}
+
+        self.download_tiles(bound_array, zoom, output_directory, progress, executor=executor)
+        tilex_start, tilex_end, tiley_start, tiley_end = self.tile_range(bound_array, zoom)
+        zoom_dir = os.path.join(output_directory, str(zoom))
+        misses = NegativeTileCache.shared()
 
         boundary_geojson = self.bound_array_to_boundary_geojson(bound_array)
         true_boundary = unary_union([
@@ -225,42 +411,47 @@ class BuildingDownloader:
             for f in boundary_geojson["features"]
             if f.get("geometry")
         ])
-        # ---- READ tiles ONE BY ONE (important part) ----
+
+        decode_tasks = []
         for x in range(tilex_start, tilex_end + 1):
             for y in range(tiley_start, tiley_end + 1):
-                tile_path = os.path.join(zoom_dir, str(x), f"{y}.json")
-
+                tile_path = os.path.join(zoom_dir, str(x), f"{y}.pbf")
                 if not os.path.isfile(tile_path):
-                    print(f"Warning: Missing tile file {tile_path}")
+                    # Tiles the provider does not have hold no buildings
+                    if not misses.is_missing("vector", zoom, x, y, count=False):
+                        print(f"Warning: Missing tile file {tile_path}")
                     continue  # failed or missing tile
+                decode_tasks.append((tile_path, x, y, zoom))
+
+        # ---- Decode tiles in parallel, group building fragments by ID as tiles arrive ----
+        # imap keeps tile order so every group lists its fragments in tile order
+        workers = max(1, min(globalParam.BUILDING_DECODE_WORKERS, len(decode_tasks)))
+        if workers > 1:
+            pool = Pool(processes=workers, initializer=BuildingDownloader._init_decode_worker,
+                        initargs=(wkb.dumps(true_boundary),))
+            results = pool.imap(BuildingDownloader._decode_tile_task, decode_tasks,
+                                chunksize=max(1, len(decode_tasks) // (workers * 8)))
+        else:
+            pool = None
+            BuildingDownloader._init_decode_worker(wkb.dumps(true_boundary))
+            results = map(BuildingDownloader._decode_tile_task, decode_tasks)
 
-                # Convert tile → GeoJSON
-                tile_geojson = self._tile_to_geojson(tile_path, x, y, zoom)
-                #print(f"Processed tile {zoom}/{x}/{y} with {len(tile_geojson.get('features', []))} buildings")
-                if not tile_geojson or "features" not in tile_geojson:
-                    continue
-
-                # ---- Merge buildings by ID ----
-                for feature in tile_geojson["features"]:
-                    geom = shape(feature["geometry"])
-
-                    # ---- EARLY TRUE BOUNDARY FILTER ----
-                    if not geom.intersects(true_boundary):
-                        continue
-                    feature_id = self._get_feature_id(feature)
-
-                    if feature_id not in features_by_id:
-                        features_by_id[feature_id] = feature
-                    else:
-                        features_by_id[feature_id] = self._merge_building_features(
-                            features_by_id[feature_id],
-                            feature
-                        )
-
-        # ---- Final GeoJSON ----
+        try:
+            for tile_features in results:
+                for feature_id, feature in tile_features:
+                    fragments_by_id.setdefault(feature_id, []).append(feature)
+        finally:
+            if pool is not None:
+                worker_pids = [process.pid for process in pool._pool]
+                pool.close()
+                pool.join()
+                for pid in worker_pids:
+                    metrics.mark_process_dead(pid)
+
+        # ---- Final GeoJSON, buildings split across tiles are unioned once ----
         geojson = {
             "type": "FeatureCollection",
-            "features": list(features_by_id.values())
+            "features": [self._merge_building_features(fragments) for fragments in fragments_by_id.values()]
         }
 
         geojson = self._filter_extrudable_buildings(geojson)
@@ -290,24 +481,22 @@ class BuildingDownloader:
 
         return str(hash(json.dumps(feature)))
 
-    def _merge_building_features(self, feature1: Dict[str, Any], feature2: Dict[str, Any]) -> Dict[str, Any]:
+    def _merge_building_features(self, fragments: List[Dict[str, Any]]) -> Dict[str, Any]:
         """
-        Merge two building features that represent the same building split across tiles.
+        Merge the fragments of a building split across tiles.
 
         Args:
-            feature1: First GeoJSON feature
-            feature2: Second GeoJSON feature (same building, different tile)
+            fragments: GeoJSON features of the same building, one per tile
 
         Returns:
             Merged GeoJSON feature with combined geometry
         """
+        feature1 = fragments[0]
+        if len(fragments) == 1:
+            return feature1
         try:
-            # Convert GeoJSON to shapely geometries
-            geom1 = shape(feature1["geometry"])
-            geom2 = shape(feature2["geometry"])
-
-            # Union the geometries to merge them
-            merged_geom = unary_union([geom1, geom2])
+            # Union all fragments at once
+            merged_geom = unary_union([shape(fragment["geometry"]) for fragment in fragments])
 
             # Convert back to GeoJSON
             merged_feature = {
@@ -387,27 +576,38 @@ class BuildingDownloader:
 
 
 
-def download_steetmap_data(bound_array, output_directory, model_path, zoom_level: int =globalParam.DEM_BUILDING_RESOLUTION) :
+def download_steetmap_data(bound_array, output_directory, model_path, zoom_level: int =globalParam.DEM_BUILDING_RESOLUTION, progress=None, executor=None) :
     #try:
     downloader = BuildingDownloader()
     
     # Download buildings at zoom 15 (good detail for buildings)
     street_map_path = os.path.join(model_path,
-        'buildings.geojson'
+        'buildings.fgb'
     )
     buildings_geojson = downloader.download_buildings(
         bound_array=bound_array,
         zoom=zoom_level,
-        output_directory=output_directory
+        output_directory=output_directory,
+        progress=progress,
+        executor=executor
     )
     # Print statistics
     stats = downloader.get_building_stats(buildings_geojson)
     # Save to file if path provided
     if not os.path.exists(model_path):
         os.makedirs(model_path)
-    with open(street_map_path, 'w') as f:
-        json.dump(buildings_geojson, f, indent=2)
+    # FlatGeobuf is read back by the building mesh generator without parsing text
+    if buildings_geojson["features"]:
+        buildings = gpd.GeoDataFrame.from_features(buildings_geojson["features"], crs="EPSG:4326")
+    else:
+        buildings = gpd.GeoDataFrame(geometry=[], crs="EPSG:4326")
+    buildings.to_file(street_map_path, driver="FlatGeobuf")
     print(f"Saved buildings to {street_map_path}")
+    if globalParam.BUILDING_GEOJSON_EXPORT:
+        geojson_path = os.path.join(model_path, 'buildings.geojson')
+        with open(geojson_path, 'w') as f:
+            json.dump(buildings_geojson, f, indent=2)
+        print(f"Saved buildings to {geojson_path}")
     print(f"Buildings downloaded: {stats['total_buildings']}")
     print(f"Buildings with height data: {stats['buildings_with_height']}")
     if stats['buildings_with_height'] > 0:
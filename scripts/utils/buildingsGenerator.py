@@ -164,7 +164,8 @@ class GeoJSONToDAE:
 
     # ---------------- PIPELINE ----------------
     def load(self) -> gpd.GeoDataFrame:
-        print(f"Loading GeoJSON: {self.input_geojson}")
+        # Any format GDAL reads, the pipeline hands over FlatGeobuf
+        print(f"Loading buildings: {self.input_geojson}")
         gdf = gpd.read_file(self.input_geojson)
         return self.prepare_geodata(gdf)
 
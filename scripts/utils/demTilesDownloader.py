@@ -1,29 +1,27 @@
-﻿from urllib import request
-import numpy as np
-import cv2
-import os
+﻿import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from utils.maptileUtils import maptile_utiles
-from multiprocessing import Pool, cpu_count
+from utils.elevationStore import ElevationTileStore
 from utils.param import globalParam
+from utils.tileFetcher import TileFetcher, RateLimiter
+from utils.negativeTileCache import NegativeTileCache
 
-def fetch_image_from_url(url : str):
+# Failure reason of tiles the provider does not have, as opposed to failed fetches
+MISSING_AT_SOURCE = "Missing at source"
+
+def fetch_image_from_url(url : str, deadline: float = globalParam.DEM_FETCH_DEADLINE):
     """
-    Fetch an image from a URL and decode it into a NumPy array.
+    Fetch the encoded image at a URL.
     Args:
         url (str): The URL of the image to fetch.
+        deadline (float): Seconds allowed for all attempts.
     Returns:
-        np.ndarray: The decoded image as a NumPy array, or None if the download fails
+        tuple: The response body or None if the download fails, the failure reason and the HTTP status.
     """
-    try:
-        resp = request.urlopen(url)
-        img = np.asarray(bytearray(resp.read()), dtype="uint8")
-        img = cv2.imdecode(img, cv2.IMREAD_ANYCOLOR)
-        if img is None:
-            raise ValueError("Failed to decode image from URL.")
-        return img
-    except Exception as e:
-        print(f"Failed to download or decode image from {url}: {e}")
-        return None
+    result = TileFetcher.shared().fetch(url, deadline=deadline, source="dem")
+    if not result.ok:
+        return None, result.error, result.status
+    return result.content, None, result.status
 
 def check_dem_file(image_file : str) -> bool:
     """
@@ -38,65 +36,131 @@ def check_dem_file(image_file : str) -> bool:
     return False
 
 
-def download_tile_image(args : tuple)-> None:
+def download_tile_image(args : tuple, rate_limiter: RateLimiter = None, bandwidth: RateLimiter = None) -> tuple:
     """
-    Download a single DEM tile image and save it to the specified directory.
+    Download a single DEM tile into the elevation store.
     Args:
-        args (tuple): A tuple containing zoom level, x tile number, y tile number,
+        args (tuple): A tuple containing zoom level, x tile number, y tile number and the ElevationTileStore.
+        rate_limiter (RateLimiter): Optional limiter shared by all downloads.
+        bandwidth (RateLimiter): Optional limiter in bytes per second shared by all downloads.
     Retuns:
-        None
+        tuple: Number of bytes fetched and the failure reason, None on success.
     """
-    zoom, x, y, output_dir = args
+    zoom, x, y, store = args
     tile_url = (
         f"https://api.mapbox.com/raster/v1/mapbox.mapbox-terrain-dem-v1/"
         f"{zoom}/{x}/{y}.webp?sku=101CUGorpzzyK&access_token={globalParam.MAPBOX_API_KEY}"
     )
-    img = fetch_image_from_url(tile_url)
-    if img is not None:
-        file_path = os.path.join(output_dir, f"{y}.png")
-        cv2.imwrite(file_path, img)
-    else:
-        print(f"[WARN] Skipped tile ({x}, {y}) due to download error.")
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+    data, error, status = fetch_image_from_url(tile_url)
+    if bandwidth is not None and data is not None:
+        bandwidth.consume(len(data))
+    if NegativeTileCache.is_missing_response(status, data):
+        NegativeTileCache.shared().record("dem", zoom, x, y, status)
+        return 0, MISSING_AT_SOURCE
+    if data is None:
+        return 0, error
 
-def download_dem_data(bound_array, output_directory, zoom_range: tuple = (globalParam.DEM_RESOLUTION,globalParam.DEM_RESOLUTION)) -> None:
+    try:
+        store.put_encoded(zoom, x, y, data)
+    except ValueError as e:
+        return len(data), str(e)
+    return len(data), None
+
+def download_dem_data(bound_array, output_directory, zoom_range: tuple = (globalParam.DEM_RESOLUTION,globalParam.DEM_RESOLUTION), progress=None,
+                      workers: int = globalParam.DEM_DOWNLOAD_WORKERS, rate_limit: float = globalParam.DEM_RATE_LIMIT,
+                      bandwidth: RateLimiter = None, executor=None) -> list:
     """
     Download DEM data for a specified bounding box and zoom range.
+
+    Tiles are fetched by a bounded thread pool since the work is network bound.
+    The number of tiles in flight and the request rate are capped independently
+    of the core count. Tiles that fail are retried once after the first pass,
+    tiles the provider does not have are neither retried nor requested again
+    until their negative cache record expires.
+
     Args:
         bound_array (str): A string containing the bounding box coordinates in the format "lat1,lon1,lat2,lon2".
-        output_directory (str): The directory where the downloaded DEM tiles will be saved.
+        output_directory (str): Root of the ElevationTileStore receiving the decoded tiles.
         zoom_range (tuple): A tuple specifying the zoom levels to download (default is (10, 11)).
+        progress (Job): Optional job receiving tile counts and fetched bytes.
+        workers (int): Maximum number of tiles in flight, unused when executor is given.
+        rate_limit (float): Maximum requests per second to the provider across all
+            downloads of the process, 0 disables the limit.
+        bandwidth (RateLimiter): Optional limiter in bytes per second, shared with other downloads.
+        executor (Executor): Optional pool shared with other downloads, a private
+            one with workers threads is used otherwise.
     Returns:
-        None    
+        list: (zoom, x, y, reason) of every tile that could not be downloaded, the
+        reason is MISSING_AT_SOURCE for tiles the provider does not have.
     """
-    try:
-        tasks = []
-        nw_lat, nw_lon = map(float, bound_array["northwest"])
-        se_lat, se_lon = map(float, bound_array["southeast"])
-        maptile_utiles.dir_check(output_directory)
-
-        for zoom in range(zoom_range[0], zoom_range[1] + 1):
-            nw_tilex, nw_tiley = maptile_utiles.lat_lon_to_tile(nw_lat, nw_lon, zoom)
-            se_tilex, se_tiley = maptile_utiles.lat_lon_to_tile(se_lat, se_lon, zoom)
+    tasks = []
+    missing = []
+    misses = NegativeTileCache.shared()
+    nw_lat, nw_lon = map(float, bound_array["northwest"])
+    se_lat, se_lon = map(float, bound_array["southeast"])
+    store = ElevationTileStore(output_directory)
 
-            tilex_start, tilex_end = sorted((nw_tilex, se_tilex))
-            tiley_start, tiley_end = sorted((nw_tiley, se_tiley))
+    for zoom in range(zoom_range[0], zoom_range[1] + 1):
+        # Prepare all tile args
+        for x, y in maptile_utiles.get_tile_range([nw_lon, se_lat, se_lon, nw_lat], zoom):
+            if check_dem_file(store.path(zoom, x, y)):
+                continue
+            if misses.is_missing("dem", zoom, x, y):
+                missing.append((zoom, x, y, MISSING_AT_SOURCE))
+            else:
+                tasks.append((zoom, x, y, store))
 
-            zoom_dir = os.path.join(output_directory, str(zoom))
-            maptile_utiles.dir_check(zoom_dir)
+    if progress is not None:
+        progress.set_total(len(tasks))
 
-            # Prepare all tile args
-            for x in range(tilex_start, tilex_end + 1):
-                x_dir = os.path.join(zoom_dir, str(x))
-                maptile_utiles.dir_check(x_dir)
-                for y in range(tiley_start, tiley_end + 1):
-                    dem_file = os.path.join(x_dir, f"{y}.png")
-                    if not check_dem_file(dem_file):
-
-                        tasks.append((zoom, x, y, x_dir))
+    # One limiter for the provider, concurrent jobs share its request rate
+    rate_limiter = RateLimiter.shared("dem", rate_limit)
+    given_up = []
+    futures = {}
+    owned = executor is None
+    if owned:
+        executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="dem")
+    try:
+        for attempt in range(2):
+            futures = {executor.submit(download_tile_image, task, rate_limiter, bandwidth): task for task in tasks}
+            retry = []
+            for future in as_completed(futures):
+                task = futures[future]
+                try:
+                    nbytes, error = future.result()
+                except Exception as e:
+                    nbytes, error = 0, str(e)
+                if error is not None and error != MISSING_AT_SOURCE and attempt == 0:
+                    retry.append(task)
+                else:
+                    # Tiles are counted once they are stored or given up on, missing ones are never retried
+                    if error is not None:
+                        given_up.append((task, error))
+                    if progress is not None:
+                        progress.advance(1, nbytes)
+                if progress is not None:
+                    progress.check_cancelled()
 
-            # Use multiprocessing
-        with Pool(processes=cpu_count()) as pool:  # You can tune the number here
-            pool.map(download_tile_image, tasks)
+            # Final retry pass for tiles that still failed after per-request retries
+            tasks = retry
+            if not tasks:
+                break
+            if attempt == 0:
+                print(f"Retrying {len(tasks)} failed DEM tiles")
+    finally:
+        # Drop queued tiles of this download only, a shared pool keeps serving other jobs
+        for future in futures:
+            future.cancel()
+        if owned:
+            executor.shutdown(wait=False)
 
-    except Exception as e:
-        print(f"Download failed: {e}")
+    failed = missing + [(zoom, x, y, error) for (zoom, x, y, _), error in given_up]
+    if failed:
+        print(f"[WARN] {len(failed)} DEM tiles could not be downloaded:")
+        for zoom, x, y, error in failed[:10]:
+            print(f"  {zoom}/{x}/{y}: {error}")
+        if len(failed) > 10:
+            print(f"  ... and {len(failed) - 10} more")
+    return failed
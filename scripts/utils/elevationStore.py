@@ -0,0 +1,323 @@
+import io
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from utils.maptileUtils import maptile_utiles
+from utils.tileStore import DirectoryTileStore
+from utils.param import globalParam
+
+
+class ElevationTileStore(DirectoryTileStore):
+    """
+    DEM tiles keyed by z/x/y, read back as int32 elevation grids.
+
+    With the "elevation" storage tiles are decoded once when stored and kept as
+    <root>/<z>/<x>/<y>.npy, read back memory-mapped without any conversion.
+    With the "webp" storage the fetched bytes are kept unchanged as
+    <root>/<z>/<x>/<y>.webp and only decoded when the elevations are read.
+
+    Values are decimetres above mean sea level, the native resolution of the
+    Mapbox Terrain-RGB encoding.
+    """
+
+    # Metres per stored unit
+    SCALE = 0.1
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, root: str = globalParam.DEM_PATH, storage: str = globalParam.DEM_STORAGE,
+                 cache_tiles: int = globalParam.DEM_TILE_CACHE_SIZE):
+        if storage not in ("elevation", "webp"):
+            raise ValueError(f"Unknown DEM storage: {storage}")
+        super().__init__(root, "npy" if storage == "elevation" else "webp")
+        self.storage = storage
+        # Tiles read by point lookups, least recently used first
+        self.cache_tiles = cache_tiles
+        self._tiles = OrderedDict()
+        self._tiles_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, root: str = globalParam.DEM_PATH, storage: str = globalParam.DEM_STORAGE) -> "ElevationTileStore":
+        """
+        Return the process wide store of a root, so point lookups share one tile cache.
+        """
+        with cls._shared_lock:
+            key = (root, storage)
+            if key not in cls._shared:
+                cls._shared[key] = cls(root, storage)
+            return cls._shared[key]
+
+    @staticmethod
+    def decode_terrain_rgb(img: np.ndarray) -> np.ndarray:
+        """
+        Decode a Terrain-RGB tile to elevation.
+
+        reference : https://docs.mapbox.com/data/tilesets/reference/mapbox-terrain-dem-v1/
+
+        Args:
+            img (np.ndarray): Tile as decoded by OpenCV, in BGR channel order.
+
+        Returns:
+            np.ndarray: int32 elevation grid in decimetres.
+        """
+        b = img[:, :, 0].astype(np.int32)
+        g = img[:, :, 1].astype(np.int32)
+        r = img[:, :, 2].astype(np.int32)
+        r <<= 16
+        g <<= 8
+        r |= g
+        r |= b
+        r -= 100000
+        return r
+
+    @staticmethod
+    def decode_image(data: bytes) -> np.ndarray:
+        """
+        Decode an encoded Terrain-RGB tile to elevation.
+
+        Raises:
+            ValueError: If the data cannot be decoded.
+        """
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError("Failed to decode image")
+        return ElevationTileStore.decode_terrain_rgb(img)
+
+    def put_encoded(self, z: int, x: int, y: int, data: bytes) -> None:
+        """
+        Store a tile as fetched from the provider.
+
+        Raises:
+            ValueError: If the data is not a valid tile.
+        """
+        if self.storage == "webp":
+            # Only the container is checked, pixels are decoded when read
+            if data[:4] != b"RIFF" or data[8:12] != b"WEBP":
+                raise ValueError("Not a WebP image")
+            self.put(z, x, y, data)
+        else:
+            self.put_elevation(z, x, y, self.decode_image(data))
+
+    def put_elevation(self, z: int, x: int, y: int, grid: np.ndarray) -> None:
+        buffer = io.BytesIO()
+        np.save(buffer, np.ascontiguousarray(grid, dtype=np.int32))
+        self.put(z, x, y, buffer.getvalue())
+
+    def get_elevation(self, z: int, x: int, y: int) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: int32 grid in decimetres, memory-mapped and read-only for the
+            "elevation" storage, or None if the tile is missing.
+        """
+        if self.storage == "webp":
+            data = self.get(z, x, y)
+            return None if data is None else self.decode_image(data)
+        try:
+            return np.load(self.path(z, x, y), mmap_mode="r")
+        except FileNotFoundError:
+            return None
+
+    def _cached_elevation(self, z: int, x: int, y: int) -> np.ndarray:
+        # Missing tiles are not cached, they may be downloaded later
+        key = (z, x, y)
+        with self._tiles_lock:
+            if key in self._tiles:
+                self._tiles.move_to_end(key)
+                return self._tiles[key]
+        grid = self.get_elevation(z, x, y)
+        if grid is not None and self.cache_tiles > 0:
+            with self._tiles_lock:
+                self._tiles[key] = grid
+                while len(self._tiles) > self.cache_tiles:
+                    self._tiles.popitem(last=False)
+        return grid
+
+    def elevations_at(self, lats, lons, zoom: int = globalParam.DEM_RESOLUTION, bilinear: bool = False) -> np.ndarray:
+        """
+        Elevation of many points.
+
+        Points are grouped by tile, every tile is read once through the tile
+        cache and sampled with one fancy-indexing operation. Within a tile the
+        pixel position is linear in latitude, as for the heightmap crop.
+
+        Args:
+            lats: Latitudes in degrees.
+            lons: Longitudes in degrees.
+            zoom (int): Zoom level of the DEM tiles.
+            bilinear (bool): Interpolate between the four nearest pixel centres
+                instead of taking the pixel containing the point. Interpolation
+                does not cross tile edges.
+
+        Returns:
+            np.ndarray: Heights above mean sea level in metres, NaN where the tile is missing.
+        """
+        lats = np.clip(np.asarray(lats, dtype=np.float64).ravel(), -85.0511, 85.0511)
+        lons = np.asarray(lons, dtype=np.float64).ravel()
+        heights = np.full(lats.shape, np.nan)
+        if lats.size == 0:
+            return heights
+
+        tile_x, tile_y = maptile_utiles.lat_lon_to_tile_many(lats, lons, zoom)
+        lon_min, lat_min, lon_max, lat_max = maptile_utiles.tile_bounds_many(tile_x, tile_y, zoom)
+        u = (lons - lon_min) / (lon_max - lon_min)
+        v = (lat_max - lats) / (lat_max - lat_min)
+
+        tiles, groups = np.unique(np.stack([tile_x, tile_y], axis=1), axis=0, return_inverse=True)
+        groups = groups.ravel()
+        for index, (x, y) in enumerate(tiles):
+            grid = self._cached_elevation(zoom, int(x), int(y))
+            if grid is None:
+                continue
+            points = np.nonzero(groups == index)[0]
+            height, width = grid.shape
+            px = u[points] * width
+            py = v[points] * height
+            if not bilinear:
+                cols = np.clip(np.floor(px), 0, width - 1).astype(np.int64)
+                rows = np.clip(np.floor(py), 0, height - 1).astype(np.int64)
+                heights[points] = grid[rows, cols] * self.SCALE
+                continue
+
+            px = np.clip(px - 0.5, 0, width - 1)
+            py = np.clip(py - 0.5, 0, height - 1)
+            col0 = np.floor(px).astype(np.int64)
+            row0 = np.floor(py).astype(np.int64)
+            col1 = np.minimum(col0 + 1, width - 1)
+            row1 = np.minimum(row0 + 1, height - 1)
+            wx = px - col0
+            wy = py - row0
+            top = grid[row0, col0] * (1 - wx) + grid[row0, col1] * wx
+            bottom = grid[row1, col0] * (1 - wx) + grid[row1, col1] * wx
+            heights[points] = (top * (1 - wy) + bottom * wy) * self.SCALE
+        return heights
+
+    def elevation_at(self, lat: float, lon: float, zoom: int = globalParam.DEM_RESOLUTION,
+                     bilinear: bool = False) -> float:
+        """
+        Elevation of a single point, see elevations_at().
+
+        Returns:
+            float: Height above mean sea level in metres, or None if the tile is missing.
+        """
+        height = self.elevations_at([lat], [lon], zoom, bilinear)[0]
+        return None if np.isnan(height) else float(height)
+
+    def tile_shape(self, zoom: int, x_range: tuple, y_range: tuple) -> tuple:
+        """
+        Height and width of the tiles of an inclusive tile range, read from the first stored one.
+
+        Raises:
+            FileNotFoundError: If no tile of the range is stored.
+        """
+        for y in range(y_range[0], y_range[1] + 1):
+            for x in range(x_range[0], x_range[1] + 1):
+                tile = self.get_elevation(zoom, x, y)
+                if tile is not None:
+                    return tile.shape
+        raise FileNotFoundError(f"No DEM tile of {zoom}/{x_range[0]}-{x_range[1]}/{y_range[0]}-{y_range[1]} is stored")
+
+    def mosaic(self, zoom: int, x_range: tuple, y_range: tuple,
+               workers: int = globalParam.MOSAIC_DECODE_WORKERS, fill: int = None) -> np.ndarray:
+        """
+        Assemble the tiles of an inclusive tile range into one grid.
+
+        The grid is allocated once and tiles are read into their slices on a
+        thread pool, which matters for the "webp" storage where every tile is
+        decoded.
+
+        Args:
+            zoom (int): Zoom level.
+            x_range (tuple): First and last tile x.
+            y_range (tuple): First and last tile y.
+            workers (int): Number of reading threads.
+            fill (int): Elevation in decimetres of missing tiles, None to raise instead.
+
+        Returns:
+            np.ndarray: int32 elevation grid in decimetres.
+
+        Raises:
+            FileNotFoundError: If a tile of the range is missing and no fill is given.
+        """
+        tile_h, tile_w = self.tile_shape(zoom, x_range, y_range)
+        grid = np.empty(((y_range[1] - y_range[0] + 1) * tile_h,
+                         (x_range[1] - x_range[0] + 1) * tile_w), dtype=np.int32)
+        missing = []
+
+        def place(task):
+            col, row = task
+            x, y = x_range[0] + col, y_range[0] + row
+            tile = self.get_elevation(zoom, x, y)
+            if tile is None:
+                if fill is None:
+                    raise FileNotFoundError(f"DEM tile {zoom}/{x}/{y} is missing")
+                missing.append((x, y))
+                tile = fill
+            grid[row * tile_h:(row + 1) * tile_h, col * tile_w:(col + 1) * tile_w] = tile
+
+        tasks = [(col, row) for col in range(x_range[1] - x_range[0] + 1) for row in range(y_range[1] - y_range[0] + 1)]
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="dem-mosaic") as executor:
+            # Consuming the results re-raises a missing tile
+            for _ in executor.map(place, tasks):
+                pass
+        if missing:
+            print(f"[WARN] {len(missing)} DEM tiles missing, filled at {fill * self.SCALE:g} m, first: "
+                  + ", ".join(f"{zoom}/{x}/{y}" for x, y in sorted(missing)[:3]))
+        return grid
+
+    def read_window(self, zoom: int, x_range: tuple, y_range: tuple, rows: tuple, cols: tuple,
+                    tile_shape: tuple = None, workers: int = globalParam.MOSAIC_DECODE_WORKERS,
+                    fill: int = None) -> np.ndarray:
+        """
+        Read a window of the grid mosaic() would assemble, touching only the tiles it overlaps.
+
+        Missing tiles are filled without a warning, windows are read repeatedly
+        and the caller reports them once.
+
+        Args:
+            zoom (int): Zoom level.
+            x_range (tuple): First and last tile x of the mosaic.
+            y_range (tuple): First and last tile y of the mosaic.
+            rows (tuple): First and past the last row of the window, in mosaic pixels.
+            cols (tuple): First and past the last column of the window, in mosaic pixels.
+            tile_shape (tuple): Tile height and width, read from the first stored tile if not given.
+            workers (int): Number of reading threads.
+            fill (int): Elevation in decimetres of missing tiles, None to raise instead.
+
+        Returns:
+            np.ndarray: int32 elevation grid in decimetres.
+
+        Raises:
+            FileNotFoundError: If a tile overlapped by the window is missing and no fill is given.
+        """
+        def load(x, y):
+            # Decoded tiles go through the tile cache, as consecutive windows share them
+            tile = self._cached_elevation(zoom, x, y) if self.storage == "webp" else self.get_elevation(zoom, x, y)
+            if tile is None:
+                if fill is None:
+                    raise FileNotFoundError(f"DEM tile {zoom}/{x}/{y} is missing")
+                return np.full(tile_shape, fill, dtype=np.int32)
+            return tile
+
+        if tile_shape is None:
+            tile_shape = self.tile_shape(zoom, x_range, y_range)
+        tile_h, tile_w = tile_shape
+        window = np.empty((rows[1] - rows[0], cols[1] - cols[0]), dtype=np.int32)
+
+        def place(task):
+            row, col = task
+            top, left = row * tile_h, col * tile_w
+            r0, r1 = max(rows[0], top), min(rows[1], top + tile_h)
+            c0, c1 = max(cols[0], left), min(cols[1], left + tile_w)
+            tile = load(x_range[0] + col, y_range[0] + row)
+            window[r0 - rows[0]:r1 - rows[0], c0 - cols[0]:c1 - cols[0]] = tile[r0 - top:r1 - top, c0 - left:c1 - left]
+
+        tasks = [(row, col)
+                 for row in range(rows[0] // tile_h, (rows[1] - 1) // tile_h + 1)
+                 for col in range(cols[0] // tile_w, (cols[1] - 1) // tile_w + 1)]
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="dem-window") as executor:
+            for _ in executor.map(place, tasks):
+                pass
+        return window
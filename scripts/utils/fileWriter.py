@@ -1,6 +1,7 @@
 import os
 import json
 import shutil
+import uuid
 from utils.param import globalParam
 
 
@@ -106,6 +107,86 @@ class FileWriter:
 
 		return
 
+	@staticmethod
+	def addTileData(lock, filePath, data, x, y, z):
+		'''
+        Write tile bytes to filePath atomically.
+
+        The data goes to a temporary file next to the destination which is then
+        renamed over it, so readers never see a partially written tile.
+
+        Args:
+            lock (multiprocessing.Lock): A lock for thread-safe operations.
+            filePath (str): The path to save the tile.
+            data (bytes): Encoded tile image.
+            x (int): X-coordinate.
+            y (int): Y-coordinate.
+            z (int): Z-coordinate.
+
+        Returns:
+            None
+		'''
+		fileDirectory = os.path.dirname(filePath)
+		FileWriter.ensureDirectory(lock, fileDirectory)
+
+		FileWriter.writeAtomic(filePath, data)
+
+		return
+
+	@staticmethod
+	def linkTile(lock, filePath, sourcePath, x, y, z):
+		'''
+        Hardlink a cached tile into place, copying when linking is not possible.
+
+        Args:
+            lock (multiprocessing.Lock): A lock for thread-safe operations.
+            filePath (str): The path to save the tile.
+            sourcePath (str): The cached tile to link.
+            x (int): X-coordinate.
+            y (int): Y-coordinate.
+            z (int): Z-coordinate.
+
+        Returns:
+            None
+		'''
+		fileDirectory = os.path.dirname(filePath)
+		FileWriter.ensureDirectory(lock, fileDirectory)
+
+		tempPath = f"{filePath}.{uuid.uuid4().hex[:8]}.tmp"
+		try:
+			try:
+				os.link(sourcePath, tempPath)
+			except OSError:
+				# Cross-device or filesystems without hardlinks
+				shutil.copyfile(sourcePath, tempPath)
+			os.replace(tempPath, filePath)
+		finally:
+			if os.path.exists(tempPath):
+				os.remove(tempPath)
+
+		return
+
+	@staticmethod
+	def writeAtomic(filePath, data):
+		'''
+        Write bytes to filePath through a temporary file and an atomic rename.
+
+        Args:
+            filePath (str): The destination path.
+            data (bytes): The content to write.
+
+        Returns:
+            None
+		'''
+		tempPath = f"{filePath}.{uuid.uuid4().hex[:8]}.tmp"
+		try:
+			with open(tempPath, "wb") as tempFile:
+				tempFile.write(data)
+			os.replace(tempPath, filePath)
+		finally:
+			if os.path.exists(tempPath):
+				os.remove(tempPath)
+
 	@staticmethod
 	def exists(filePath, x, y, z):
 		'''
@@ -127,7 +208,7 @@ class FileWriter:
 	@staticmethod
 	def close(lock, path, file, zoom_level):
 		'''
-        Placeholder method for closing and recalculating metadata.
+        Flush and close the tile store of a run.
 
         Args:
             lock (multiprocessing.Lock): A lock for thread-safe operations.
@@ -139,6 +220,9 @@ class FileWriter:
             None
 
 		'''
+		# Imported here as the tile stores build on FileWriter
+		from utils.tileStore import close_tile_store
+		close_tile_store(path)
 		#TODO recalculate bounds and center
 		return
 	
@@ -190,7 +274,7 @@ class FileWriter:
 		target.close()
 	
 	@staticmethod
-	def write_sdf_file(sdf_template,model_name,  size_x, size_y, size_z,pose_x,pose_y,origin_height,path,include_buildings):
+	def write_sdf_file(sdf_template,model_name,  size_x, size_y, size_z,pose_x,pose_y,origin_height,path,include_buildings,chunks=None):
 		'''
         Write an SDF file with the provided template and model details.
 
@@ -202,6 +286,8 @@ class FileWriter:
             size_z (float): The size in the z-direction.
             origin_height (float): The origin height.
             path (str): The directory path to save the SDF file.
+            chunks (list, optional): Terrain chunk sub-models to include, as dicts with
+                name, pose_x and pose_y relative to the model. Defaults to None.
 
         Returns:
             None
@@ -262,6 +348,14 @@ class FileWriter:
 			buildings_sdf_block = """"""
 		sdf_template = sdf_template.replace("$BUILDING$", buildings_sdf_block)
 
+		chunks_sdf_block = "".join(f"""
+        <include>
+          <uri>model://{chunk["name"]}</uri>
+          <name>{chunk["name"]}</name>
+          <pose>{chunk["pose_x"]} {chunk["pose_y"]} 0 0 0 0</pose>
+        </include>""" for chunk in chunks or [])
+		sdf_template = sdf_template.replace("$CHUNKS$", chunks_sdf_block)
+
     	# Ensure results are a string
 		sdf_content = str(sdf_template)
     	# Open file
@@ -1,19 +1,21 @@
 import os
+import re
 import cv2
 import shutil
 import json
+from contextlib import contextmanager, nullcontext
 from utils.fileWriter import FileWriter
 from utils.param import globalParam
 from utils.maptileUtils import maptile_utiles
 from utils.buildingsGenerator import GeoJSONToDAE
 from utils.heightMapGenerator import HeightmapGenerator
 from utils.utils import ConcatImage
+from utils.tileStore import open_tile_store, close_tile_store
+from utils.profiler import StageProfiler
 from geopy.distance import geodesic
 from geopy.distance import distance
 from geopy.point import Point
-from multiprocessing import Pool, cpu_count
 from PIL import Image
-import rasterio
 
 
 class OrthoGenerator(ConcatImage):
@@ -21,64 +23,96 @@ class OrthoGenerator(ConcatImage):
         super().__init__(**kwargs)
 
 
-    def generate_ortho(self,path: str,zoomlevel,model_name,boundaries)-> None:
+    def generate_ortho(self,path: str,zoomlevel,model_name,boundaries,chunks: int = 1)-> None:
         """
         Generate the aerial image of the map.
 
         Args:
             path (str): Path to metadata.
+            chunks (int): Number of terrain chunks along each axis, above 1 the
+                image is split into one texture per chunk sub-model.
 
         Returns:
             None
         """
  
-        image_dir = os.path.join(path, str(zoomlevel))
         # Check and create necessary directories
         maptile_utiles.dir_check(os.path.join(globalParam.GAZEBO_MODEL_PATH, model_name, 'textures'),remove_existing=True)
-        maptile_utiles.dir_check(os.path.join(globalParam.TEMPORARY_SATELLITE_IMAGE, model_name),remove_existing=True)
+        self.reset_chunk_models(model_name, chunks)
         bound_array = boundaries.split(',')
         tile_boundaries = maptile_utiles.get_max_tilenumber(bound_array,zoomlevel)
-        image_dir_list = self.get_x_tile_directories(image_dir,tile_boundaries)
-
-
-        temp_output_dir = os.path.join(globalParam.TEMPORARY_SATELLITE_IMAGE, model_name)
-        args_list = [
-            (self, dir_name, image_dir, tile_boundaries, temp_output_dir)
-            for dir_name in image_dir_list
-        ]
-        #  Multiprocessing call
-        with Pool(processes=cpu_count()) as pool:
-            pool.map(OrthoGenerator._run_instance_method, args_list)
-
-        image_list = sorted([
-            os.path.join(temp_output_dir, img)
-            for img in os.listdir(temp_output_dir) if img.endswith('.png')
-        ])            
-        images = [cv2.imread(path) for path in image_list]
-        filtered_images = [images[0]]
-
-        for img in images[1:]:
-            if OrthoGenerator.are_dimensions_equal(filtered_images[-1], img):
-                filtered_images.append(img)
-        stitched_image = cv2.hconcat(filtered_images)
+        store = open_tile_store(path)
+        try:
+            stitched_image = self.mosaic(store, zoomlevel, tile_boundaries)
+        finally:
+            # The tiles are only read here, the store must not stay open for the life of the server
+            close_tile_store(path)
+        if stitched_image is None:
+            raise RuntimeError(f"No imagery tiles found in {path}")
 
         # Save the stitched image
         compression_params = [cv2.IMWRITE_PNG_COMPRESSION, 9]
-        cv2.imwrite(os.path.join(globalParam.GAZEBO_MODEL_PATH, model_name, 'textures', model_name+'_aerial.png'), stitched_image, compression_params)
+        if chunks == 1:
+            cv2.imwrite(os.path.join(globalParam.GAZEBO_MODEL_PATH, model_name, 'textures', model_name+'_aerial.png'), stitched_image, compression_params)
+            return
+
+        # Same fractions of the region as the heightmap chunks
+        rows = self.chunk_edges(stitched_image.shape[0], chunks, shared=False)
+        cols = self.chunk_edges(stitched_image.shape[1], chunks, shared=False)
+        for row in range(chunks):
+            for col in range(chunks):
+                name = self.chunk_name(model_name, row, col)
+                cv2.imwrite(os.path.join(globalParam.GAZEBO_MODEL_PATH, name, 'textures', name+'_aerial.png'),
+                            stitched_image[rows[row]:rows[row + 1], cols[col]:cols[col + 1]], compression_params)
+
+    def reset_chunk_models(self, model_name: str, chunks: int) -> None:
+        """
+        Remove the chunk sub-models of a previous generation and create empty ones.
+        """
+        pattern = re.compile(re.escape(model_name) + r"_chunk_\d+_\d+")
+        if os.path.isdir(globalParam.GAZEBO_MODEL_PATH):
+            for entry in os.listdir(globalParam.GAZEBO_MODEL_PATH):
+                if pattern.fullmatch(entry):
+                    shutil.rmtree(os.path.join(globalParam.GAZEBO_MODEL_PATH, entry), ignore_errors=True)
+        if chunks > 1:
+            for row in range(chunks):
+                for col in range(chunks):
+                    maptile_utiles.dir_check(os.path.join(globalParam.GAZEBO_MODEL_PATH, self.chunk_name(model_name, row, col), 'textures'))
 
 
 
 class GazeboTerrianGenerator(HeightmapGenerator,OrthoGenerator):
-    def __init__(self,tile_path:str,include_buildings: bool,**kwargs):
+    def __init__(self,tile_path:str,include_buildings: bool,chunks: int = globalParam.TERRAIN_CHUNKS,**kwargs):
         super().__init__(**kwargs)
         self.tile_path = tile_path
         self.include_buildings = include_buildings
+        self.chunks = max(1, int(chunks))
         with open(os.path.join(self.tile_path, 'metadata.json')) as f:
             data = json.load(f)
             self.boundaries = data["bounds"]
             self.launch_location = data["launch_location"]
             self.zoom_level = data["zoom_level"]
         self.model_name = os.path.basename(self.tile_path)
+        self.model_path = os.path.join(globalParam.GAZEBO_MODEL_PATH, self.model_name)
+        self.profiler = StageProfiler(os.path.join(self.model_path, 'generation_report.json'))
+        # Looked up once, the DEM does not change during a generation
+        self._true_origin = None
+        self._launch_location = None
+
+    @contextmanager
+    def _stage(self, name: str, inputs: list = (), outputs: list = ()):
+        """
+        Enter a named generation stage, reporting it to the owning job if any
+        and recording it in the generation report.
+
+        Args:
+            name (str): Stage name.
+            inputs (list): Paths read by the stage.
+            outputs (list): Paths written by the stage.
+        """
+        with self.job.stage(name) if self.job is not None else nullcontext():
+            with self.profiler.stage(name, inputs, outputs):
+                yield
 
 
     def get_origin_height(self)-> float:
@@ -106,6 +140,8 @@ class GazeboTerrianGenerator(HeightmapGenerator,OrthoGenerator):
             Returns:
                 dict: A dictionary containing latitude, longitude, and altitude of the origin.
         """
+        if self._true_origin is not None:
+            return dict(self._true_origin)
     
         bound_array = self.boundaries.split(',')
         boundaries = maptile_utiles.get_true_boundaries(bound_array,self.zoom_level)
@@ -114,11 +150,12 @@ class GazeboTerrianGenerator(HeightmapGenerator,OrthoGenerator):
         se = boundaries["southeast"]
         ne = boundaries["northeast"]
         origin_lon,origin_lat = float((se[1]+sw[1])/2),float((sw[0]+ne[0])/2) 
-        return {
+        self._true_origin = {
             "latitude": origin_lat,
             "longitude": origin_lon,
             "altitude": HeightmapGenerator.get_amsl(origin_lat, origin_lon)
         }
+        return dict(self._true_origin)
 
     def get_launch_location(self) -> list:
         """
@@ -127,13 +164,16 @@ class GazeboTerrianGenerator(HeightmapGenerator,OrthoGenerator):
         Returns:
             list: A list containing latitude and longitude of the launch location.
         """
+        if self._launch_location is not None:
+            return dict(self._launch_location)
         location_array = self.launch_location.split(',')
 
-        return {
+        self._launch_location = {
             "latitude": float(location_array[1]),
             "longitude": float(location_array[0]),
             "altitude": HeightmapGenerator.get_amsl(float(location_array[1]), float(location_array[0]))
             }
+        return dict(self._launch_location)
 
     def gen_sdf(self, size_x: float, size_y: float, size_z: float, pose_x: float, pose_y: float, pose_z: float, include_buildings : bool) -> None:
         """
@@ -153,7 +193,26 @@ class GazeboTerrianGenerator(HeightmapGenerator,OrthoGenerator):
         """
 
         template = FileWriter.read_template(os.path.join(globalParam.TEMPLATE_DIR_PATH ,'sdf_temp.txt'))
-        FileWriter.write_sdf_file(template, self.model_name, size_x, size_y, size_z,pose_x,pose_y,pose_z, os.path.join(globalParam.GAZEBO_MODEL_PATH, self.model_name),include_buildings)
+        if not self.terrain_chunks:
+            FileWriter.write_sdf_file(template, self.model_name, size_x, size_y, size_z,pose_x,pose_y,pose_z, os.path.join(globalParam.GAZEBO_MODEL_PATH, self.model_name),include_buildings)
+            return
+
+        # Every chunk is a model of its own, included by the terrain model at its offset from the centre
+        config_template = FileWriter.read_template(os.path.join(globalParam.TEMPLATE_DIR_PATH ,'config_temp.txt'))
+        chunk_includes = []
+        for chunk in self.terrain_chunks:
+            chunk_path = os.path.join(globalParam.GAZEBO_MODEL_PATH, chunk["name"])
+            chunk_size_x = round((chunk["x1"] - chunk["x0"]) * size_x, 2)
+            chunk_size_y = round((chunk["y1"] - chunk["y0"]) * size_y, 2)
+            FileWriter.write_sdf_file(template, chunk["name"], chunk_size_x, chunk_size_y, size_z, pose_x, pose_y, pose_z, chunk_path, False)
+            FileWriter.write_config_file(config_template, chunk["name"], chunk_path, "Gazebo 3d Terrian chunk")
+            chunk_includes.append({
+                "name": chunk["name"],
+                "pose_x": round(((chunk["x0"] + chunk["x1"]) / 2 - 0.5) * size_x, 2),
+                "pose_y": round((0.5 - (chunk["y0"] + chunk["y1"]) / 2) * size_y, 2),
+            })
+        template = FileWriter.read_template(os.path.join(globalParam.TEMPLATE_DIR_PATH ,'sdf_chunked_temp.txt'))
+        FileWriter.write_sdf_file(template, self.model_name, size_x, size_y, size_z,pose_x,pose_y,pose_z, os.path.join(globalParam.GAZEBO_MODEL_PATH, self.model_name),include_buildings,chunk_includes)
 
     def gen_config(self) -> None:
         """
@@ -291,26 +350,43 @@ class GazeboTerrianGenerator(HeightmapGenerator,OrthoGenerator):
 
         print("Map tiles directory being used : ",self.tile_path)
         if os.path.isfile(os.path.join(self.tile_path, 'metadata.json')) and self.tile_path != '':
-            self.generate_ortho(self.tile_path,self.zoom_level,self.model_name,self.boundaries)
+            textures_path = os.path.join(self.model_path, 'textures')
+            if self.chunks > 1:
+                # Chunk sub-models hold both the aerial and the heightmap textures
+                chunk_paths = [os.path.join(globalParam.GAZEBO_MODEL_PATH, self.chunk_name(self.model_name, row, col))
+                               for row in range(self.chunks) for col in range(self.chunks)]
+                ortho_outputs = heightmap_outputs = chunk_paths
+            else:
+                ortho_outputs = [os.path.join(textures_path, self.model_name+'_aerial.png')]
+                heightmap_outputs = [os.path.join(textures_path, self.model_name+'_height_map.tif')]
+            with self._stage("ortho", [self.tile_path], ortho_outputs):
+                self.generate_ortho(self.tile_path,self.zoom_level,self.model_name,self.boundaries,self.chunks)
             print("Satellite image generated successfully")
-            self.generate_rgb_heightmap(self.tile_path,self.boundaries,self.zoom_level)
-            (size_x,size_y,size_z,pose_x,posey,posez) = self.get_world_dimensions()
+            with self._stage("heightmap", outputs=heightmap_outputs):
+                self.generate_rgb_heightmap(self.tile_path,self.boundaries,self.zoom_level,self.chunks)
+            with self._stage("dimensions"):
+                (size_x,size_y,size_z,pose_x,posey,posez) = self.get_world_dimensions()
             if self.include_buildings:
-                origin_coord = self.get_true_origin()
-                print("Starting building data download...")
-                street_map = os.path.join(globalParam.GAZEBO_MODEL_PATH, self.model_name, 'buildings.geojson')
-                output_dae_file = os.path.join(globalParam.GAZEBO_MODEL_PATH, self.model_name, 'textures/buildings.dae')
-                true_boundaries = maptile_utiles.get_true_boundaries(self.boundaries.split(','), self.zoom_level)
-                geojson_to_dae = GeoJSONToDAE(street_map, output_dae_file)
-                geojson_to_dae.run(origin_coord,size_z,posez,self.heightmap, true_boundaries)
+                street_map = os.path.join(self.model_path, 'buildings.fgb')
+                output_dae_file = os.path.join(self.model_path, 'textures/buildings.dae')
+                with self._stage("buildings", [street_map], [output_dae_file]):
+                    origin_coord = self.get_true_origin()
+                    print("Starting building data download...")
+                    true_boundaries = maptile_utiles.get_true_boundaries(self.boundaries.split(','), self.zoom_level)
+                    geojson_to_dae = GeoJSONToDAE(street_map, output_dae_file)
+                    geojson_to_dae.run(origin_coord,size_z,posez,self.heightmap, true_boundaries)
                 print("Building models generated successfully")
             # Generate SDF files for the world
-            self.gen_config()
-            self.gen_sdf(size_x,size_y,size_z,pose_x,posey,posez,self.include_buildings)
-            maptile_utiles.dir_check(globalParam.GAZEBO_WORLD_PATH)
-            self.gen_world()
+            sdf_outputs = [os.path.join(self.model_path, 'model.config'), os.path.join(self.model_path, 'model.sdf'),
+                           os.path.join(globalParam.GAZEBO_WORLD_PATH, self.model_name+'.sdf')]
+            with self._stage("sdf", outputs=sdf_outputs):
+                self.gen_config()
+                self.gen_sdf(size_x,size_y,size_z,pose_x,posey,posez,self.include_buildings)
+                maptile_utiles.dir_check(globalParam.GAZEBO_WORLD_PATH)
+                self.gen_world()
             print("Generate gazebo model files are save to : ",os.path.join(globalParam.GAZEBO_MODEL_PATH,os.path.basename(self.tile_path)))
             print("Generate gazebo world file are save to : ",globalParam.GAZEBO_WORLD_PATH)
             print("Gazebo world files generated successfully")
 
-            shutil.rmtree(globalParam.TEMP_PATH)
+            # Only remove this generator's scratch data, other jobs may share TEMP_PATH
+            shutil.rmtree(os.path.join(self.temp_path, 'gazebo_terrian', self.model_name), ignore_errors=True)
@@ -1,21 +1,29 @@
 import cv2
 import os
+import warnings
 import numpy as np
 import math
+import rasterio
+from rasterio.errors import NotGeoreferencedWarning
+from rasterio.windows import Window
 from PIL import Image
-from multiprocessing import Pool, cpu_count
 
 from utils.maptileUtils import maptile_utiles
 from utils.utils import ConcatImage
+from utils.elevationStore import ElevationTileStore
 from utils.param import globalParam
 
 
 class HeightmapGenerator(ConcatImage):
+    # Elevation in decimetres of DEM tiles the provider does not have, sea level
+    MISSING_TILE_FILL = 0
+
     def __init__(self,**kwargs):
         super().__init__(**kwargs)
         self.heightmap = None
         self.max_height = self.min_height = 0
         self.size_x=self.size_y=self.size_z=0
+        self.terrain_chunks = []
 
 
     def get_dem_px_bounds(self,true_boundaries,tile_boundaries,height,width):
@@ -45,39 +53,279 @@ class HeightmapGenerator(ConcatImage):
         Returns:
             float: Height above mean sea level in meters.
         """
-        tile_x,tile_y = maptile_utiles.lat_lon_to_tile(lat, lon,globalParam.DEM_RESOLUTION)
-        boundaries = maptile_utiles.get_tile_bounds(tile_x, tile_y, globalParam.DEM_RESOLUTION)
-        # check if tile exist
-        lat_max = boundaries["northeast"][0]
-        lat_min = boundaries["southwest"][0]
-        lon_max = boundaries["northeast"][1]
-        lon_min = boundaries["southwest"][1]
-        dem_tile_path = os.path.join(globalParam.DEM_PATH, str(globalParam.DEM_RESOLUTION), str(tile_x), str(tile_y)+'.png')
-        if os.path.isfile(dem_tile_path) == True:
-            # read the image from the tile its a gbr image format
-            dem_img = cv2.imread(dem_tile_path)
-            #get the size of the image
-            height,width = dem_img.shape[:2]
-            # from boundaries and the desiderd lat long get the pixel coordinates
-            px = int((lon - lon_min) / (lon_max - lon_min) * width)
-            py = int((lat_max - lat) / (lat_max - lat_min) * height)
-            # from pixel read the image and get the height
-            b,g,r = dem_img[py,px]  
-            b,g,r = float(b), float(g), float(r)
-            # convert the pixel value to height 
-            # reference : https://docs.mapbox.com/data/tilesets/reference/mapbox-terrain-dem-v1/
-            height = ((r * 256 * 256 + g * 256 + b) * 0.1) - 10000
-            return height
+        height = ElevationTileStore.shared().elevation_at(lat, lon, globalParam.DEM_RESOLUTION)
+        if height is None:
+            # Same fill as the heightmap, the provider may not cover the point
+            tile_x,tile_y = maptile_utiles.lat_lon_to_tile(lat, lon,globalParam.DEM_RESOLUTION)
+            print("[WARN] Tile not found",tile_x,tile_y,globalParam.DEM_RESOLUTION,lat,lon)
+            height = HeightmapGenerator.MISSING_TILE_FILL * ElevationTileStore.SCALE
+        return height
 
-        else :
-            # raise an error and kill the program
+    @staticmethod
+    def get_amsl_many(lats, lons, bilinear: bool = False) -> np.ndarray:
+        """
+        Get the height above mean sea level (AMSL) of many points at once.
 
-            print("Tile not found",tile_x,tile_y,globalParam.DEM_RESOLUTION,lat,lon)
-            return None
+        DEM tiles are read once and kept in an LRU cache shared by all lookups
+        of the process.
+
+        Args:
+            lats: Latitudes in degrees.
+            lons: Longitudes in degrees.
+            bilinear (bool): Interpolate between DEM pixels instead of taking the nearest.
+        Returns:
+            np.ndarray: Heights above mean sea level in meters, NaN where the DEM tile is missing.
+        """
+        heights = ElevationTileStore.shared().elevations_at(lats, lons, globalParam.DEM_RESOLUTION, bilinear)
+        missing = int(np.isnan(heights).sum())
+        if missing:
+            print(f"[WARN] DEM tiles missing for {missing} of {heights.size} points")
+        return heights
 
     
 
-    def generate_rgb_heightmap(self,model_path,boundaries,zoomlevel) -> list:
+    @staticmethod
+    def get_nearest_map_size(height,width):
+        value = max(height, width)
+        n = math.log2(value - 1)
+        # Get floor and ceil values of n
+        n_ceil = int(math.ceil(n))
+
+        size_upper = (2 ** n_ceil) + 1
+
+        return size_upper
+
+    @staticmethod
+    def resize_corner_aligned(grid: np.ndarray, size: int) -> np.ndarray:
+        """
+        Resample a grid to size x size with its corner pixels kept in the corners.
+
+        Unlike cv2.resize the first and last rows and columns of the result are
+        sampled exactly on the first and last rows and columns of the grid, so
+        chunks sharing an edge of the source grid end up with identical edges.
+        """
+        height, width = grid.shape[:2]
+        map_x = np.tile(np.linspace(0, width - 1, size, dtype=np.float32), (size, 1))
+        map_y = np.tile(np.linspace(0, height - 1, size, dtype=np.float32)[:, None], (1, size))
+        return cv2.remap(grid, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+    def write_heightmap_chunks(self, model_name: str, height_img_normalized: np.ndarray, chunks: int) -> list:
+        """
+        Split the normalized heightmap into an NxN grid of heightmaps.
+
+        All chunks share the global normalization, so one size_z applies to all
+        of them, and neighbouring chunks share the samples on their common edge.
+        Every chunk is resampled to the same 2^n+1 size.
+
+        Args:
+            model_name (str): Name of the terrain model.
+            height_img_normalized (np.ndarray): 8-bit heightmap of the whole region.
+            chunks (int): Number of chunks along each axis.
+
+        Returns:
+            list: One dict per chunk with its name, row, column and extent as
+            fractions of the region, x from the west and y from the north.
+        """
+        height, width = height_img_normalized.shape[:2]
+        layout, size = self.chunk_layout(model_name, height, width, chunks)
+        for chunk in layout:
+            grid = height_img_normalized[chunk["rows"][0]:chunk["rows"][1], chunk["cols"][0]:chunk["cols"][1]]
+            chunk_map = Image.fromarray(self.resize_corner_aligned(grid, size), mode='L')
+            chunk_map.save(os.path.join(globalParam.GAZEBO_MODEL_PATH, chunk["name"], 'textures', chunk["name"]+'_height_map.tif'), format="TIFF")
+        return layout
+
+    def chunk_layout(self, model_name: str, height: int, width: int, chunks: int) -> tuple:
+        """
+        Split a heightmap of height x width samples into an NxN grid of chunks.
+
+        Returns:
+            tuple: One dict per chunk with its name, row, column, sample rows and
+            columns (first and past the last) and extent as fractions of the
+            region, x from the west and y from the north, and the common 2^n+1
+            size of the chunk heightmaps.
+        """
+        if min(height, width) <= chunks:
+            raise ValueError(f"Heightmap of {width}x{height} samples is too small for {chunks}x{chunks} chunks")
+        rows = self.chunk_edges(height, chunks)
+        cols = self.chunk_edges(width, chunks)
+        size = self.get_nearest_map_size(max(b - a for a, b in zip(rows, rows[1:])) + 1,
+                                         max(b - a for a, b in zip(cols, cols[1:])) + 1)
+
+        layout = []
+        for row in range(chunks):
+            for col in range(chunks):
+                layout.append({
+                    "name": self.chunk_name(model_name, row, col), "row": row, "col": col,
+                    "rows": (rows[row], rows[row + 1] + 1), "cols": (cols[col], cols[col + 1] + 1),
+                    "x0": cols[col] / (width - 1), "x1": cols[col + 1] / (width - 1),
+                    "y0": rows[row] / (height - 1), "y1": rows[row + 1] / (height - 1),
+                })
+        return layout, size
+
+    @staticmethod
+    def normalize_heightmap(grid: np.ndarray, min_dm: int, max_dm: int) -> np.ndarray:
+        """
+        Scale a decimetre grid to 8 bits, min_dm mapping to 0 and max_dm to 255.
+        """
+        normalized = grid.astype(np.float32)
+        normalized -= min_dm
+        if max_dm > min_dm:
+            normalized *= 255.0 / (max_dm - min_dm)
+        return normalized.astype(np.uint8)
+
+    @staticmethod
+    def sample_positions(length: int, size: int, corner_aligned: bool) -> np.ndarray:
+        """
+        Source positions of size samples resampled from an axis of length samples, as
+        resize_corner_aligned() places them or, otherwise, as cv2.resize does.
+        """
+        if corner_aligned:
+            return np.linspace(0, length - 1, size)
+        return np.clip((np.arange(size) + 0.5) * (length / size) - 0.5, 0, length - 1)
+
+    @staticmethod
+    def window_extremes(store: ElevationTileStore, x_range: tuple, y_range: tuple, tile_shape: tuple,
+                        rows: tuple, cols: tuple) -> tuple:
+        """
+        Lowest and highest elevation of a window of the DEM mosaic, reading one tile at a time.
+
+        Missing tiles count as MISSING_TILE_FILL, as they are filled when the
+        heightmap is resampled, and are reported once here.
+
+        Returns:
+            tuple: Minimum and maximum in decimetres.
+        """
+        tile_h, tile_w = tile_shape
+        min_dm, max_dm = None, None
+        missing = []
+        for row in range(rows[0] // tile_h, (rows[1] - 1) // tile_h + 1):
+            for col in range(cols[0] // tile_w, (cols[1] - 1) // tile_w + 1):
+                x, y = x_range[0] + col, y_range[0] + row
+                tile = store.get_elevation(globalParam.DEM_RESOLUTION, x, y)
+                if tile is None:
+                    missing.append((x, y))
+                    low = high = HeightmapGenerator.MISSING_TILE_FILL
+                else:
+                    top, left = row * tile_h, col * tile_w
+                    part = tile[max(rows[0], top) - top:min(rows[1], top + tile_h) - top,
+                                max(cols[0], left) - left:min(cols[1], left + tile_w) - left]
+                    low, high = int(part.min()), int(part.max())
+                min_dm = low if min_dm is None else min(min_dm, low)
+                max_dm = high if max_dm is None else max(max_dm, high)
+        if missing:
+            print(f"[WARN] {len(missing)} DEM tiles missing, filled at "
+                  f"{HeightmapGenerator.MISSING_TILE_FILL * ElevationTileStore.SCALE:g} m, first: "
+                  + ", ".join(f"{globalParam.DEM_RESOLUTION}/{x}/{y}" for x, y in missing[:3]))
+        return min_dm, max_dm
+
+    @staticmethod
+    def strip_rows(height: int, width: int, size: int) -> int:
+        """
+        Heightmap rows resampled at once from a window of height x width DEM samples.
+        """
+        # Bytes held per output row: its DEM rows as int32, float32 and uint8, and their resampling along x
+        row_bytes = (height / size + 2) * (width * 9 + size * 8)
+        return int(max(1, min(size, globalParam.DEM_MEMORY_BUDGET // row_bytes)))
+
+    def write_heightmap_windowed(self, store: ElevationTileStore, x_range: tuple, y_range: tuple, tile_shape: tuple,
+                                 rows: tuple, cols: tuple, size: int, min_dm: int, max_dm: int, path: str,
+                                 corner_aligned: bool = False) -> None:
+        """
+        Resample a window of the DEM mosaic into a size x size 8-bit heightmap, strip by strip.
+
+        Every strip of output rows reads only the DEM rows it interpolates from,
+        normalizes them and is written to the TIFF before the next one is read.
+        Strips are as tall as DEM_MEMORY_BUDGET allows.
+
+        Args:
+            store (ElevationTileStore): DEM tiles.
+            x_range (tuple): First and last tile x of the mosaic.
+            y_range (tuple): First and last tile y of the mosaic.
+            tile_shape (tuple): Tile height and width.
+            rows (tuple): First and past the last row of the window, in mosaic pixels.
+            cols (tuple): First and past the last column of the window, in mosaic pixels.
+            size (int): Edge of the heightmap.
+            min_dm (int): Elevation mapped to 0, in decimetres.
+            max_dm (int): Elevation mapped to 255, in decimetres.
+            path (str): Output TIFF.
+            corner_aligned (bool): Sample as resize_corner_aligned() instead of cv2.resize.
+        """
+        height, width = rows[1] - rows[0], cols[1] - cols[0]
+        src_x = self.sample_positions(width, size, corner_aligned)
+        src_y = self.sample_positions(height, size, corner_aligned)
+        x0 = np.floor(src_x).astype(np.int64)
+        x1 = np.minimum(x0 + 1, width - 1)
+        wx = (src_x - x0).astype(np.float32)
+        y0 = np.floor(src_y).astype(np.int64)
+        y1 = np.minimum(y0 + 1, height - 1)
+        wy = (src_y - y0).astype(np.float32)[:, None]
+
+        strip = self.strip_rows(height, width, size)
+        with warnings.catch_warnings():
+            # Gazebo scales the heightmap by the SDF size, the TIFF carries no georeference
+            warnings.simplefilter("ignore", NotGeoreferencedWarning)
+            with rasterio.open(path, "w", driver="GTiff", width=size, height=size, count=1, dtype="uint8") as dst:
+                for start in range(0, size, strip):
+                    stop = min(size, start + strip)
+                    first, last = int(y0[start]), int(y1[stop - 1])
+                    grid = store.read_window(globalParam.DEM_RESOLUTION, x_range, y_range,
+                                             (rows[0] + first, rows[0] + last + 1), cols, tile_shape,
+                                             fill=self.MISSING_TILE_FILL)
+                    grid = self.normalize_heightmap(grid, min_dm, max_dm)
+                    along_x = grid[:, x0] * (1 - wx) + grid[:, x1] * wx
+                    del grid
+                    resampled = along_x[y0[start:stop] - first] * (1 - wy[start:stop]) + along_x[y1[start:stop] - first] * wy[start:stop]
+                    dst.write(np.rint(resampled).astype(np.uint8), 1, window=Window(0, start, size, stop - start))
+                    self.report_progress()
+
+    def generate_heightmap_windowed(self, model: str, store: ElevationTileStore, x_range: tuple, y_range: tuple,
+                                    tile_shape: tuple, crop_px_cord: dict, chunks: int) -> None:
+        """
+        Out-of-core variant of generate_rgb_heightmap() for DEM grids beyond DEM_MEMORY_BUDGET.
+
+        The extremes are found in a first pass over the tiles, the heightmaps
+        are then resampled strip by strip from windows of the DEM mosaic, which
+        is never assembled. Only the finished 8-bit heightmap of the whole
+        region is loaded, for the launch height and the buildings.
+        """
+        rows = (crop_px_cord["northwest"][1], crop_px_cord["southeast"][1])
+        cols = (crop_px_cord["southwest"][0], crop_px_cord["northeast"][0])
+        height, width = rows[1] - rows[0], cols[1] - cols[0]
+        size = self.get_nearest_map_size(height,width)
+
+        min_dm, max_dm = self.window_extremes(store, x_range, y_range, tile_shape, rows, cols)
+        self.max_height = max_dm * ElevationTileStore.SCALE
+        self.min_height = min_dm * ElevationTileStore.SCALE
+
+        layout, chunk_size = self.chunk_layout(model, height, width, chunks) if chunks > 1 else ([], 0)
+        strips = -(-size // self.strip_rows(height, width, size))
+        for chunk in layout:
+            chunk_h, chunk_w = chunk["rows"][1] - chunk["rows"][0], chunk["cols"][1] - chunk["cols"][0]
+            strips += -(-chunk_size // self.strip_rows(chunk_h, chunk_w, chunk_size))
+        self.report_total(strips)
+
+        if chunks > 1:
+            heightmap_path = os.path.join(self.temp_path, 'gazebo_terrian', model, 'height_map.tif')
+            os.makedirs(os.path.dirname(heightmap_path), exist_ok=True)
+        else:
+            heightmap_path = os.path.join(globalParam.GAZEBO_MODEL_PATH, model, 'textures', model+'_height_map.tif')
+        self.write_heightmap_windowed(store, x_range, y_range, tile_shape, rows, cols, size, min_dm, max_dm, heightmap_path)
+        # Read back through rasterio, PIL refuses to open images this large
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", NotGeoreferencedWarning)
+            with rasterio.open(heightmap_path) as src:
+                self.heightmap = Image.fromarray(src.read(1), mode='L')
+
+        for chunk in layout:
+            self.write_heightmap_windowed(store, x_range, y_range, tile_shape,
+                                          (rows[0] + chunk["rows"][0], rows[0] + chunk["rows"][1]),
+                                          (cols[0] + chunk["cols"][0], cols[0] + chunk["cols"][1]),
+                                          chunk_size, min_dm, max_dm,
+                                          os.path.join(globalParam.GAZEBO_MODEL_PATH, chunk["name"], 'textures', chunk["name"]+'_height_map.tif'),
+                                          corner_aligned=True)
+        self.terrain_chunks = layout
+
+    def generate_rgb_heightmap(self,model_path,boundaries,zoomlevel,chunks: int = 1) -> list:
 
         #get the true boundaries as there is a padding non uniform padding added 
         bound_array = boundaries.split(',')
@@ -86,70 +334,51 @@ class HeightmapGenerator(ConcatImage):
                             true_boundaries["northeast"][1], true_boundaries["northeast"][0]]
         
         tile_number_boundaries = maptile_utiles.get_max_tilenumber(true_bound_array,globalParam.DEM_RESOLUTION)
-        image_dir = os.path.join(globalParam.DEM_PATH, str(globalParam.DEM_RESOLUTION))
-        image_dir_list = self.get_x_tile_directories(image_dir,tile_number_boundaries)
-
-        temp_output_dir = os.path.join(globalParam.TEMP_PATH, 'heightmap')
-
-        maptile_utiles.dir_check(temp_output_dir,remove_existing=True)
-
-        args_list = [
-            (self, dir_name, image_dir, tile_number_boundaries, temp_output_dir)
-            for dir_name in image_dir_list
-        ]
-        #  Multiprocessing call
-        with Pool(processes=cpu_count()) as pool:
-            pool.map(ConcatImage._run_instance_method, args_list)
-
-        image_list = sorted([
-            os.path.join(temp_output_dir, img)
-            for img in os.listdir(temp_output_dir) if img.endswith('.png')
-        ])            
-        images = [cv2.imread(path) for path in image_list]
-        filtered_images = [images[0]]
-
-        for img in images[1:]:
-            if ConcatImage.are_dimensions_equal(filtered_images[-1], img):
-                filtered_images.append(img)
-        stitched_image = cv2.hconcat(filtered_images)
-        
-        cv2.imwrite(os.path.join(temp_output_dir, 'height_map.png'),stitched_image)
+        x_range = sorted((tile_number_boundaries["southwest"][0], tile_number_boundaries["southeast"][0]))
+        y_range = sorted((tile_number_boundaries["northwest"][1], tile_number_boundaries["southwest"][1]))
 
-        tile_boundaries = maptile_utiles.get_true_boundaries(true_bound_array,globalParam.DEM_RESOLUTION)
+        store = ElevationTileStore(globalParam.DEM_PATH)
+        tile_shape = store.tile_shape(globalParam.DEM_RESOLUTION, x_range, y_range)
+        height = (y_range[1] - y_range[0] + 1) * tile_shape[0]
+        width = (x_range[1] - x_range[0] + 1) * tile_shape[1]
 
-        height,width = stitched_image.shape[:2]
+        tile_boundaries = maptile_utiles.get_true_boundaries(true_bound_array,globalParam.DEM_RESOLUTION)
         crop_px_cord = self.get_dem_px_bounds(true_boundaries,tile_boundaries,height,width)
-        # Crop the image based on the true boundaries needed
-        cropped_image = self.crop_dem_image(crop_px_cord,stitched_image) 
-        height,width = cropped_image.shape[:2]
-        cv2.imwrite(os.path.join(temp_output_dir, 'cropped_image.png'),cropped_image)
+        model = os.path.basename(model_path)
 
-        # Convert to float to avoid overflow during calculation
-        cropped_image_float = cropped_image.astype(np.float32)
-        # Calculate height map - changed to use float operations
-        height_map = ((cropped_image_float[:, :, 2] * 256 * 256 + cropped_image_float[:, :, 1] * 256 + cropped_image_float[:, :, 0]) * 0.1) - 10000
-        self.max_height = np.max(height_map)
-        self.min_height = np.min(height_map)
+        # Mosaic, normalised copy and heightmap held at once by the in-memory path
+        crop_h = crop_px_cord["southeast"][1] - crop_px_cord["northwest"][1]
+        crop_w = crop_px_cord["northeast"][0] - crop_px_cord["southwest"][0]
+        size = self.get_nearest_map_size(crop_h,crop_w)
+        if height * width * 4 + crop_h * crop_w * 5 + size * size * 2 > globalParam.DEM_MEMORY_BUDGET:
+            print(f"DEM grid of {width}x{height} exceeds the memory budget, building the heightmap in windows")
+            self.generate_heightmap_windowed(model, store, x_range, y_range, tile_shape, crop_px_cord, chunks)
+            return
 
-        height_img_normalized = ((height_map - np.min(height_map)) / (np.max(height_map) - np.min(height_map)) * 255).astype(np.uint8)
+        # Elevations are stored decoded, the tiles are copied straight into one grid
+        self.report_total(1)
+        stitched_grid = store.mosaic(globalParam.DEM_RESOLUTION, x_range, y_range, fill=self.MISSING_TILE_FILL)
+        self.report_progress()
 
-        def get_nearest_map_size(height,width):
-            value = max(height, width)
-            n = math.log2(value - 1)
-            # Get floor and ceil values of n
-            n_ceil = int(math.ceil(n))
+        # Crop the grid based on the true boundaries needed
+        cropped_grid = self.crop_dem_image(crop_px_cord,stitched_grid)
+        height,width = cropped_grid.shape[:2]
 
-            size_upper = (2 ** n_ceil) + 1
+        # Extremes are taken on the integer grid, one float32 copy is normalised in place
+        min_dm = int(cropped_grid.min())
+        max_dm = int(cropped_grid.max())
+        self.max_height = max_dm * ElevationTileStore.SCALE
+        self.min_height = min_dm * ElevationTileStore.SCALE
 
-            return size_upper
-        
-        size = get_nearest_map_size(height,width)
+        height_img_normalized = self.normalize_heightmap(cropped_grid, min_dm, max_dm)
         resized_map  = cv2.resize(height_img_normalized, (size,size), interpolation=cv2.INTER_LINEAR)
 
-        model = os.path.basename(model_path)
-
         # Convert OpenCV image to PIL Image and save as TIFF
         self.heightmap = Image.fromarray(resized_map, mode='L')  # 'L' for 8-bit grayscale
+        if chunks > 1:
+            # The whole map is still used for the launch height and the buildings, only the chunks are written
+            self.terrain_chunks = self.write_heightmap_chunks(model, height_img_normalized, chunks)
+            return
         self.heightmap.save(os.path.join(globalParam.GAZEBO_MODEL_PATH, model, 'textures', model+'_height_map.tif'), format="TIFF")
 
     def crop_dem_image(self,px_bound,height_map):
@@ -0,0 +1,299 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from utils.param import globalParam
+from utils import metrics
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside a running job once cancellation has been requested.
+    """
+
+
+class JobQueueFull(Exception):
+    """
+    Raised when a job is submitted while the run queue is at capacity.
+    """
+
+
+class Job:
+    """
+    State of a single background generation job.
+
+    Each job owns a scratch directory under TEMP_PATH so concurrent jobs never
+    share intermediate files.
+    """
+
+    def __init__(self, name: str):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.status = "queued"
+        self.current_stage = None
+        self.processed = 0
+        self.total = 0
+        self.bytes_fetched = 0
+        self.error = None
+        # Summary set by the job target, e.g. the coverage of a prefetch
+        self.result = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.stage_started_at = None
+        self.stage_bytes = 0
+        self.temp_path = os.path.join(globalParam.TEMP_PATH, self.job_id)
+        self._cancel_event = threading.Event()
+        self._lock = threading.Lock()
+        # Subscribers wait on this for stage, status and progress changes
+        self._changed = threading.Condition(self._lock)
+        self._version = 0
+        self._events = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def cancel(self) -> None:
+        """
+        Request cancellation. Running jobs stop at the next stage boundary.
+        """
+        self._cancel_event.set()
+
+    def check_cancelled(self) -> None:
+        """
+        Raise JobCancelled if cancellation has been requested.
+        """
+        if self.cancelled:
+            raise JobCancelled(f"Job {self.job_id} was cancelled")
+
+    @contextmanager
+    def stage(self, name: str, total: int = 0):
+        """
+        Mark the start of a pipeline stage and reset its progress counters.
+
+        Args:
+            name (str): Stage name.
+            total (int): Number of work items in the stage, if known.
+        """
+        self.check_cancelled()
+        with self._changed:
+            self.current_stage = name
+            self.processed = 0
+            self.total = total
+            self.stage_started_at = time.time()
+            self.stage_bytes = 0
+            self._add_event("stage", stage=name)
+        started = time.monotonic()
+        result = "failed"
+        try:
+            yield self
+            result = "completed"
+        except JobCancelled:
+            result = "cancelled"
+            raise
+        finally:
+            metrics.GENERATION_STAGE_SECONDS.labels(name, result).observe(time.monotonic() - started)
+
+    def set_status(self, status: str, error: str = None) -> None:
+        """
+        Move the job to a new status and notify subscribers.
+
+        Args:
+            status (str): One of queued, in_progress, completed, failed or cancelled.
+            error (str): Error message for failed jobs.
+        """
+        with self._changed:
+            now = time.time()
+            self.status = status
+            self.error = error
+            if status == "in_progress":
+                self.started_at = now
+            elif status in ("completed", "failed", "cancelled"):
+                self.finished_at = now
+            self._add_event("status", status=status, error=error)
+
+    def set_total(self, total: int) -> None:
+        with self._changed:
+            self.total = total
+            self._touch()
+
+    def advance(self, count: int = 1, nbytes: int = 0) -> None:
+        """
+        Record processed work items and fetched bytes for the current stage.
+
+        Args:
+            count (int): Number of items processed.
+            nbytes (int): Number of bytes fetched while processing them.
+        """
+        with self._changed:
+            self.processed += count
+            self.bytes_fetched += nbytes
+            self.stage_bytes += nbytes
+            self._touch()
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def wait_for_update(self, version: int, timeout: float) -> int:
+        """
+        Block until the job changes after the given version or the timeout expires.
+
+        Args:
+            version (int): Last version seen by the caller.
+            timeout (float): Seconds to wait.
+
+        Returns:
+            int: The current version, equal to the given one on timeout.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self._version != version, timeout)
+            return self._version
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Block until the job has finished.
+
+        Returns:
+            bool: True if the job finished within the timeout.
+        """
+        with self._changed:
+            return self._changed.wait_for(lambda: self.finished, timeout)
+
+    def events_since(self, index: int) -> list:
+        with self._lock:
+            return self._events[index:]
+
+    def progress(self) -> dict:
+        """
+        Snapshot of the current stage progress including throughput.
+        """
+        with self._lock:
+            elapsed = time.time() - self.stage_started_at if self.stage_started_at else 0.0
+            return {
+                "stage": self.current_stage,
+                "processed": self.processed,
+                "total": self.total,
+                "bytes_fetched": self.bytes_fetched,
+                "stage_elapsed": round(elapsed, 2),
+                "items_per_sec": round(self.processed / elapsed, 2) if elapsed > 0 else 0.0,
+                "bytes_per_sec": round(self.stage_bytes / elapsed, 2) if elapsed > 0 else 0.0,
+            }
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "job_id": self.job_id,
+                "name": self.name,
+                "status": self.status,
+                "stage": self.current_stage,
+                "processed": self.processed,
+                "total": self.total,
+                "bytes_fetched": self.bytes_fetched,
+                "error": self.error,
+                "result": self.result,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+    def _add_event(self, event: str, **data) -> None:
+        # Callers must hold self._changed
+        self._events.append(dict(data, event=event, time=time.time()))
+        self._touch()
+
+    def _touch(self) -> None:
+        # Callers must hold self._changed
+        self._version += 1
+        self._changed.notify_all()
+
+
+class JobManager:
+    """
+    Runs jobs on a bounded worker pool with a bounded run queue.
+    """
+
+    def __init__(self, max_workers: int = globalParam.MAX_CONCURRENT_JOBS,
+                 max_queued: int = globalParam.MAX_QUEUED_JOBS,
+                 history: int = globalParam.JOB_HISTORY):
+        self.max_queued = max_queued
+        self.history = history
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, name: str, target, *args, **kwargs) -> Job:
+        """
+        Queue a job. The target is called as target(job, *args, **kwargs).
+
+        Args:
+            name (str): Human readable job name.
+            target (callable): Function performing the work.
+
+        Returns:
+            Job: The queued job.
+
+        Raises:
+            JobQueueFull: If max_queued jobs are already waiting.
+        """
+        job = Job(name)
+        with self._lock:
+            queued = sum(1 for j in self._jobs.values() if j.status == "queued")
+            if queued >= self.max_queued:
+                raise JobQueueFull(f"{queued} jobs already queued")
+            self._jobs[job.job_id] = job
+            self._trim_history()
+        self._executor.submit(self._run, job, target, args, kwargs)
+        return job
+
+    def get(self, job_id: str) -> Job:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def latest(self) -> Job:
+        with self._lock:
+            return next(reversed(self._jobs.values()), None)
+
+    def jobs(self) -> list:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.get(job_id)
+        if job is None or job.status not in ("queued", "in_progress"):
+            return False
+        job.cancel()
+        return True
+
+    def _trim_history(self) -> None:
+        # Forget the oldest finished jobs once the history limit is reached
+        finished = [j for j in self._jobs.values() if j.finished]
+        for job in finished[:max(0, len(self._jobs) - self.history)]:
+            del self._jobs[job.job_id]
+
+    def _run(self, job: Job, target, args, kwargs) -> None:
+        if job.cancelled:
+            job.set_status("cancelled")
+            return
+
+        job.set_status("in_progress")
+        os.makedirs(job.temp_path, exist_ok=True)
+        status, error = "completed", None
+        try:
+            with metrics.GENERATION_JOBS_ACTIVE.track_inprogress():
+                target(job, *args, **kwargs)
+        except JobCancelled:
+            status = "cancelled"
+            print(f"Job {job.job_id} cancelled")
+        except Exception as e:
+            status, error = "failed", str(e)
+            print(f"Error during processing job {job.job_id}: {e}")
+
+        # Remove scratch data before subscribers see the final status
+        shutil.rmtree(job.temp_path, ignore_errors=True)
+        job.set_status(status, error=error)
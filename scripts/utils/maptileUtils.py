@@ -1,5 +1,9 @@
 import mercantile
+import numpy as np
+import shapely
+from shapely.geometry import shape
 import os,shutil
+from functools import lru_cache
 
 
 class maptile_utiles:
@@ -28,8 +32,13 @@ class maptile_utiles:
     def get_max_tilenumber(bound_array,zoom): # take zoom level as fundtion param
         '''
         get the squared tile number.
+        Memoized per bounds and zoom, the same region is looked up by every generation stage.
         '''
+        return dict(maptile_utiles._max_tilenumber(tuple(map(float, bound_array)), int(zoom)))
 
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _max_tilenumber(bound_array: tuple, zoom: int) -> dict:
         sw = (float(bound_array[1]), float(bound_array[0]))
         nw = (float(bound_array[3]), float(bound_array[0]))
         ne = (float(bound_array[3]), float(bound_array[2]))
@@ -65,8 +74,13 @@ class maptile_utiles:
     def get_true_boundaries(bound_array : str,zoom):
         '''
         Returns the lat log of the boundaries
-        
+        Memoized per bounds and zoom, the same region is looked up by every generation stage.
         '''
+        return dict(maptile_utiles._true_boundaries(tuple(map(float, bound_array)), int(zoom)))
+
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _true_boundaries(bound_array: tuple, zoom: int) -> dict:
         boundaries  = maptile_utiles.get_max_tilenumber(bound_array,zoom)
         true_sw     = maptile_utiles.get_tile_bounds(boundaries["southwest"][0],boundaries["southwest"][1],zoom)["southwest"]
         true_se     = maptile_utiles.get_tile_bounds(boundaries["southeast"][0],boundaries["southeast"][1],zoom)["southeast"]
@@ -83,6 +97,113 @@ class maptile_utiles:
 
 
 
+    @staticmethod
+    def get_tile_range(bound_array, zoom: int, selection=None) -> list:
+        """
+        Enumerate every tile covering a bounding box at the given zoom level.
+
+        The range is inclusive on all sides. With a selection, only tiles
+        intersecting it are kept, the same test the UI applies when it
+        previews the grid of a selection.
+
+        Args:
+            bound_array (list): Bounds as [west, south, east, north].
+            zoom (int): Zoom level.
+            selection (dict): Optional GeoJSON geometry of the selected area.
+
+        Returns:
+            list: (x, y) tile numbers in row-major order from the north-west tile.
+        """
+        x_start, x_end, y_start, y_end = maptile_utiles.tile_range(bound_array, zoom)
+        xs, ys = np.meshgrid(np.arange(x_start, x_end + 1), np.arange(y_start, y_end + 1))
+        xs, ys = xs.ravel(), ys.ravel()
+        if selection is not None:
+            # Tiles touching the selection count as selected, like turf.booleanDisjoint in the UI
+            west, south, east, north = maptile_utiles.tile_bounds_many(xs, ys, zoom)
+            keep = shapely.intersects(shapely.box(west, south, east, north), shape(selection))
+            xs, ys = xs[keep], ys[keep]
+        return list(zip(xs.tolist(), ys.tolist()))
+
+    @staticmethod
+    def tile_range(bound_array, zoom: int) -> tuple:
+        """
+        Inclusive tile range covering a bounding box.
+
+        Args:
+            bound_array (list): Bounds as [west, south, east, north].
+            zoom (int): Zoom level.
+
+        Returns:
+            tuple: (first x, last x, first y, last y)
+        """
+        west, south, east, north = map(float, bound_array)
+        xs, ys = maptile_utiles.lat_lon_to_tile_many([north, south], [west, east], zoom)
+        return int(xs.min()), int(xs.max()), int(ys.min()), int(ys.max())
+
+    @staticmethod
+    def lat_lon_to_tile_many(lats, lons, zoom: int) -> tuple:
+        """
+        Array version of lat_lon_to_tile.
+
+        Args:
+            lats: Latitudes in degrees.
+            lons: Longitudes in degrees.
+            zoom (int): Zoom level.
+
+        Returns:
+            tuple: Arrays of tile x and y numbers.
+        """
+        lats = np.clip(np.asarray(lats, dtype=np.float64), -85.0511, 85.0511)
+        lons = np.asarray(lons, dtype=np.float64)
+        n = 2.0 ** zoom
+        # Same projection and edge handling as mercantile.tile
+        x = lons / 360.0 + 0.5
+        sin_lat = np.sin(np.radians(lats))
+        y = 0.5 - 0.25 * np.log((1.0 + sin_lat) / (1.0 - sin_lat)) / np.pi
+        tile_x = np.clip(np.floor((x + mercantile.EPSILON) * n), 0, n - 1).astype(np.int64)
+        tile_y = np.clip(np.floor((y + mercantile.EPSILON) * n), 0, n - 1).astype(np.int64)
+        return tile_x, tile_y
+
+    @staticmethod
+    def tile_bounds_many(xs, ys, zoom: int) -> tuple:
+        """
+        Array version of get_tile_bounds.
+
+        Args:
+            xs: Tile x numbers.
+            ys: Tile y numbers.
+            zoom (int): Zoom level.
+
+        Returns:
+            tuple: Arrays of west, south, east and north bounds in degrees.
+        """
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        n = 2.0 ** zoom
+        west = xs / n * 360.0 - 180.0
+        east = (xs + 1) / n * 360.0 - 180.0
+        north = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * ys / n))))
+        south = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (ys + 1) / n))))
+        return west, south, east, north
+
+    @staticmethod
+    def tile_fraction_to_lon_lat(xs, ys, zoom: int, fx, fy) -> tuple:
+        """
+        Convert positions inside tiles to lon/lat, linear between the tile bounds.
+
+        Args:
+            xs: Tile x numbers.
+            ys: Tile y numbers.
+            zoom (int): Zoom level.
+            fx: Fraction of the tile width from the west edge.
+            fy: Fraction of the tile height from the south edge.
+
+        Returns:
+            tuple: Arrays of longitudes and latitudes.
+        """
+        west, south, east, north = maptile_utiles.tile_bounds_many(xs, ys, zoom)
+        return west + np.asarray(fx) * (east - west), south + np.asarray(fy) * (north - south)
+
     @staticmethod
     def lat_lon_to_tile( lat: float, lon: float, zoom: int):
         """
@@ -0,0 +1,76 @@
+import atexit
+import os
+import shutil
+from utils.param import globalParam
+
+# Tiles are also fetched from multiprocessing pools, so every process writes its
+# samples to a shared directory that /metrics aggregates. The directory must be
+# configured before prometheus_client is imported. Child processes inherit the
+# variable and write into the directory of their parent. Every process group
+# (the server, each CLI run) gets a directory of its own, so starting one never
+# wipes the samples of another.
+if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+    def _pid_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    # Directories left behind by process groups that did not exit cleanly
+    if os.path.isdir(globalParam.METRICS_PATH):
+        for entry in os.listdir(globalParam.METRICS_PATH):
+            if entry.isdigit() and not _pid_alive(int(entry)):
+                shutil.rmtree(os.path.join(globalParam.METRICS_PATH, entry), ignore_errors=True)
+
+    _group_path = os.path.join(globalParam.METRICS_PATH, str(os.getpid()))
+    shutil.rmtree(_group_path, ignore_errors=True)
+    os.makedirs(_group_path, exist_ok=True)
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = _group_path
+    atexit.register(shutil.rmtree, _group_path, ignore_errors=True)
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+from prometheus_client import CONTENT_TYPE_LATEST
+
+
+FETCH_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 45)
+STAGE_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 3600)
+
+TILE_FETCH_SECONDS = Histogram(
+    "tile_fetch_seconds", "Time to fetch one tile including retries", ["source"], buckets=FETCH_BUCKETS
+)
+TILE_FETCH_BYTES = Counter("tile_fetch_bytes", "Bytes of tile data downloaded", ["source"])
+TILE_FETCH_RETRIES = Counter("tile_fetch_retries", "Tile fetch attempts beyond the first", ["source"])
+TILE_FETCH_FAILURES = Counter("tile_fetch_failures", "Tile fetches that failed after all attempts", ["source", "status"])
+TILE_FETCH_ACTIVE = Gauge("tile_fetch_active", "Tile fetches in flight", ["source"], multiprocess_mode="livesum")
+
+TILE_CACHE_REQUESTS = Counter("tile_cache_requests", "Shared imagery cache lookups", ["result"])
+TILE_NEGATIVE_CACHE_HITS = Counter(
+    "tile_negative_cache_hits", "Tile fetches skipped because the provider has no such tile", ["source"]
+)
+
+GENERATION_JOBS_ACTIVE = Gauge("generation_jobs_active", "Generation jobs running", multiprocess_mode="livesum")
+GENERATION_STAGE_SECONDS = Histogram(
+    "generation_stage_seconds", "Duration of generation stages", ["stage", "result"], buckets=STAGE_BUCKETS
+)
+
+
+def mark_process_dead(pid: int) -> None:
+    """
+    Drop the live gauge samples of an exited child process, e.g. a pool worker.
+    """
+    multiprocess.mark_process_dead(pid)
+
+
+def render() -> tuple:
+    """
+    Render the metrics of all processes in the Prometheus text format.
+
+    Returns:
+        tuple: The payload and its content type.
+    """
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
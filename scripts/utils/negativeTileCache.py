@@ -0,0 +1,108 @@
+import os
+import sqlite3
+import threading
+import time
+from utils.param import globalParam
+from utils import metrics
+
+
+# Responses meaning the provider has no tile, as opposed to a failed fetch
+MISSING_STATUS = {204, 404, 410}
+
+
+class NegativeTileCache:
+    """
+    Persistent record of tiles the provider does not have.
+
+    Tiles answered with 404, 410, 204 or an empty body are recorded with their
+    status and time, and are not requested again until the record is older than
+    the TTL. Transient failures are never recorded. Sources are "dem", "vector"
+    or "imagery:<key>" with the key from TileCache.source_key().
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, root: str = globalParam.TILE_CACHE_PATH, ttl: float = globalParam.NEGATIVE_CACHE_TTL):
+        self.ttl = ttl
+        os.makedirs(root, exist_ok=True)
+        self.index_path = os.path.join(root, "misses.sqlite")
+        self._local = threading.local()
+
+        db = self._db()
+        with db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS misses ("
+                "source TEXT NOT NULL, z INTEGER NOT NULL, x INTEGER NOT NULL, y INTEGER NOT NULL, "
+                "status INTEGER NOT NULL, recorded REAL NOT NULL, PRIMARY KEY (source, z, x, y))"
+            )
+
+    @classmethod
+    def shared(cls) -> "NegativeTileCache":
+        """
+        Return the process wide instance.
+        """
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    @staticmethod
+    def is_missing_response(status: int, content: bytes = None) -> bool:
+        """
+        Whether a fetch outcome means the tile does not exist.
+        """
+        return status in MISSING_STATUS or (status == 200 and content is not None and len(content) == 0)
+
+    def _db(self) -> sqlite3.Connection:
+        # sqlite connections cannot be shared between threads, nor with forked pool workers
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.index_path, timeout=30)
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def is_missing(self, source: str, z: int, x: int, y: int, count: bool = True) -> bool:
+        """
+        Check whether a tile is known to be missing and the record has not expired.
+
+        Args:
+            source (str): Source key.
+            z (int): Zoom level.
+            x (int): Tile X coordinate.
+            y (int): Tile Y coordinate.
+            count (bool): Count a hit in the metrics, only lookups that skip a
+                fetch should do so.
+
+        Returns:
+            bool: True if the tile should not be requested.
+        """
+        row = self._db().execute(
+            "SELECT 1 FROM misses WHERE source=? AND z=? AND x=? AND y=? AND recorded>?",
+            (source, z, x, y, time.time() - self.ttl)
+        ).fetchone()
+        if row is None:
+            return False
+        if count:
+            metrics.TILE_NEGATIVE_CACHE_HITS.labels(source.split(":")[0]).inc()
+        return True
+
+    def record(self, source: str, z: int, x: int, y: int, status: int) -> None:
+        """
+        Record a tile the provider answered as missing.
+        """
+        db = self._db()
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO misses (source, z, x, y, status, recorded) VALUES (?, ?, ?, ?, ?, ?)",
+                (source, z, x, y, status, time.time())
+            )
+
+    def stats(self) -> dict:
+        db = self._db()
+        total, live = db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(recorded>?), 0) FROM misses", (time.time() - self.ttl,)
+        ).fetchone()
+        return {"tiles": total, "live": live, "ttl": self.ttl}
@@ -11,12 +11,55 @@ class globalParam:
     DEM_RESOLUTION              = 13
     DEM_BUILDING_RESOLUTION     = 15
 
+    # Upper bound on concurrent imagery fetches for /download-tiles
+    TILE_DOWNLOAD_WORKERS       = min(32, (os.cpu_count() or 1) * 4)
+    PREVIEW_SIZE                = 64    # edge of the tile thumbnails returned to the UI
+    DEFAULT_TILE_SOURCE         = "http://ecn.t0.tiles.virtualearth.net/tiles/a{quad}.jpeg?g=129&mkt=en&stl=H"
+
+    # Background generation jobs
+    MAX_CONCURRENT_JOBS         = 2
+    MAX_QUEUED_JOBS             = 16
+    JOB_HISTORY                 = 100
+    SSE_PROGRESS_INTERVAL       = 0.5   # seconds between coalesced progress events
+    SSE_KEEPALIVE_INTERVAL      = 15
+
+    # Shared HTTP tile fetcher
+    FETCH_POOL_SIZE             = 64
+    FETCH_CONNECT_TIMEOUT       = 5     # seconds
+    FETCH_READ_TIMEOUT          = 15    # seconds between bytes
+    FETCH_DEADLINE              = 45    # seconds for all attempts of one tile
+    FETCH_RETRIES               = 3
+    FETCH_BACKOFF               = 0.5   # base delay in seconds, doubled per attempt
+    FETCH_BACKOFF_MAX           = 8
+    FETCH_VERIFY_SSL            = True
+
+    # DEM tile downloads
+    DEM_DOWNLOAD_WORKERS        = 16    # tiles in flight, independent of the core count
+    DEM_RATE_LIMIT              = 50    # requests per second, 0 disables the limit
+    DEM_FETCH_DEADLINE          = 30    # seconds for all attempts of one DEM tile
+    # "elevation" decodes tiles at download time into memory-mappable grids,
+    # "webp" keeps the fetched bytes and decodes them when the heightmap is built
+    DEM_STORAGE                 = "elevation"
+    DEM_TILE_CACHE_SIZE         = 64    # decoded DEM tiles kept in memory for point elevation lookups
+    DEM_MEMORY_BUDGET           = 2 * 1024 ** 3    # bytes of DEM grids held at once, larger heightmaps are built in windows
+    BUILDING_DEBUG_JSON         = False # also dump every decoded building tile as indented JSON
+    BUILDING_DECODE_WORKERS     = os.cpu_count() or 1   # processes decoding building tiles
+    MOSAIC_DECODE_WORKERS       = os.cpu_count() or 1   # threads decoding tiles into the stitched ortho and DEM grids
+    BUILDING_GEOJSON_EXPORT     = False # also write buildings.geojson next to buildings.fgb
+    TERRAIN_CHUNKS              = 1     # terrain is split into an NxN grid of heightmap sub-models when above 1
+
 
     DEM_PATH                    = os.path.join(OUTPUT_BASE_PATH, 'dem')
     BUILDING_PATH               = os.path.join(OUTPUT_BASE_PATH, 'streetmap')
+    TILE_CACHE_PATH             = os.path.join(OUTPUT_BASE_PATH, 'tile_cache')
+    TILE_CACHE_MAX_BYTES        = 10 * 1024 ** 3   # disk budget of the shared imagery cache
+    NEGATIVE_CACHE_TTL          = 7 * 24 * 3600    # seconds before a tile the provider lacked is requested again
+    PREFETCH_BANDWIDTH          = 0     # bytes per second shared by a prefetch request, 0 for no limit
+    TILE_STORE                  = "directory"      # "directory" or "mbtiles" for run imagery
+    METRICS_PATH                = os.path.join(TEMP_PATH, 'metrics')   # per process samples behind /metrics
+    MBTILES_BATCH_SIZE          = 256
     HELIPAD_MODEL         = "https://fuel.gazebosim.org/1.0/saiaravind19/models/helipad" 
     # Set the global config
-    TEMPORARY_SATELLITE_IMAGE    = os.path.join(TEMP_PATH,'gazebo_terrian')
     TEMPLATE_DIR_PATH            = str(Path(__file__).resolve().parents[2] / 'templates')
     
     # Free Mapbox API Key 
@@ -0,0 +1,467 @@
+import os
+import base64
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils.demTilesDownloader import download_dem_data, MISSING_AT_SOURCE
+from utils.buildingDownloader import BuildingDownloader, download_steetmap_data
+from utils.elevationStore import ElevationTileStore
+from utils.fileWriter import FileWriter
+from utils.utils import Utils
+from utils.gazeboWorldGenerator import GazeboTerrianGenerator
+from utils.maptileUtils import maptile_utiles
+from utils.tileFetcher import RETRYABLE_STATUS, TileFetcher
+from utils.tileCache import TileCache
+from utils.negativeTileCache import NegativeTileCache
+from utils.tileStore import open_tile_store
+from utils.param import globalParam
+
+
+lock = threading.Lock()
+
+
+class DownloadExecutors:
+    """
+    Thread pools of the imagery, DEM and vector tile downloads.
+
+    One instance is shared by all jobs of a process, so regions running
+    concurrently queue their tiles on the same pools instead of each opening
+    its own set of connections.
+    """
+
+    def __init__(self, workers: int = globalParam.TILE_DOWNLOAD_WORKERS,
+                 dem_workers: int = globalParam.DEM_DOWNLOAD_WORKERS):
+        self.imagery = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="imagery")
+        self.dem = ThreadPoolExecutor(max_workers=max(1, dem_workers), thread_name_prefix="dem")
+        self.vector = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="vector")
+
+    def shutdown(self, wait: bool = True) -> None:
+        for executor in (self.imagery, self.dem, self.vector):
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+
+def format_output_path(template, x, y, z, quad, timestamp):
+    replaceMap = {
+        "x": str(x),
+        "y": str(y),
+        "z": str(z),
+        "quad": quad,
+        "timestamp": str(timestamp),
+    }
+    for key, value in replaceMap.items():
+        template = template.replace(f"{{{key}}}", value)
+    return template
+
+
+def fetch_tile(source, outputDirectory, outputFile, x, y, z, timestamp, outputScale=1, preview="thumbnail"):
+    """
+    Download a single imagery tile into the run directory.
+
+    The tile is fetched into memory and written once to its final location.
+    Tiles already in the shared tile cache are hardlinked instead of downloaded,
+    tiles the provider recently answered as missing are not requested again.
+
+    Args:
+        source (str): Tile URL template.
+        outputDirectory (str): Output directory template.
+        outputFile (str): Output file template.
+        x (int): Tile X coordinate.
+        y (int): Tile Y coordinate.
+        z (int): Zoom level.
+        timestamp (int): Timestamp used in the output templates.
+        outputScale (int): Output scale.
+        preview (str): "thumbnail" for a small base64 JPEG, "url" for a link to the
+            stored tile or "none".
+
+    Returns:
+        dict: Result with code, message and the requested preview when downloaded.
+    """
+    quad = Utils.makeQuadKey(x, y, z)
+    outputDirectory = format_output_path(outputDirectory, x, y, z, quad, timestamp)
+    outputFile = format_output_path(outputFile, x, y, z, quad, timestamp)
+
+    store = open_tile_store(os.path.join(globalParam.OUTPUT_BASE_PATH, outputDirectory), ext=Path(outputFile).suffix.lstrip(".") or "png")
+
+    result = {}
+    if store.exists(z, x, y):
+        result["code"] = 200
+        result["message"] = 'Tile already exists'
+        return result
+
+    cache = TileCache.shared()
+    cacheKey = TileCache.source_key(source, outputScale)
+    misses = NegativeTileCache.shared()
+    if misses.is_missing(f"imagery:{cacheKey}", z, x, y):
+        result["code"] = 404
+        result["message"] = 'Tile missing at source'
+        return result
+
+    cachedPath = cache.get(cacheKey, z, x, y)
+    data = None
+    if cachedPath is not None:
+        try:
+            store.put_file(z, x, y, cachedPath)
+            if preview == "thumbnail":
+                with open(cachedPath, "rb") as cachedFile:
+                    data = cachedFile.read()
+            result["code"] = 200
+            result["message"] = 'Tile loaded from cache'
+        except FileNotFoundError:
+            # Evicted between lookup and link, download it again
+            cachedPath = None
+
+    if cachedPath is None:
+        result["code"], data = Utils.downloadTileScaled(source, x, y, z, outputScale)
+        if data is not None:
+            blobPath = cache.put(cacheKey, z, x, y, data)
+            if blobPath is not None:
+                store.put_file(z, x, y, blobPath)
+            else:
+                store.put(z, x, y, data)
+            result["message"] = 'Tile Downloaded'
+        else:
+            if NegativeTileCache.is_missing_response(result["code"]):
+                misses.record(f"imagery:{cacheKey}", z, x, y, result["code"])
+            result["message"] = 'Download failed'
+
+    if result["code"] == 200:
+        if preview == "thumbnail" and data is not None:
+            thumbnail = Utils.makeThumbnail(data)
+            if thumbnail is not None:
+                result["image"] = base64.b64encode(thumbnail).decode("utf-8")
+        elif preview == "url":
+            result["image_url"] = f"/tiles/{Path(outputDirectory).as_posix()}/{z}/{x}/{y}"
+
+    return result
+
+
+def download_region_tiles(source, bounds, zoom_level, outputDirectory, outputFile, timestamp,
+                          workers=globalParam.TILE_DOWNLOAD_WORKERS, preview="none", outputScale=1, executor=None,
+                          selection=None, tiles=None):
+    """
+    Download every imagery tile of a region on a bounded worker pool.
+
+    Tiles failing with a retryable error are fetched once more after the first
+    pass, those results carry "retry": True.
+
+    Args:
+        source (str): Tile URL template.
+        bounds (list): Bounds as [west, south, east, north].
+        zoom_level (int): Zoom level of the imagery.
+        outputDirectory (str): Output directory template.
+        outputFile (str): Output file template.
+        timestamp (int): Timestamp used in the output templates.
+        workers (int): Number of concurrent fetches, unused when executor is given.
+        preview (str): Preview mode passed to fetch_tile.
+        outputScale (int): Output scale.
+        executor (Executor): Optional pool shared with other downloads, a
+            private one with workers threads is used otherwise.
+        selection (dict): Optional GeoJSON geometry, only tiles intersecting it are fetched.
+        tiles (list): Optional (x, y) tiles already enumerated by the caller, bounds
+            and selection are then not enumerated again.
+
+    Yields:
+        dict: fetch_tile result of each tile with its x, y and z.
+    """
+    if tiles is None:
+        tiles = maptile_utiles.get_tile_range(bounds, zoom_level, selection)
+
+    submitted = []
+
+    def fetch_batch(executor, batch):
+        futures = {
+            executor.submit(fetch_tile, source, outputDirectory, outputFile, x, y, zoom_level, timestamp, outputScale, preview): (x, y)
+            for x, y in batch
+        }
+        submitted.extend(futures)
+        for future in as_completed(futures):
+            x, y = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"code": -1, "message": f"Download failed: {e}"}
+            result.update({"type": "tile", "x": x, "y": y, "z": zoom_level})
+            yield result
+
+    retry = []
+    owned = executor is None
+    if owned:
+        executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for result in fetch_batch(executor, tiles):
+            if result["code"] == -1 or result["code"] in RETRYABLE_STATUS:
+                retry.append((result["x"], result["y"]))
+            yield result
+
+        # Final retry pass for tiles that failed after per-request retries
+        for result in fetch_batch(executor, retry):
+            result["retry"] = True
+            yield result
+    finally:
+        # Stop queued downloads if the consumer went away, a shared pool keeps serving other jobs
+        for future in submitted:
+            future.cancel()
+        if owned:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def write_metadata(outputDirectory, outputFile, bounds, center, area, zoom_level, launchLocation, outputScale=1):
+    """
+    Write the run metadata read back by the world generator.
+
+    Args:
+        outputDirectory (str): Run directory relative to OUTPUT_BASE_PATH.
+        outputFile (str): Output file template.
+        bounds (list): Bounds as [west, south, east, north].
+        center (list): Center as [lon, lat].
+        area (str): Selected area in square meters.
+        zoom_level (int): Zoom level of the imagery.
+        launchLocation (list): Launch location as [lon, lat].
+        outputScale (int): Output scale.
+
+    Returns:
+        None
+    """
+    runPath = os.path.join(globalParam.OUTPUT_BASE_PATH, outputDirectory)
+    filePath = os.path.join(runPath, outputFile)
+    FileWriter.addMetadata(
+        lock, runPath, filePath, outputFile,
+        "Map Tiles Downloader via AliFlux", "jpg", bounds, center, area,
+        zoom_level, "mercator", 256 * outputScale, launchLocation=launchLocation
+    )
+    store = open_tile_store(runPath, ext=Path(outputFile).suffix.lstrip(".") or "png")
+    store.set_metadata({
+        "name": outputDirectory,
+        "format": Path(outputFile).suffix.lstrip(".") or "png",
+        "bounds": ",".join(map(str, bounds)),
+        "center": ",".join(map(str, list(center) + [zoom_level])),
+        "minzoom": zoom_level,
+        "maxzoom": zoom_level,
+        "type": "baselayer",
+    })
+
+
+def generate_world(job, bounds, zoom_level, outputDirectory, outputFile, include_buildings=False, chunks=globalParam.TERRAIN_CHUNKS,
+                   executors: DownloadExecutors = None):
+    """
+    Turn downloaded imagery into a Gazebo world: DEM and building download,
+    then heightmap, textures, buildings and SDF generation.
+
+    Args:
+        job (Job): Job running the generation.
+        bounds (list): Bounds as [west, south, east, north].
+        zoom_level (int): Zoom level of the imagery.
+        outputDirectory (str): Run directory relative to OUTPUT_BASE_PATH.
+        outputFile (str): Output file template.
+        include_buildings (bool): Whether to generate buildings.
+        chunks (int): Terrain sub-models along each axis, 1 for a single heightmap.
+        executors (DownloadExecutors): Optional pools shared with other jobs, the
+            downloads use private pools otherwise.
+
+    Returns:
+        None
+    """
+    orthodir_path = os.path.join(globalParam.OUTPUT_BASE_PATH, outputDirectory)
+    FileWriter.close(lock, orthodir_path, os.path.join(orthodir_path, outputFile), zoom_level)
+    true_boundaries = maptile_utiles.get_true_boundaries(bounds, zoom_level)
+    with job.stage("dem"):
+        failed = download_dem_data(true_boundaries, globalParam.DEM_PATH, progress=job,
+                                   executor=executors.dem if executors else None)
+    # Tiles the provider does not have are filled at 0 m by the heightmap, a re-run cannot fetch them either
+    missing = [tile for tile in failed if tile[3] == MISSING_AT_SOURCE]
+    failed = [tile for tile in failed if tile[3] != MISSING_AT_SOURCE]
+    if missing:
+        print(f"[WARN] {len(missing)} DEM tiles are missing at the provider and will be filled at 0 m")
+    if failed:
+        # Tiles that failed transiently would be filled as well, a re-run may fetch them
+        raise RuntimeError(f"{len(failed)} DEM tiles could not be downloaded, first: "
+                           + ", ".join(f"{z}/{x}/{y} ({error})" for z, x, y, error in failed[:3]))
+    model_path =  os.path.join(globalParam.GAZEBO_MODEL_PATH,os.path.basename(orthodir_path))
+    if include_buildings:
+        with job.stage("buildings_download"):
+            print("Starting building data download...")
+            download_steetmap_data(true_boundaries, globalParam.BUILDING_PATH,model_path,progress=job,
+                                   executor=executors.vector if executors else None)
+
+    terrian_generator = GazeboTerrianGenerator(orthodir_path,include_buildings,chunks,job=job,temp_path=job.temp_path)
+    terrian_generator.generate_gazebo_world()
+    print("Gazebo world generation completed successfully.")
+
+
+def generate_region(job, region: dict, workers: int = globalParam.TILE_DOWNLOAD_WORKERS,
+                    executors: DownloadExecutors = None) -> None:
+    """
+    Run the whole pipeline for one region without the UI.
+
+    Args:
+        job (Job): Job running the generation.
+        region (dict): Region with name, bounds [west, south, east, north], center,
+            area, zoom, launch_location, source, buildings and optionally chunks.
+        workers (int): Number of concurrent imagery fetches, unused when executors is given.
+        executors (DownloadExecutors): Optional pools shared with the other regions.
+
+    Returns:
+        None
+    """
+    outputDirectory = region["name"]
+    outputFile = "{z}/{x}/{y}.png"
+    bounds = region["bounds"]
+    zoom_level = region["zoom"]
+
+    write_metadata(outputDirectory, outputFile, bounds, region["center"], region["area"],
+                   zoom_level, region["launch_location"])
+
+    tiles = maptile_utiles.get_tile_range(bounds, zoom_level)
+    failed = 0
+    with job.stage("imagery", total=len(tiles)):
+        for result in download_region_tiles(region["source"], bounds, zoom_level, outputDirectory, outputFile, 0, workers,
+                                            executor=executors.imagery if executors else None):
+            job.check_cancelled()
+            retryable = result["code"] == -1 or result["code"] in RETRYABLE_STATUS
+            if result.get("retry") or result["code"] == 200 or not retryable:
+                job.advance()
+                failed += result["code"] != 200
+    if failed:
+        print(f"[WARN] {failed} imagery tiles of {outputDirectory} could not be downloaded")
+
+    generate_world(job, bounds, zoom_level, outputDirectory, outputFile, region["buildings"],
+                   region.get("chunks", globalParam.TERRAIN_CHUNKS), executors)
+
+
+def warm_imagery_tile(source, x, y, z, bandwidth=None):
+    """
+    Make sure an imagery tile is in the shared tile cache.
+
+    Args:
+        source (str): Tile URL template.
+        x (int): Tile X coordinate.
+        y (int): Tile Y coordinate.
+        z (int): Zoom level.
+        bandwidth (RateLimiter): Optional limiter in bytes per second.
+
+    Returns:
+        tuple: HTTP status code (200 for cached tiles) and the number of bytes fetched.
+    """
+    cacheKey = TileCache.source_key(source)
+    misses = NegativeTileCache.shared()
+    if misses.is_missing(f"imagery:{cacheKey}", z, x, y):
+        return 404, 0
+    cache = TileCache.shared()
+    if cache.get(cacheKey, z, x, y) is not None:
+        return 200, 0
+
+    result = TileFetcher.shared().fetch(Utils.qualifyURL(source, x, y, z))
+    if bandwidth is not None and result.content is not None:
+        bandwidth.consume(len(result.content))
+    if NegativeTileCache.is_missing_response(result.status, result.content):
+        misses.record(f"imagery:{cacheKey}", z, x, y, result.status)
+    elif result.ok:
+        cache.put(cacheKey, z, x, y, result.content)
+    return result.status, len(result.content or b"")
+
+
+def _coverage(tiles, available, source):
+    """
+    Count the tiles of a layer that are stored, missing at the provider or still missing.
+
+    Args:
+        tiles (list): (z, x, y) of every tile of the layer.
+        available (callable): Returns True for a stored tile.
+        source (str): Negative tile cache source key of the layer.
+
+    Returns:
+        dict: Tile counts and the covered fraction.
+    """
+    misses = NegativeTileCache.shared()
+    stored = missing = 0
+    for z, x, y in tiles:
+        if available(z, x, y):
+            stored += 1
+        elif misses.is_missing(source, z, x, y, count=False):
+            missing += 1
+    return {
+        "tiles": len(tiles),
+        "stored": stored,
+        "missing_at_source": missing,
+        "failed": len(tiles) - stored - missing,
+        "coverage": round((stored + missing) / len(tiles), 4) if tiles else 1.0,
+    }
+
+
+def prefetch_region(job, region: dict, workers: int = globalParam.TILE_DOWNLOAD_WORKERS, bandwidth=None,
+                    executors: DownloadExecutors = None) -> None:
+    """
+    Warm the imagery, DEM and vector tile caches of a region without generating a world.
+
+    Tiles the later generation would need are fetched ahead of time so it only
+    reads from disk. The coverage of every layer is stored in job.result.
+
+    Args:
+        job (Job): Job running the prefetch.
+        region (dict): Region with bounds [west, south, east, north], zoom and
+            optionally source and buildings.
+        workers (int): Number of concurrent fetches per layer, unused when executors is given.
+        bandwidth (RateLimiter): Optional limiter in bytes per second, may be shared between regions.
+        executors (DownloadExecutors): Optional pools shared with the other regions.
+
+    Returns:
+        None
+    """
+    bounds = list(map(float, region["bounds"]))
+    zoom_level = int(region["zoom"])
+    source = region.get("source") or globalParam.DEFAULT_TILE_SOURCE
+    true_boundaries = maptile_utiles.get_true_boundaries(bounds, zoom_level)
+    coverage = {}
+
+    tiles = maptile_utiles.get_tile_range(bounds, zoom_level)
+    cacheKey = TileCache.source_key(source)
+    with job.stage("prefetch_imagery", total=len(tiles)):
+        executor = executors.imagery if executors else ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="prefetch")
+        futures = []
+        try:
+            futures = [executor.submit(warm_imagery_tile, source, x, y, zoom_level, bandwidth) for x, y in tiles]
+            for future in as_completed(futures):
+                _, nbytes = future.result()
+                job.advance(1, nbytes)
+                job.check_cancelled()
+        finally:
+            # Drop queued tiles of this region only, a shared pool keeps serving other jobs
+            for future in futures:
+                future.cancel()
+            if not executors:
+                executor.shutdown(wait=False)
+        coverage["imagery"] = _coverage(
+            [(zoom_level, x, y) for x, y in tiles],
+            lambda z, x, y: TileCache.shared().contains(cacheKey, z, x, y),
+            f"imagery:{cacheKey}"
+        )
+
+    with job.stage("prefetch_dem"):
+        download_dem_data(true_boundaries, globalParam.DEM_PATH, progress=job, bandwidth=bandwidth,
+                          executor=executors.dem if executors else None)
+        zoom = globalParam.DEM_RESOLUTION
+        x_start, x_end, y_start, y_end = BuildingDownloader.tile_range(true_boundaries, zoom)
+        store = ElevationTileStore(globalParam.DEM_PATH)
+        coverage["dem"] = _coverage(
+            [(zoom, x, y) for x in range(x_start, x_end + 1) for y in range(y_start, y_end + 1)],
+            store.exists, "dem"
+        )
+
+    if region.get("buildings", True):
+        with job.stage("prefetch_buildings"):
+            zoom = globalParam.DEM_BUILDING_RESOLUTION
+            downloader = BuildingDownloader()
+            downloader.download_tiles(true_boundaries, zoom, globalParam.BUILDING_PATH, progress=job,
+                                      workers=workers, bandwidth=bandwidth,
+                                      executor=executors.vector if executors else None)
+            x_start, x_end, y_start, y_end = downloader.tile_range(true_boundaries, zoom)
+            coverage["vector"] = _coverage(
+                [(zoom, x, y) for x in range(x_start, x_end + 1) for y in range(y_start, y_end + 1)],
+                lambda z, x, y: os.path.isfile(os.path.join(globalParam.BUILDING_PATH, str(z), str(x), f"{y}.pbf")),
+                "vector"
+            )
+
+    job.result = {"coverage": coverage}
+    for layer, counts in coverage.items():
+        print(f"Prefetch {job.name} {layer}: {counts['stored']}/{counts['tiles']} stored, "
+              f"{counts['missing_at_source']} missing at source, {counts['failed']} failed")
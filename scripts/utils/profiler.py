@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import resource
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from utils.fileWriter import FileWriter
+
+
+class StageProfiler:
+    """
+    Records wall time, CPU time, peak memory and file sizes of generation stages
+    and keeps a JSON report of them up to date on disk.
+
+    thread_cpu_seconds is the CPU time of the thread running the stage and is
+    the only figure that belongs to this job alone. Fields prefixed process_
+    are measured over the whole process: they include other jobs running
+    concurrently and the server threads. process_children_cpu_seconds covers
+    child processes reaped during the stage, such as the stitching pools, and
+    process_peak_rss_bytes is sampled in the background over this process and
+    its live multiprocessing children.
+    """
+
+    def __init__(self, report_path: str, sample_interval: float = 0.1):
+        self.report_path = report_path
+        self.sample_interval = sample_interval
+        self.stages = []
+        self.started_at = time.time()
+
+    @staticmethod
+    def _rss_bytes(pid) -> int:
+        # /proc is Linux only, other platforms report 0
+        try:
+            with open(f"/proc/{pid}/status") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except (OSError, ValueError):
+            pass
+        return 0
+
+    def _tree_rss_bytes(self) -> int:
+        pids = ["self"] + [child.pid for child in multiprocessing.active_children()]
+        return sum(self._rss_bytes(pid) for pid in pids)
+
+    @staticmethod
+    def path_size(path: str) -> int:
+        """
+        Size in bytes of a file, or of all files below a directory.
+        """
+        if os.path.isfile(path):
+            return os.path.getsize(path)
+        total = 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return total
+
+    @contextmanager
+    def stage(self, name: str, inputs: list = (), outputs: list = ()):
+        """
+        Profile a stage and rewrite the report once it ends, successfully or not.
+
+        Args:
+            name (str): Stage name.
+            inputs (list): Paths read by the stage, sized on entry.
+            outputs (list): Paths written by the stage, sized on exit.
+        """
+        record = {"stage": name, "status": "failed"}
+        record["input_bytes"] = {path: self.path_size(path) for path in inputs}
+
+        peak = [self._tree_rss_bytes()]
+        stop = threading.Event()
+
+        def sample():
+            while not stop.wait(self.sample_interval):
+                peak[0] = max(peak[0], self._tree_rss_bytes())
+
+        sampler = threading.Thread(target=sample, name=f"profile-{name}", daemon=True)
+        sampler.start()
+        thread_start = time.thread_time()
+        self_usage = resource.getrusage(resource.RUSAGE_SELF)
+        children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        wall_start = time.perf_counter()
+        try:
+            yield record
+            record["status"] = "completed"
+        finally:
+            record["wall_seconds"] = round(time.perf_counter() - wall_start, 3)
+            record["thread_cpu_seconds"] = round(time.thread_time() - thread_start, 3)
+            stop.set()
+            sampler.join()
+            self_end = resource.getrusage(resource.RUSAGE_SELF)
+            children_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+            record["process_cpu_seconds"] = round(
+                (self_end.ru_utime - self_usage.ru_utime) + (self_end.ru_stime - self_usage.ru_stime), 3
+            )
+            record["process_children_cpu_seconds"] = round(
+                (children_end.ru_utime - children_usage.ru_utime) + (children_end.ru_stime - children_usage.ru_stime), 3
+            )
+            record["process_peak_rss_bytes"] = max(peak[0], self._tree_rss_bytes())
+            record["output_bytes"] = {path: self.path_size(path) for path in outputs if os.path.exists(path)}
+            self.stages.append(record)
+            self.write_report()
+
+    def write_report(self) -> None:
+        report = {
+            "started_at": self.started_at,
+            "wall_seconds": round(sum(stage["wall_seconds"] for stage in self.stages), 3),
+            "stages": self.stages,
+        }
+        try:
+            os.makedirs(os.path.dirname(self.report_path), exist_ok=True)
+            FileWriter.writeAtomic(self.report_path, json.dumps(report, indent=2).encode("utf-8"))
+        except OSError as e:
+            print(f"[WARN] Could not write generation report {self.report_path}: {e}")
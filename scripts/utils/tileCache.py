@@ -0,0 +1,223 @@
+import os
+import hashlib
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from utils.param import globalParam
+from utils.fileWriter import FileWriter
+from utils import metrics
+
+
+# Query parameters holding credentials, they do not change the tiles served
+CREDENTIAL_PARAMS = {"access_token", "accesstoken", "token", "key", "apikey", "api_key", "signature", "sig"}
+
+
+class TileCache:
+    """
+    Content-addressed tile cache shared by every run.
+
+    Tiles are indexed by source/z/x/y and stored once per distinct content under
+    objects/<digest[:2]>/<digest>, so blank or ocean tiles repeated across a
+    region take the space of one. Run directories are populated from the cache
+    with hardlinks. When the cache grows past its disk budget the least recently
+    used blobs are evicted.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, root: str = globalParam.TILE_CACHE_PATH, max_bytes: int = globalParam.TILE_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.objects_path = os.path.join(root, "objects")
+        os.makedirs(self.objects_path, exist_ok=True)
+        self.index_path = os.path.join(root, "index.sqlite")
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+
+        db = self._db()
+        with db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS tiles ("
+                "source TEXT NOT NULL, z INTEGER NOT NULL, x INTEGER NOT NULL, y INTEGER NOT NULL, "
+                "digest TEXT NOT NULL, PRIMARY KEY (source, z, x, y))"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                "digest TEXT PRIMARY KEY, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS blobs_last_access ON blobs (last_access)")
+            db.execute("CREATE INDEX IF NOT EXISTS tiles_digest ON tiles (digest)")
+        self._total_bytes = db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    @classmethod
+    def shared(cls) -> "TileCache":
+        """
+        Return the process wide cache instance.
+        """
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    @staticmethod
+    def source_key(source: str, outputScale: int = 1) -> str:
+        """
+        Derive a short stable key from a tile URL template.
+
+        Credential query parameters are stripped first, so rotating an API key
+        keeps the cached tiles and no key ends up in the cache index.
+
+        Args:
+            source (str): Tile URL template.
+            outputScale (int): Output scale, scaled tiles are cached separately.
+
+        Returns:
+            str: Source key.
+        """
+        parts = urlsplit(source)
+        query = [(name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+                 if name.lower() not in CREDENTIAL_PARAMS]
+        # Placeholders such as {z} stay readable, they are part of the template
+        source = urlunsplit(parts._replace(query=urlencode(query, safe="{}")))
+        key = hashlib.sha1(source.encode("utf-8")).hexdigest()[:16]
+        return key if outputScale == 1 else f"{key}@{outputScale}"
+
+    def _db(self) -> sqlite3.Connection:
+        # sqlite connections cannot be shared between threads
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.index_path, timeout=30)
+            self._local.db = db
+        return db
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.objects_path, digest[:2], digest)
+
+    def get(self, source: str, z: int, x: int, y: int) -> str:
+        """
+        Look up a cached tile and mark it as recently used.
+
+        Args:
+            source (str): Source key from source_key().
+            z (int): Zoom level.
+            x (int): Tile X coordinate.
+            y (int): Tile Y coordinate.
+
+        Returns:
+            str: Path to the cached blob, or None on a miss.
+        """
+        db = self._db()
+        row = db.execute(
+            "SELECT digest FROM tiles WHERE source=? AND z=? AND x=? AND y=?", (source, z, x, y)
+        ).fetchone()
+        if row is None:
+            metrics.TILE_CACHE_REQUESTS.labels("miss").inc()
+            return None
+
+        blob_path = self._blob_path(row[0])
+        if not os.path.isfile(blob_path):
+            metrics.TILE_CACHE_REQUESTS.labels("miss").inc()
+            return None
+
+        metrics.TILE_CACHE_REQUESTS.labels("hit").inc()
+        with self._write_lock, db:
+            db.execute("UPDATE blobs SET last_access=? WHERE digest=?", (time.time(), row[0]))
+        return blob_path
+
+    def contains(self, source: str, z: int, x: int, y: int) -> bool:
+        """
+        Check whether a tile is cached without touching its recency or the hit metrics.
+
+        Args:
+            source (str): Source key from source_key().
+            z (int): Zoom level.
+            x (int): Tile X coordinate.
+            y (int): Tile Y coordinate.
+
+        Returns:
+            bool: True if the tile and its blob are stored.
+        """
+        row = self._db().execute(
+            "SELECT digest FROM tiles WHERE source=? AND z=? AND x=? AND y=?", (source, z, x, y)
+        ).fetchone()
+        return row is not None and os.path.isfile(self._blob_path(row[0]))
+
+    def put(self, source: str, z: int, x: int, y: int, data: bytes) -> str:
+        """
+        Store a tile, deduplicating identical content.
+
+        Args:
+            source (str): Source key from source_key().
+            z (int): Zoom level.
+            x (int): Tile X coordinate.
+            y (int): Tile Y coordinate.
+            data (bytes): Encoded tile.
+
+        Returns:
+            str: Path to the cached blob, or None if the tile does not fit the budget.
+        """
+        if len(data) > self.max_bytes:
+            return None
+
+        digest = hashlib.sha256(data).hexdigest()
+        blob_path = self._blob_path(digest)
+        db = self._db()
+
+        with self._write_lock:
+            if not os.path.isfile(blob_path):
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                FileWriter.writeAtomic(blob_path, data)
+            with db:
+                inserted = db.execute(
+                    "INSERT OR IGNORE INTO blobs (digest, size, last_access) VALUES (?, ?, ?)",
+                    (digest, len(data), time.time())
+                ).rowcount
+                db.execute(
+                    "INSERT OR REPLACE INTO tiles (source, z, x, y, digest) VALUES (?, ?, ?, ?, ?)",
+                    (source, z, x, y, digest)
+                )
+            if inserted:
+                self._total_bytes += len(data)
+            if self._total_bytes > self.max_bytes:
+                self._evict(keep=digest)
+
+        return blob_path
+
+    def _evict(self, keep: str = None) -> None:
+        """
+        Drop least recently used blobs until the cache is back under 90% of its budget.
+
+        Callers must hold the write lock.
+        """
+        db = self._db()
+        # Other processes may have written to the cache, start from the real total
+        self._total_bytes = db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        target = int(self.max_bytes * 0.9)
+
+        evicted = 0
+        rows = db.execute("SELECT digest, size FROM blobs ORDER BY last_access ASC").fetchall()
+        with db:
+            for digest, size in rows:
+                if self._total_bytes <= target:
+                    break
+                if digest == keep:
+                    continue
+                db.execute("DELETE FROM tiles WHERE digest=?", (digest,))
+                db.execute("DELETE FROM blobs WHERE digest=?", (digest,))
+                try:
+                    os.remove(self._blob_path(digest))
+                except FileNotFoundError:
+                    pass
+                self._total_bytes -= size
+                evicted += 1
+
+        print(f"Tile cache evicted {evicted} blobs, {self._total_bytes} bytes in use")
+
+    def stats(self) -> dict:
+        db = self._db()
+        tiles = db.execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+        blobs, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return {"tiles": tiles, "blobs": blobs, "bytes": size, "max_bytes": self.max_bytes}
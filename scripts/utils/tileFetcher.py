@@ -0,0 +1,241 @@
+import os
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from utils.param import globalParam
+from utils import metrics
+
+
+# Status codes worth another attempt, everything else is final
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+
+class FetchResult:
+    """
+    Outcome of a single tile fetch.
+
+    Attributes:
+        url (str): Requested URL.
+        status (int): HTTP status code, or -1 when no response was received.
+        content (bytes): Response body for successful fetches, otherwise None.
+        attempts (int): Number of attempts made.
+        elapsed (float): Total seconds spent including backoff.
+        error (str): Description of the last failure, if any.
+    """
+
+    def __init__(self, url, status=-1, content=None, attempts=0, elapsed=0.0, error=None):
+        self.url = url
+        self.status = status
+        self.content = content
+        self.attempts = attempts
+        self.elapsed = elapsed
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 200 and self.content is not None
+
+    @property
+    def retryable(self) -> bool:
+        return self.status == -1 or self.status in RETRYABLE_STATUS
+
+
+class RateLimiter:
+    """
+    Token bucket limiting how many requests per second are started.
+
+    Shared by all threads of a download so the provider sees a bounded request
+    rate whatever the number of workers.
+    """
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, rate: float, burst: int = None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, name: str, rate: float) -> "RateLimiter":
+        """
+        Return the limiter of a provider shared by all downloads of the current
+        process, so concurrent jobs and regions do not multiply its request rate.
+
+        Args:
+            name (str): Provider, e.g. "dem".
+            rate (float): Requests per second, replaces the rate of an existing limiter.
+        """
+        with cls._shared_lock:
+            limiter = cls._shared.get(name)
+            if limiter is None:
+                limiter = cls._shared[name] = cls(rate)
+            elif limiter.rate != rate:
+                with limiter._lock:
+                    limiter.rate = rate
+                    limiter.capacity = max(1, int(rate))
+                    limiter._tokens = min(limiter._tokens, limiter.capacity)
+            return limiter
+
+    def acquire(self) -> None:
+        """
+        Block until a request may be started. A rate of 0 or less disables limiting.
+        """
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def consume(self, amount: float) -> None:
+        """
+        Charge an amount already used, such as downloaded bytes, and block until
+        the bucket has paid it back. A rate of 0 or less disables limiting.
+        """
+        if self.rate <= 0 or amount <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # The balance may go negative, later callers then wait for the debt as well
+            self._tokens -= amount
+            wait = -self._tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+class TileFetcher:
+    """
+    Pooled keep-alive HTTP client shared by the imagery, DEM and vector tile downloads.
+
+    Every fetch is bounded by a deadline covering connect, body read and retries,
+    so a stalled socket can never hang a worker.
+    """
+
+    _shared = None
+    _shared_pid = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self,
+                 pool_size: int = globalParam.FETCH_POOL_SIZE,
+                 connect_timeout: float = globalParam.FETCH_CONNECT_TIMEOUT,
+                 read_timeout: float = globalParam.FETCH_READ_TIMEOUT,
+                 deadline: float = globalParam.FETCH_DEADLINE,
+                 retries: int = globalParam.FETCH_RETRIES,
+                 backoff: float = globalParam.FETCH_BACKOFF,
+                 backoff_max: float = globalParam.FETCH_BACKOFF_MAX,
+                 verify: bool = globalParam.FETCH_VERIFY_SSL):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+
+        self.session = requests.Session()
+        self.session.verify = verify
+        self.session.headers["User-Agent"] = "gazebo_terrain_generator"
+        # Retries are handled here so they share the per-request deadline
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @classmethod
+    def shared(cls) -> "TileFetcher":
+        """
+        Return the fetcher shared by all threads of the current process.
+
+        A new instance is created after a fork since pooled sockets must not be
+        shared between processes.
+        """
+        with cls._shared_lock:
+            if cls._shared is None or cls._shared_pid != os.getpid():
+                cls._shared = cls()
+                cls._shared_pid = os.getpid()
+            return cls._shared
+
+    def _backoff_delay(self, attempt: int) -> float:
+        # Full jitter keeps concurrent workers from retrying in lockstep
+        delay = min(self.backoff_max, self.backoff * (2 ** attempt))
+        return random.uniform(0, delay)
+
+    def _get(self, url: str, remaining: float) -> tuple:
+        """
+        Perform one GET, reading the body in chunks so the deadline also
+        bounds slow transfers.
+        """
+        timeout = (min(self.connect_timeout, remaining), min(self.read_timeout, remaining))
+        started = time.monotonic()
+        with self.session.get(url, timeout=timeout, stream=True) as response:
+            if response.status_code != 200:
+                return response.status_code, None
+            chunks = []
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                chunks.append(chunk)
+                if time.monotonic() - started > remaining:
+                    raise requests.exceptions.Timeout(f"Deadline of {remaining:.1f}s exceeded while reading body")
+            return 200, b"".join(chunks)
+
+    def fetch(self, url: str, deadline: float = None, source: str = "imagery") -> FetchResult:
+        """
+        Fetch a URL with bounded retries and jittered exponential backoff.
+
+        Args:
+            url (str): URL to fetch.
+            deadline (float): Seconds allowed for all attempts, defaults to the fetcher deadline.
+            source (str): Kind of tile fetched, "imagery", "dem" or "vector", used to label metrics.
+
+        Returns:
+            FetchResult: The outcome of the last attempt.
+        """
+        with metrics.TILE_FETCH_ACTIVE.labels(source).track_inprogress():
+            result = self._fetch(url, self.deadline if deadline is None else deadline)
+
+        metrics.TILE_FETCH_SECONDS.labels(source).observe(result.elapsed)
+        if result.attempts > 1:
+            metrics.TILE_FETCH_RETRIES.labels(source).inc(result.attempts - 1)
+        if result.ok:
+            metrics.TILE_FETCH_BYTES.labels(source).inc(len(result.content))
+        else:
+            metrics.TILE_FETCH_FAILURES.labels(source, str(result.status)).inc()
+        return result
+
+    def _fetch(self, url: str, deadline: float) -> FetchResult:
+        started = time.monotonic()
+        result = FetchResult(url)
+
+        for attempt in range(self.retries + 1):
+            remaining = deadline - (time.monotonic() - started)
+            if remaining <= 0:
+                result.error = result.error or "Deadline exceeded"
+                break
+
+            result.attempts = attempt + 1
+            try:
+                result.status, result.content = self._get(url, remaining)
+                result.error = None if result.status == 200 else f"HTTP {result.status}"
+            except requests.exceptions.RequestException as e:
+                result.status, result.content, result.error = -1, None, str(e)
+
+            if result.ok or not result.retryable:
+                break
+
+            delay = self._backoff_delay(attempt)
+            if time.monotonic() - started + delay >= deadline:
+                break
+            time.sleep(delay)
+
+        result.elapsed = time.monotonic() - started
+        return result
@@ -0,0 +1,334 @@
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from utils.param import globalParam
+from utils.fileWriter import FileWriter
+
+
+class TileStore(ABC):
+    """
+    Interface of the storage behind a set of z/x/y tiles.
+
+    Implementations must be safe to share between threads and picklable so the
+    stitchers can hand them to worker processes.
+    """
+
+    @abstractmethod
+    def exists(self, z: int, x: int, y: int) -> bool:
+        pass
+
+    @abstractmethod
+    def get(self, z: int, x: int, y: int) -> bytes:
+        """
+        Returns:
+            bytes: The encoded tile, or None if it is not stored.
+        """
+
+    @abstractmethod
+    def put(self, z: int, x: int, y: int, data: bytes) -> None:
+        pass
+
+    def put_file(self, z: int, x: int, y: int, path: str) -> None:
+        """
+        Store the tile held in an existing file.
+        """
+        with open(path, "rb") as tile_file:
+            self.put(z, x, y, tile_file.read())
+
+    @abstractmethod
+    def columns(self, z: int) -> dict:
+        """
+        List stored tiles of a zoom level.
+
+        Returns:
+            dict: Sorted list of tile y numbers keyed by tile x number.
+        """
+
+    def set_metadata(self, metadata: dict) -> None:
+        pass
+
+    def flush(self) -> None:
+        pass
+
+    @abstractmethod
+    def close(self) -> None:
+        """
+        Write pending tiles and release the resources of the store.
+        """
+
+
+class DirectoryTileStore(TileStore):
+    """
+    One file per tile laid out as <root>/<z>/<x>/<y>.<ext>.
+    """
+
+    def __init__(self, root: str, ext: str = "png"):
+        self.root = root
+        self.ext = ext
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def path(self, z: int, x: int, y: int) -> str:
+        return os.path.join(self.root, str(z), str(x), f"{y}.{self.ext}")
+
+    def exists(self, z, x, y):
+        return os.path.isfile(self.path(z, x, y))
+
+    def get(self, z, x, y):
+        try:
+            with open(self.path(z, x, y), "rb") as tile_file:
+                return tile_file.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, z, x, y, data):
+        FileWriter.addTileData(self._lock, self.path(z, x, y), data, x, y, z)
+
+    def put_file(self, z, x, y, path):
+        FileWriter.linkTile(self._lock, self.path(z, x, y), path, x, y, z)
+
+    def columns(self, z):
+        zoom_dir = os.path.join(self.root, str(z))
+        if not os.path.isdir(zoom_dir):
+            return {}
+
+        suffix = "." + self.ext
+        columns = {}
+        for x_dir in os.listdir(zoom_dir):
+            if not x_dir.isdigit():
+                continue
+            ys = [
+                int(name[:-len(suffix)]) for name in os.listdir(os.path.join(zoom_dir, x_dir))
+                if name.endswith(suffix) and name[:-len(suffix)].isdigit()
+            ]
+            columns[int(x_dir)] = sorted(ys)
+        return columns
+
+    def close(self):
+        # Tiles are written straight to their files, there is nothing to release
+        pass
+
+
+class MBTilesTileStore(TileStore):
+    """
+    Tiles kept in a single MBTiles (SQLite) file at <root>/tiles.mbtiles.
+
+    Writes are buffered and inserted in batches inside one transaction. Rows use
+    the TMS scheme required by the MBTiles specification.
+    """
+
+    FILE_NAME = "tiles.mbtiles"
+
+    def __init__(self, root: str, batch_size: int = globalParam.MBTILES_BATCH_SIZE, read_only: bool = False):
+        self.root = root
+        self.path = os.path.join(root, self.FILE_NAME)
+        self.batch_size = batch_size
+        # Read-only stores never create the directory, the file or its tables
+        self.read_only = read_only
+        self._lock = threading.RLock()
+        self._pending = {}
+        self._db = None
+        self._db_pid = None
+
+    def __getstate__(self):
+        self.flush()
+        state = self.__dict__.copy()
+        for key in ("_lock", "_db", "_db_pid"):
+            del state[key]
+        state["_pending"] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+        self._db = None
+        self._db_pid = None
+
+    def _conn(self) -> sqlite3.Connection:
+        # Callers must hold self._lock; reconnect after a fork
+        if self._db is None or self._db_pid != os.getpid():
+            if self.read_only:
+                self._db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=30, check_same_thread=False)
+                self._db_pid = os.getpid()
+                return self._db
+            os.makedirs(self.root, exist_ok=True)
+            self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._db_pid = os.getpid()
+            with self._db:
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS tiles ("
+                    "zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)"
+                )
+                self._db.execute(
+                    "CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row)"
+                )
+        return self._db
+
+    @staticmethod
+    def _tms_row(z: int, y: int) -> int:
+        return (1 << z) - 1 - y
+
+    def exists(self, z, x, y):
+        with self._lock:
+            if (z, x, y) in self._pending:
+                return True
+            row = self._conn().execute(
+                "SELECT 1 FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?",
+                (z, x, self._tms_row(z, y))
+            ).fetchone()
+            return row is not None
+
+    def get(self, z, x, y):
+        with self._lock:
+            if (z, x, y) in self._pending:
+                return self._pending[(z, x, y)]
+            row = self._conn().execute(
+                "SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?",
+                (z, x, self._tms_row(z, y))
+            ).fetchone()
+            return bytes(row[0]) if row else None
+
+    def put(self, z, x, y, data):
+        with self._lock:
+            self._pending[(z, x, y)] = bytes(data)
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def columns(self, z):
+        with self._lock:
+            self.flush()
+            rows = self._conn().execute(
+                "SELECT tile_column, tile_row FROM tiles WHERE zoom_level=?", (z,)
+            ).fetchall()
+        columns = {}
+        for x, tms_row in rows:
+            columns.setdefault(x, []).append(self._tms_row(z, tms_row))
+        return {x: sorted(ys) for x, ys in columns.items()}
+
+    def set_metadata(self, metadata):
+        with self._lock:
+            db = self._conn()
+            with db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)",
+                    [(str(name), str(value)) for name, value in metadata.items()]
+                )
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            rows = [
+                (z, x, self._tms_row(z, y), sqlite3.Binary(data))
+                for (z, x, y), data in self._pending.items()
+            ]
+            db = self._conn()
+            with db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+            self._pending.clear()
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            if self._db is not None and self._db_pid == os.getpid():
+                self._db.close()
+            self._db = None
+
+
+def detect_tile_store_backend(root: str) -> str:
+    """
+    Pick the backend of an existing tile directory, falling back to globalParam.TILE_STORE.
+    """
+    if os.path.isfile(os.path.join(root, MBTilesTileStore.FILE_NAME)):
+        return "mbtiles"
+    if os.path.isdir(root) and any(name.isdigit() for name in os.listdir(root)):
+        return "directory"
+    return globalParam.TILE_STORE
+
+
+_open_stores = {}
+_open_stores_lock = threading.Lock()
+
+
+def open_tile_store(root: str, backend: str = None, ext: str = "png") -> TileStore:
+    """
+    Open the tile store of a directory, sharing one instance per root so
+    concurrent writers use the same batch buffer.
+
+    Args:
+        root (str): Directory holding the tiles.
+        backend (str): "directory" or "mbtiles", detected from the directory
+            content when omitted.
+        ext (str): File extension used by the directory backend.
+
+    Returns:
+        TileStore: The opened store.
+    """
+    backend = backend or detect_tile_store_backend(root)
+    key = (os.path.abspath(root), backend)
+    with _open_stores_lock:
+        store = _open_stores.get(key)
+        if store is None:
+            if backend == "mbtiles":
+                store = MBTilesTileStore(root)
+            elif backend == "directory":
+                store = DirectoryTileStore(root, ext)
+            else:
+                raise ValueError(f"Unknown tile store backend: {backend}")
+            _open_stores[key] = store
+        return store
+
+
+def close_tile_store(root: str, backend: str = None) -> None:
+    """
+    Flush and close a store opened with open_tile_store.
+    """
+    backend = backend or detect_tile_store_backend(root)
+    with _open_stores_lock:
+        store = _open_stores.pop((os.path.abspath(root), backend), None)
+    if store is not None:
+        store.close()
+
+
+def read_tile(root: str, z: int, x: int, y: int) -> bytes:
+    """
+    Read one tile of a directory without creating anything.
+
+    A store already opened with open_tile_store is used as is, so tiles still
+    buffered by a running download are seen. Otherwise the store is opened
+    read-only and closed again, nothing is cached for roots that are only read.
+
+    Returns:
+        bytes: The encoded tile, or None if it is not stored.
+    """
+    backend = detect_tile_store_backend(root)
+    with _open_stores_lock:
+        store = _open_stores.get((os.path.abspath(root), backend))
+    if store is not None:
+        return store.get(z, x, y)
+
+    if backend == "mbtiles":
+        if not os.path.isfile(os.path.join(root, MBTilesTileStore.FILE_NAME)):
+            return None
+        store = MBTilesTileStore(root, read_only=True)
+    else:
+        store = DirectoryTileStore(root)
+    try:
+        return store.get(z, x, y)
+    finally:
+        if backend == "mbtiles":
+            store.close()
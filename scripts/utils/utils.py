@@ -3,14 +3,14 @@
 from urllib.parse import urlparse
 from urllib.parse import parse_qs
 from urllib.parse import parse_qsl
-import urllib.request
 import uuid
-import uuid
-import ssl
-import os
+import io
 import cv2
 import math
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from utils.param import globalParam
+from utils.tileFetcher import TileFetcher
 from PIL import Image
 
 class Utils:
@@ -102,36 +102,31 @@ class Utils:
 		return canvas
 
 	@staticmethod
-	def downloadFile(url, destination, x, y, z):
+	def downloadTile(url, x, y, z):
+		"""
+		Download a tile into memory.
 
-		url = Utils.qualifyURL(url, x, y, z)
+		Returns:
+			tuple: HTTP status code (-1 on connection errors) and the tile bytes or None.
+		"""
 
-		code = 0
+		url = Utils.qualifyURL(url, x, y, z)
 
-		# monkey patching SSL certificate issue
-		# DONT use it in a prod/sensitive environment
-		ssl._create_default_https_context = ssl._create_unverified_context
+		result = TileFetcher.shared().fetch(url)
 
-		try:
-			path, response = urllib.request.urlretrieve(url, destination)
-			code = 200
-		except urllib.error.URLError as e:
-			if not hasattr(e, "code"):
-				print(e)
-				code = -1
-			else:
-				code = e.code
+		if result.status == -1:
+			print(f"Failed to download {url}: {result.error}")
 
-		return code
+		return result.status, result.content
 
 
 	@staticmethod
-	def downloadFileScaled(url, destination, x, y, z, outputScale):
+	def downloadTileScaled(url, x, y, z, outputScale):
 		
 
 
 		if outputScale == 1:
-			return Utils.downloadFile(url, destination, x, y, z)
+			return Utils.downloadTile(url, x, y, z)
 
 		elif outputScale == 2:
 
@@ -139,81 +134,150 @@ class Utils:
 			childImages = []
 
 			for childX, childY, childZ in childTiles:
-				
-				tempFile = Utils.randomString() + ".jpg"
-				tempFilePath = os.path.join(globalParam.TEMPFILE_PATH, tempFile)
 
-				code = Utils.downloadFile(url, tempFilePath, childX, childY, childZ)
+				code, data = Utils.downloadTile(url, childX, childY, childZ)
 
 				if code == 200:
-					image = Image.open(tempFilePath)
+					image = Image.open(io.BytesIO(data))
 				else:
-					return code
+					return code, None
 
 				childImages.append(image)
 			
 			canvas = Utils.mergeQuadTile(childImages)
-			# canvas.save(destination, "PNG")
-			canvas.save(destination, "JPEG")
+			output = io.BytesIO()
+			canvas.save(output, "JPEG")
 			
-			return 200
+			return 200, output.getvalue()
 
 		#TODO implement custom scale
 
+	@staticmethod
+	def makeThumbnail(data, size=globalParam.PREVIEW_SIZE):
+		"""
+		Encode a small JPEG preview of a tile.
+
+		Args:
+			data (bytes): Encoded tile image.
+			size (int): Edge length of the preview in pixels.
+
+		Returns:
+			bytes: JPEG encoded thumbnail, or None if the tile cannot be decoded.
+		"""
+		image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+		if image is None:
+			return None
+		thumbnail = cv2.resize(image, (size, size), interpolation=cv2.INTER_AREA)
+		ok, encoded = cv2.imencode(".jpg", thumbnail, [cv2.IMWRITE_JPEG_QUALITY, 70])
+		return encoded.tobytes() if ok else None
+
 class ConcatImage:
-    def __init__(self,**kwargs):
+    def __init__(self, temp_path: str = globalParam.TEMP_PATH, job=None, **kwargs):
         super().__init__(**kwargs)
+        # Scratch directory for intermediate images, one per job
+        self.temp_path = temp_path
+        self.job = job
+
+    def __getstate__(self):
+        # The job handle holds locks and is only needed in the parent process
+        state = self.__dict__.copy()
+        state["job"] = None
+        return state
 
-    def get_x_tile_directories(self, image_dir: str, tile_boundaries: dict) -> list:
+    def report_total(self, total: int) -> None:
+        """
+        Report the number of work items of the current stage to the owning job.
         """
-        Get a numerically sorted list of X-tile directories within tile boundary limits.
+        if self.job is not None:
+            self.job.set_total(total)
+
+    def report_progress(self, count: int = 1, nbytes: int = 0) -> None:
+        """
+        Report processed work items of the current stage to the owning job.
+        """
+        if self.job is not None:
+            self.job.advance(count, nbytes)
+
+    def get_x_tile_directories(self, store, zoom: int, tile_boundaries: dict) -> list:
+        """
+        Get a numerically sorted list of X-tile columns within tile boundary limits.
 
         Args:
-            image_dir (str): Path to the zoom level directory containing X-tile directories.
+            store (TileStore): Tile store holding the tiles.
+            zoom (int): Zoom level of the tiles.
             tile_boundaries (dict): Dictionary of tile coordinate bounds.
 
         Returns:
-            list: Sorted list of valid X-tile directory names (as strings).
+            list: Sorted list of valid X-tile numbers.
         """
-        # List only directory names that are numeric (tile x)
-        dir_list = [d for d in os.listdir(image_dir) if d.isdigit()]
-
         min_x = min(tile_boundaries["southwest"][0], tile_boundaries["southeast"][0])
         max_x = max(tile_boundaries["southwest"][0], tile_boundaries["southeast"][0])
 
-        # Filter and sort X directories
-        x_dirs = sorted([d for d in dir_list if min_x <= int(d) <= max_x], key=lambda x: int(x))
-        return x_dirs
-       
-    def process_column_image(self, dir_name, image_dir, tile_boundaries, temp_output_dir):
-        image_list = []
-        max_y = max(tile_boundaries["northwest"][1], tile_boundaries["southwest"][1])
-        min_y = min(tile_boundaries["northwest"][1], tile_boundaries["southwest"][1])
+        return sorted(x for x in store.columns(zoom) if min_x <= x <= max_x)
 
-        dir_path = os.path.join(image_dir, dir_name)
-        for image in os.listdir(dir_path):
-            tile_num = int(image.split('.')[0])
-            if min_y <= tile_num <= max_y:
-                image_list.append(os.path.join(dir_path, image))
+    def mosaic(self, store, zoom: int, tile_boundaries: dict, workers: int = globalParam.MOSAIC_DECODE_WORKERS) -> np.ndarray:
+        """
+        Stitch the tiles within the tile boundaries into one image.
 
-        image_list.sort()
-        images = [cv2.imread(path) for path in image_list if os.path.exists(path)]
-        if images:
-            output_file = os.path.join(temp_output_dir, dir_name + '.png')
-            cv2.imwrite(output_file, cv2.vconcat(images))
+        The output array is allocated once and every tile is decoded straight
+        into its slice on a thread pool, OpenCV releases the GIL while decoding.
+        Columns with fewer tiles than the first one are left out, as they would
+        not line up.
 
-    @staticmethod
-    def _run_instance_method(args : tuple) -> None:
-        """
-        Run an instance method with the provided arguments.
         Args:
-            args (tuple): A tuple containing the instance and its method arguments.
+            store (TileStore): Tile store holding the tiles.
+            zoom (int): Zoom level of the tiles.
+            tile_boundaries (dict): Dictionary of tile coordinate bounds.
+            workers (int): Number of decoding threads.
+
         Returns:
-            None
+            np.ndarray: BGR image, or None if there are no tiles.
+
+        Raises:
+            ValueError: If none of the tiles can be decoded.
         """
-        instance, dir_name, image_dir, tile_boundaries, temp_output_dir = args
-        instance.process_column_image(dir_name, image_dir, tile_boundaries, temp_output_dir)
-    
+        max_y = max(tile_boundaries["northwest"][1], tile_boundaries["southwest"][1])
+        min_y = min(tile_boundaries["northwest"][1], tile_boundaries["southwest"][1])
+
+        stored = store.columns(zoom)
+        columns = []
+        for x in self.get_x_tile_directories(store, zoom, tile_boundaries):
+            ys = [y for y in stored.get(x, []) if min_y <= y <= max_y]
+            if ys and (not columns or len(ys) == len(columns[0][1])):
+                columns.append((x, ys))
+        if not columns:
+            return None
+
+        def decode(x, y):
+            data = store.get(zoom, x, y)
+            if data is None:
+                return None
+            return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+        tasks = [(col, row, x, y) for col, (x, ys) in enumerate(columns) for row, y in enumerate(ys)]
+        # The tile size comes from the first tile that decodes, corrupt tiles are left black
+        for col, row, x, y in tasks:
+            first = decode(x, y)
+            if first is not None:
+                first_at = (col, row)
+                break
+        else:
+            raise ValueError(f"None of the {len(tasks)} tiles at zoom {zoom} could be decoded")
+        tile_h, tile_w = first.shape[:2]
+        image = np.zeros((len(columns[0][1]) * tile_h, len(columns) * tile_w, 3), dtype=np.uint8)
+
+        def place(task):
+            col, row, x, y = task
+            tile = first if (col, row) == first_at else decode(x, y)
+            if tile is not None and tile.shape[:2] == (tile_h, tile_w):
+                image[row * tile_h:(row + 1) * tile_h, col * tile_w:(col + 1) * tile_w] = tile
+
+        self.report_total(len(tasks))
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="mosaic") as executor:
+            for _ in executor.map(place, tasks):
+                self.report_progress()
+        return image
+
     @staticmethod
     def are_dimensions_equal(img1, img2) -> bool:
         """
@@ -231,3 +295,28 @@ class ConcatImage:
 
 
 
+
+    @staticmethod
+    def chunk_name(model_name: str, row: int, col: int) -> str:
+        """
+        Name of the terrain sub-model at a row (from the north) and column (from the west).
+        """
+        return f"{model_name}_chunk_{row}_{col}"
+
+    @staticmethod
+    def chunk_edges(length: int, chunks: int, shared: bool = True) -> list:
+        """
+        Split an image axis into chunks of near equal size.
+
+        Args:
+            length (int): Number of pixels along the axis.
+            chunks (int): Number of chunks.
+            shared (bool): Whether neighbouring chunks share the pixel on their
+                common edge, as heightmap samples must for seamless terrain.
+
+        Returns:
+            list: chunks + 1 pixel indices, chunk i spans edges[i] to edges[i + 1],
+            inclusive when shared and exclusive otherwise.
+        """
+        span = length - 1 if shared else length
+        return [round(i * span / chunks) for i in range(chunks + 1)]
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules are imported as utils.* with scripts/ as the working directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
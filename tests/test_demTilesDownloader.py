@@ -0,0 +1,81 @@
+import threading
+
+import pytest
+
+from utils import demTilesDownloader
+from utils.demTilesDownloader import MISSING_AT_SOURCE, download_dem_data
+from utils.maptileUtils import maptile_utiles
+from utils.negativeTileCache import NegativeTileCache
+
+
+BOUNDS = {"northwest": [47.45, 8.40], "southeast": [47.30, 8.60]}
+
+
+class Progress:
+    def __init__(self):
+        self.total = self.done = 0
+        self.lock = threading.Lock()
+
+    def set_total(self, total):
+        self.total = total
+
+    def advance(self, count=1, nbytes=0):
+        with self.lock:
+            self.done += count
+
+    def check_cancelled(self):
+        pass
+
+
+@pytest.fixture
+def misses(tmp_path, monkeypatch):
+    cache = NegativeTileCache(str(tmp_path / "cache"))
+    monkeypatch.setattr(NegativeTileCache, "_shared", cache)
+    return cache
+
+
+def test_missing_and_failed_tiles_are_reported_and_counted(tmp_path, monkeypatch, misses):
+    attempts = {}
+    lock = threading.Lock()
+
+    def fake_download(task, rate_limiter=None, bandwidth=None):
+        zoom, x, y, _ = task
+        with lock:
+            attempts[x, y] = attempts.get((x, y), 0) + 1
+            attempt = attempts[x, y]
+        kind = (x + y) % 4
+        if kind == 0:
+            return 100, None
+        if kind == 1:
+            return 0, MISSING_AT_SOURCE
+        if kind == 2:
+            # Succeeds on the retry pass
+            return (100, None) if attempt == 2 else (0, "timeout")
+        return 0, "timeout"
+
+    monkeypatch.setattr(demTilesDownloader, "download_tile_image", fake_download)
+    progress = Progress()
+    failed = download_dem_data(BOUNDS, str(tmp_path / "dem"), zoom_range=(13, 13), progress=progress,
+                               workers=4, rate_limit=0)
+
+    nw_lat, nw_lon = BOUNDS["northwest"]
+    se_lat, se_lon = BOUNDS["southeast"]
+    tiles = maptile_utiles.get_tile_range([nw_lon, se_lat, se_lon, nw_lat], 13)
+    assert {(x, y): error for _, x, y, error in failed} == {
+        (x, y): MISSING_AT_SOURCE if (x + y) % 4 == 1 else "timeout"
+        for x, y in tiles if (x + y) % 4 in (1, 3)
+    }
+    assert progress.total == progress.done == len(tiles)
+    # Missing tiles are not retried, transient failures are retried once
+    assert all(attempts[x, y] == (2 if (x + y) % 4 in (2, 3) else 1) for x, y in tiles)
+
+
+def test_tiles_known_missing_are_not_requested(tmp_path, monkeypatch, misses):
+    misses.record("dem", 13, 4287, 2868, 404)
+    requested = []
+    monkeypatch.setattr(demTilesDownloader, "download_tile_image",
+                        lambda task, rate_limiter=None, bandwidth=None: requested.append(task[1:3]) or (100, None))
+    failed = download_dem_data({"northwest": [47.375, 8.405], "southeast": [47.37, 8.41]}, str(tmp_path / "dem"),
+                               zoom_range=(13, 13), rate_limit=0)
+    assert (4287, 2868) not in requested
+    assert (13, 4287, 2868, MISSING_AT_SOURCE) in failed
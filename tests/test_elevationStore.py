@@ -0,0 +1,143 @@
+import cv2
+import numpy as np
+import pytest
+
+from utils.elevationStore import ElevationTileStore
+from utils.maptileUtils import maptile_utiles
+
+
+def encode_terrain_rgb(grid: np.ndarray, ext: str = ".png") -> bytes:
+    """
+    Encode decimetre elevations the way Mapbox Terrain-RGB does, losslessly.
+    """
+    value = grid.astype(np.int64) + 100000
+    bgr = np.stack([value & 255, (value >> 8) & 255, (value >> 16) & 255], axis=-1).astype(np.uint8)
+    params = [cv2.IMWRITE_WEBP_QUALITY, 101] if ext == ".webp" else []
+    return cv2.imencode(ext, bgr, params)[1].tobytes()
+
+
+def sample_grid(seed: int = 0, shape=(16, 16)) -> np.ndarray:
+    return np.random.default_rng(seed).integers(-4000, 88000, shape).astype(np.int32)
+
+
+def test_decode_terrain_rgb():
+    # BGR pixels, R=1 G=134 B=160 encodes sea level and black the lowest value, -10000 m
+    img = np.array([[[160, 134, 1], [0, 0, 0], [255, 255, 255]]], dtype=np.uint8)
+    grid = ElevationTileStore.decode_terrain_rgb(img)
+    assert grid.dtype == np.int32
+    assert grid.tolist() == [[0, -100000, 2 ** 24 - 1 - 100000]]
+
+
+@pytest.mark.parametrize("storage, ext", [("elevation", ".png"), ("webp", ".webp")])
+def test_put_encoded_round_trip(tmp_path, storage, ext):
+    store = ElevationTileStore(str(tmp_path), storage)
+    grid = sample_grid()
+    store.put_encoded(13, 4290, 2868, encode_terrain_rgb(grid, ext))
+    np.testing.assert_array_equal(store.get_elevation(13, 4290, 2868), grid)
+    assert store.get_elevation(13, 4290, 2869) is None
+    assert store.exists(13, 4290, 2868)
+
+
+@pytest.mark.parametrize("storage", ["elevation", "webp"])
+def test_put_encoded_rejects_invalid_tiles(tmp_path, storage):
+    store = ElevationTileStore(str(tmp_path), storage)
+    with pytest.raises(ValueError):
+        store.put_encoded(13, 0, 0, b"<html>rate limited</html>")
+    assert not store.exists(13, 0, 0)
+
+
+def test_unknown_storage(tmp_path):
+    with pytest.raises(ValueError):
+        ElevationTileStore(str(tmp_path), "tiff")
+
+
+def points_at_pixels(x, y, zoom, shape, rows, cols, offset=0.5):
+    """
+    Latitudes and longitudes of positions inside pixels of a tile, offset from their top-left corner.
+    """
+    height, width = shape
+    fx = (np.asarray(cols) + offset) / width
+    fy = 1 - (np.asarray(rows) + offset) / height
+    lons, lats = maptile_utiles.tile_fraction_to_lon_lat(np.full(fx.shape, x), np.full(fx.shape, y), zoom, fx, fy)
+    return lats, lons
+
+
+def test_elevations_at_samples_the_pixel_of_each_point(tmp_path):
+    store = ElevationTileStore(str(tmp_path))
+    grid = sample_grid(1)
+    store.put_elevation(13, 4290, 2868, grid)
+    store.put_elevation(13, 4291, 2868, grid + 10)
+    rows, cols = np.arange(16), np.arange(16)[::-1]
+    lats, lons = points_at_pixels(4290, 2868, 13, grid.shape, rows, cols)
+    east_lats, east_lons = points_at_pixels(4291, 2868, 13, grid.shape, rows, cols)
+
+    heights = store.elevations_at(np.concatenate([lats, east_lats]), np.concatenate([lons, east_lons]), 13)
+    np.testing.assert_allclose(heights[:16], grid[rows, cols] * 0.1)
+    np.testing.assert_allclose(heights[16:], (grid[rows, cols] + 10) * 0.1)
+    assert store.elevation_at(lats[3], lons[3], 13) == pytest.approx(grid[3, 12] * 0.1)
+
+
+def test_elevations_at_interpolates_between_pixel_centres(tmp_path):
+    store = ElevationTileStore(str(tmp_path))
+    grid = sample_grid(2)
+    store.put_elevation(13, 4290, 2868, grid)
+    rows, cols = np.array([4, 9]), np.array([7, 2])
+
+    lats, lons = points_at_pixels(4290, 2868, 13, grid.shape, rows, cols)
+    np.testing.assert_allclose(store.elevations_at(lats, lons, 13, bilinear=True), grid[rows, cols] * 0.1, atol=1e-6)
+
+    # Half way between four pixel centres
+    lats, lons = points_at_pixels(4290, 2868, 13, grid.shape, rows, cols, offset=1.0)
+    expected = (grid[rows, cols] + grid[rows, cols + 1] + grid[rows + 1, cols] + grid[rows + 1, cols + 1]) / 4 * 0.1
+    np.testing.assert_allclose(store.elevations_at(lats, lons, 13, bilinear=True), expected, atol=1e-6)
+
+
+def test_elevations_at_missing_tiles(tmp_path):
+    store = ElevationTileStore(str(tmp_path))
+    lats, lons = points_at_pixels(4290, 2868, 13, (16, 16), [0, 5], [0, 5])
+    assert np.isnan(store.elevations_at(lats, lons, 13)).all()
+    assert store.elevation_at(lats[0], lons[0], 13) is None
+    assert store.elevations_at([], [], 13).size == 0
+
+    # Missing tiles are not cached, a later download is picked up
+    store.put_elevation(13, 4290, 2868, sample_grid(3))
+    assert not np.isnan(store.elevations_at(lats, lons, 13)).any()
+
+
+def test_point_lookups_keep_a_bounded_tile_cache(tmp_path):
+    store = ElevationTileStore(str(tmp_path), cache_tiles=2)
+    for x in range(4290, 4294):
+        store.put_elevation(13, x, 2868, sample_grid(x))
+        lats, lons = points_at_pixels(x, 2868, 13, (16, 16), [1], [1])
+        store.elevations_at(lats, lons, 13)
+    assert list(store._tiles) == [(13, 4292, 2868), (13, 4293, 2868)]
+
+
+@pytest.fixture
+def dem_3x2(tmp_path):
+    store = ElevationTileStore(str(tmp_path))
+    for x in range(100, 103):
+        for y in range(200, 202):
+            store.put_elevation(13, x, y, sample_grid(x * 10 + y))
+    return store
+
+
+@pytest.mark.parametrize("rows, cols", [((0, 32), (0, 48)), ((5, 6), (7, 8)), ((10, 27), (3, 45)), ((16, 32), (32, 48))])
+def test_read_window_matches_the_mosaic(dem_3x2, rows, cols):
+    full = dem_3x2.mosaic(13, (100, 102), (200, 201))
+    window = dem_3x2.read_window(13, (100, 102), (200, 201), rows, cols)
+    np.testing.assert_array_equal(window, full[rows[0]:rows[1], cols[0]:cols[1]])
+
+
+def test_read_window_fills_missing_tiles(dem_3x2):
+    dem_3x2.put_elevation(13, 101, 202, sample_grid(5))
+    # Tile 100/202 is missing from the third row of the range
+    window = dem_3x2.read_window(13, (100, 101), (200, 202), (20, 40), (10, 20), tile_shape=(16, 16), fill=0)
+    full = dem_3x2.mosaic(13, (100, 101), (200, 202), fill=0)
+    np.testing.assert_array_equal(window, full[20:40, 10:20])
+    assert (window[12:, :6] == 0).all()
+
+    with pytest.raises(FileNotFoundError):
+        dem_3x2.read_window(13, (100, 101), (200, 202), (20, 40), (10, 20))
+    with pytest.raises(FileNotFoundError):
+        dem_3x2.mosaic(13, (100, 101), (200, 202))
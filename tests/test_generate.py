@@ -0,0 +1,21 @@
+import generate
+from utils.jobManager import Job
+from utils.param import globalParam
+
+
+def test_watch_prints_status_of_job_finishing_while_draining(monkeypatch, capsys):
+    monkeypatch.setattr(globalParam, "SSE_PROGRESS_INTERVAL", 0)
+    job = Job("zurich")
+    job.set_status("in_progress")
+    events_since = job.events_since
+
+    def finish_while_draining(index):
+        events = events_since(index)
+        if not job.finished:
+            job.set_status("failed", "no DEM")
+        return events
+
+    monkeypatch.setattr(job, "events_since", finish_while_draining)
+    generate.watch([job])
+    lines = capsys.readouterr().out.splitlines()
+    assert lines == ["[zurich] in_progress", "[zurich] failed: no DEM"]
@@ -0,0 +1,60 @@
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils.heightMapGenerator import HeightmapGenerator
+from utils.param import globalParam
+
+
+@pytest.fixture
+def model_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(globalParam, "GAZEBO_MODEL_PATH", str(tmp_path))
+    return tmp_path
+
+
+def write_chunks(model_path, heightmap, chunks):
+    generator = HeightmapGenerator()
+    for row in range(chunks):
+        for col in range(chunks):
+            os.makedirs(model_path / generator.chunk_name("terrain", row, col) / "textures")
+    layout = generator.write_heightmap_chunks("terrain", heightmap, chunks)
+    maps = {}
+    for chunk in layout:
+        path = model_path / chunk["name"] / "textures" / (chunk["name"] + "_height_map.tif")
+        maps[chunk["row"], chunk["col"]] = np.asarray(Image.open(path))
+    return layout, maps
+
+
+@pytest.mark.parametrize("shape, chunks", [((301, 257), 2), ((400, 523), 3), ((129, 129), 4)])
+def test_neighbouring_chunks_share_their_edge(model_path, shape, chunks):
+    rng = np.random.default_rng(chunks)
+    heightmap = rng.integers(0, 256, shape, dtype=np.uint8)
+    layout, maps = write_chunks(model_path, heightmap, chunks)
+
+    sizes = {chunk_map.shape for chunk_map in maps.values()}
+    assert len(sizes) == 1
+    size = sizes.pop()[0]
+    # Gazebo heightmaps are 2^n+1 samples wide
+    assert (size - 1) & (size - 2) == 0
+    for (row, col), chunk_map in maps.items():
+        if col + 1 < chunks:
+            np.testing.assert_array_equal(chunk_map[:, -1], maps[row, col + 1][:, 0])
+        if row + 1 < chunks:
+            np.testing.assert_array_equal(chunk_map[-1, :], maps[row + 1, col][0, :])
+
+
+def test_chunks_cover_the_region_without_gaps(model_path):
+    heightmap = np.random.default_rng(0).integers(0, 256, (301, 257), dtype=np.uint8)
+    layout, maps = write_chunks(model_path, heightmap, 3)
+
+    for chunk in layout:
+        assert chunk["x0"] == chunk["cols"][0] / 256 and chunk["y0"] == chunk["rows"][0] / 300
+        rows, cols = chunk["rows"], chunk["cols"]
+        chunk_map = maps[chunk["row"], chunk["col"]]
+        # The corners of every chunk are samples of the full heightmap
+        assert chunk_map[0, 0] == heightmap[rows[0], cols[0]]
+        assert chunk_map[-1, -1] == heightmap[rows[1] - 1, cols[1] - 1]
+    assert {chunk["x1"] for chunk in layout if chunk["col"] == 2} == {1.0}
+    assert {chunk["y1"] for chunk in layout if chunk["row"] == 2} == {1.0}
@@ -0,0 +1,80 @@
+import threading
+
+import pytest
+
+from utils.jobManager import JobManager, JobQueueFull
+from utils.param import globalParam
+
+
+@pytest.fixture(autouse=True)
+def temp_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(globalParam, "TEMP_PATH", str(tmp_path))
+
+
+def blocking(release):
+    def target(job):
+        release.wait(5)
+    return target
+
+
+def test_jobs_beyond_the_workers_wait_in_the_queue():
+    manager = JobManager(max_workers=1, max_queued=1)
+    release = threading.Event()
+    first = manager.submit("first", blocking(release))
+    second = manager.submit("second", blocking(release))
+    first.wait_for_update(0, 5)
+    assert first.status == "in_progress"
+    assert second.status == "queued"
+    with pytest.raises(JobQueueFull):
+        manager.submit("third", blocking(release))
+
+    release.set()
+    assert first.wait(5) and second.wait(5)
+    assert [job.status for job in manager.jobs()] == ["completed", "completed"]
+    assert manager.latest() is second
+
+
+def test_status_events_and_failures():
+    manager = JobManager(max_workers=1)
+
+    def target(job, tiles):
+        with job.stage("dem", total=tiles):
+            job.advance(tiles, 100)
+        raise RuntimeError("no DEM")
+
+    job = manager.submit("world", target, 3)
+    assert job.wait(5)
+    assert job.status == "failed" and job.error == "no DEM"
+    assert [event.get("status") or event.get("stage") for event in job.events_since(0)] == \
+        ["in_progress", "dem", "failed"]
+    assert job.progress()["processed"] == 3
+
+
+def test_cancelled_jobs_stop_at_the_next_check():
+    manager = JobManager(max_workers=1)
+    release = threading.Event()
+    running = manager.submit("running", blocking(release))
+    queued = manager.submit("queued", blocking(release))
+    assert manager.cancel(queued.job_id)
+    release.set()
+    assert queued.wait(5) and queued.status == "cancelled"
+    assert running.wait(5) and running.status == "completed"
+    assert not manager.cancel(running.job_id)
+
+    def checking(job):
+        job.cancel()
+        job.check_cancelled()
+
+    job = manager.submit("checking", checking)
+    assert job.wait(5) and job.status == "cancelled"
+
+
+def test_history_keeps_the_latest_finished_jobs():
+    manager = JobManager(max_workers=1, history=2)
+    jobs = [manager.submit(f"job{i}", lambda job: None) for i in range(3)]
+    for job in jobs:
+        assert job.wait(5)
+    latest = manager.submit("latest", lambda job: None)
+    assert latest.wait(5)
+    assert manager.get(jobs[0].job_id) is None and manager.get(jobs[1].job_id) is None
+    assert [job.name for job in manager.jobs()] == ["job2", "latest"]
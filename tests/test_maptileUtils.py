@@ -0,0 +1,58 @@
+import mercantile
+import numpy as np
+import pytest
+
+from utils.maptileUtils import maptile_utiles
+
+
+@pytest.mark.parametrize("zoom", [0, 3, 13, 17, 20])
+def test_lat_lon_to_tile_many_matches_mercantile(zoom):
+    rng = np.random.default_rng(zoom)
+    lats = np.concatenate([rng.uniform(-85.05, 85.05, 500), [85.0511, -85.0511, 0.0]])
+    lons = np.concatenate([rng.uniform(-180, 179.999, 500), [-180.0, 179.999, 0.0]])
+    # Points exactly on tile edges, where floor and rounding disagree most easily
+    edges = np.arange(0, 2 ** zoom, max(1, 2 ** zoom // 16))
+    west, south, _, north = maptile_utiles.tile_bounds_many(edges, edges, zoom)
+    lats = np.concatenate([lats, north, south])
+    lons = np.concatenate([lons, west, west])
+
+    xs, ys = maptile_utiles.lat_lon_to_tile_many(lats, lons, zoom)
+    expected = [mercantile.tile(lon, lat, zoom) for lat, lon in zip(lats, lons)]
+    assert xs.tolist() == [tile.x for tile in expected]
+    assert ys.tolist() == [tile.y for tile in expected]
+
+
+@pytest.mark.parametrize("bounds, zoom", [
+    ([8.54, 47.37, 8.55, 47.38], 17),
+    ([-0.5, -0.5, 0.5, 0.5], 10),
+    ([139.6, 35.6, 139.8, 35.75], 14),
+    ([-74.05, 40.68, -73.9, 40.82], 15),
+])
+def test_tile_range_matches_mercantile(bounds, zoom):
+    expected = sorted((tile.x, tile.y) for tile in mercantile.tiles(*bounds, zoom))
+    x_start, x_end, y_start, y_end = maptile_utiles.tile_range(bounds, zoom)
+    assert (x_start, x_end) == (min(x for x, _ in expected), max(x for x, _ in expected))
+    assert (y_start, y_end) == (min(y for _, y in expected), max(y for _, y in expected))
+    assert sorted(maptile_utiles.get_tile_range(bounds, zoom)) == expected
+
+
+def test_tile_bounds_many_matches_mercantile():
+    xs = np.array([0, 1, 4312, 8191])
+    ys = np.array([0, 5000, 2871, 8191])
+    west, south, east, north = maptile_utiles.tile_bounds_many(xs, ys, 13)
+    for i, (x, y) in enumerate(zip(xs, ys)):
+        expected = mercantile.bounds(int(x), int(y), 13)
+        assert [west[i], south[i], east[i], north[i]] == pytest.approx(list(expected), abs=1e-9)
+
+
+def test_get_tile_range_keeps_tiles_in_selection():
+    bounds = [8.54, 47.37, 8.56, 47.38]
+    triangle = {"type": "Polygon", "coordinates": [[[8.54, 47.37], [8.56, 47.37], [8.54, 47.38], [8.54, 47.37]]]}
+    rectangle = {"type": "Polygon", "coordinates": [[[8.54, 47.37], [8.56, 47.37], [8.56, 47.38],
+                                                     [8.54, 47.38], [8.54, 47.37]]]}
+    tiles = maptile_utiles.get_tile_range(bounds, 17)
+    assert maptile_utiles.get_tile_range(bounds, 17, rectangle) == tiles
+    selected = maptile_utiles.get_tile_range(bounds, 17, triangle)
+    assert 0 < len(selected) < len(tiles)
+    # The north-east corner is outside the triangle
+    assert (max(x for x, _ in tiles), min(y for _, y in tiles)) not in selected
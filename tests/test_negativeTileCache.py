@@ -0,0 +1,54 @@
+import types
+
+import pytest
+
+from utils import metrics, negativeTileCache
+from utils.negativeTileCache import NegativeTileCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(negativeTileCache, "time", types.SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def hits(source: str) -> float:
+    return metrics.TILE_NEGATIVE_CACHE_HITS.labels(source)._value.get()
+
+
+def test_records_expire_after_the_ttl(tmp_path, clock):
+    cache = NegativeTileCache(str(tmp_path), ttl=60)
+    cache.record("dem", 13, 1, 2, 404)
+    assert cache.is_missing("dem", 13, 1, 2)
+    assert not cache.is_missing("dem", 13, 1, 3)
+    assert not cache.is_missing("vector", 13, 1, 2)
+
+    clock.now += 59
+    assert cache.is_missing("dem", 13, 1, 2)
+    clock.now += 2
+    assert not cache.is_missing("dem", 13, 1, 2)
+    assert cache.stats() == {"tiles": 1, "live": 0, "ttl": 60}
+
+    # Recording again renews the entry
+    cache.record("dem", 13, 1, 2, 404)
+    assert cache.is_missing("dem", 13, 1, 2)
+    assert cache.stats()["live"] == 1
+
+
+def test_only_counted_lookups_are_hits(tmp_path, clock):
+    cache = NegativeTileCache(str(tmp_path))
+    cache.record("imagery:abc", 5, 1, 1, 404)
+    before = hits("imagery")
+    assert cache.is_missing("imagery:abc", 5, 1, 1)
+    assert cache.is_missing("imagery:abc", 5, 1, 1, count=False)
+    assert not cache.is_missing("imagery:abc", 5, 1, 2)
+    assert hits("imagery") == before + 1
+
+
+@pytest.mark.parametrize("status, content, missing", [
+    (404, None, True), (204, None, True), (200, b"", True),
+    (200, b"tile", False), (500, None, False), (429, b"", False),
+])
+def test_missing_responses(status, content, missing):
+    assert NegativeTileCache.is_missing_response(status, content) is missing
@@ -0,0 +1,21 @@
+from utils import pipeline
+from utils.maptileUtils import maptile_utiles
+
+
+def test_download_region_tiles_fetches_only_given_tiles(monkeypatch):
+    fetched = []
+
+    def fake_fetch(source, outputDirectory, outputFile, x, y, z, *args):
+        fetched.append((x, y))
+        return {"code": 200, "message": "ok"}
+
+    def enumerate_again(*args):
+        raise AssertionError("tiles enumerated twice")
+
+    monkeypatch.setattr(pipeline, "fetch_tile", fake_fetch)
+    monkeypatch.setattr(maptile_utiles, "get_tile_range", enumerate_again)
+    tiles = [(100, 200), (101, 200)]
+    results = list(pipeline.download_region_tiles("src", [0, 0, 1, 1], 9, "run", "{z}/{x}/{y}.png", 0,
+                                                  workers=2, tiles=tiles))
+    assert sorted(fetched) == tiles
+    assert sorted((result["x"], result["y"]) for result in results) == tiles
@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+import server
+from utils.jobManager import Job
+from utils.param import globalParam
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(globalParam, "SSE_PROGRESS_INTERVAL", 0)
+    return server.app.test_client()
+
+
+def read_events(response) -> list:
+    events = []
+    for block in response.get_data(as_text=True).split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if "event" in lines:
+            events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_task_events_streams_until_final_status(client, monkeypatch):
+    job = Job("world")
+    monkeypatch.setattr(server.job_manager, "get", lambda job_id: job if job_id == job.job_id else None)
+    job.set_status("in_progress")
+    with job.stage("dem", total=2):
+        job.advance(2, 10)
+    job.set_status("completed")
+
+    events = read_events(client.get(f"/task-events?job_id={job.job_id}"))
+    names = [name for name, _ in events]
+    assert names[0] == "job"
+    assert names.count("stage") == 1
+    assert [data["status"] for name, data in events if name == "status"] == ["in_progress", "completed"]
+
+
+def test_task_events_sends_status_set_while_draining(client, monkeypatch):
+    job = Job("world")
+    monkeypatch.setattr(server.job_manager, "get", lambda job_id: job if job_id == job.job_id else None)
+    job.set_status("in_progress")
+    events_since = job.events_since
+
+    def finish_while_draining(index):
+        events = events_since(index)
+        if not job.finished:
+            # The job finishes right after the stream read its events
+            job.set_status("completed")
+        return events
+
+    monkeypatch.setattr(job, "events_since", finish_while_draining)
+    events = read_events(client.get(f"/task-events?job_id={job.job_id}"))
+    assert [data["status"] for name, data in events if name == "status"] == ["in_progress", "completed"]
+
+
+def test_task_events_unknown_job(client):
+    response = client.get("/task-events?job_id=missing")
+    assert response.get_json()["code"] == 404
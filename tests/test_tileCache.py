@@ -0,0 +1,45 @@
+import itertools
+import os
+import types
+
+from utils import tileCache
+from utils.tileCache import TileCache
+
+
+def test_eviction_trims_to_ninety_percent_of_budget(tmp_path, monkeypatch):
+    # A strictly increasing clock keeps the LRU order deterministic
+    clock = itertools.count()
+    monkeypatch.setattr(tileCache, "time", types.SimpleNamespace(time=lambda: next(clock)))
+    cache = TileCache(str(tmp_path), max_bytes=10_000)
+    for x in range(9):
+        cache.put("src", 10, x, 0, bytes([x]) * 1000)
+    assert cache.stats()["bytes"] == 9000
+
+    # Touch the oldest tile so the next one in line is evicted instead
+    assert cache.get("src", 10, 0, 0) is not None
+    cache.put("src", 10, 9, 0, bytes([9]) * 1000)
+    cache.put("src", 10, 10, 0, bytes([10]) * 1000)
+
+    stats = cache.stats()
+    assert stats["bytes"] == 9000
+    assert cache.contains("src", 10, 0, 0)
+    assert not cache.contains("src", 10, 1, 0)
+    assert not cache.contains("src", 10, 2, 0)
+    assert cache.contains("src", 10, 10, 0)
+    blobs = sum(len(files) for _, _, files in os.walk(cache.objects_path))
+    assert blobs == stats["blobs"]
+
+
+def test_identical_tiles_are_stored_once(tmp_path):
+    cache = TileCache(str(tmp_path), max_bytes=10_000)
+    first = cache.put("src", 10, 0, 0, b"ocean" * 100)
+    second = cache.put("src", 10, 1, 0, b"ocean" * 100)
+    assert first == second
+    assert cache.stats()["bytes"] == 500
+
+
+def test_source_key_ignores_credentials():
+    template = "https://api.mapbox.com/v4/mapbox.satellite/{z}/{x}/{y}@2x.jpg90?access_token="
+    assert TileCache.source_key(template + "first") == TileCache.source_key(template + "second")
+    assert TileCache.source_key("https://mt0.google.com/vt?lyrs=s&x={x}&y={y}&z={z}") != \
+        TileCache.source_key("https://mt0.google.com/vt?lyrs=m&x={x}&y={y}&z={z}")
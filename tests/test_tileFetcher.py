@@ -0,0 +1,83 @@
+import types
+
+import pytest
+
+from utils import tileFetcher
+from utils.tileFetcher import RateLimiter
+
+
+class FakeClock:
+    """
+    Monotonic clock that only advances when the limiter sleeps.
+
+    The tests use power of two rates so the token arithmetic stays exact.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(tileFetcher, "time", types.SimpleNamespace(monotonic=clock.monotonic, sleep=clock.sleep))
+    return clock
+
+
+def test_acquire_allows_burst_then_paces(clock):
+    limiter = RateLimiter(8)
+    for _ in range(8):
+        limiter.acquire()
+    assert clock.sleeps == []
+
+    for _ in range(16):
+        limiter.acquire()
+    assert clock.now == 2.0
+    assert limiter._tokens == 0
+
+
+def test_acquire_refills_up_to_capacity(clock):
+    limiter = RateLimiter(4, burst=2)
+    limiter.acquire()
+    limiter.acquire()
+    clock.now += 60
+    limiter.acquire()
+    limiter.acquire()
+    assert clock.sleeps == []
+    limiter.acquire()
+    assert clock.sleeps == [0.25]
+
+
+def test_consume_charges_debt_to_later_callers(clock):
+    limiter = RateLimiter(1024)
+    limiter.consume(3072)
+    # The full bucket pays for 1024 bytes, the rest is waited for
+    assert clock.now == 2.0
+    limiter.consume(512)
+    assert clock.now == 2.5
+    assert limiter._tokens == -512
+
+
+def test_zero_rate_disables_limiting(clock):
+    limiter = RateLimiter(0)
+    for _ in range(100):
+        limiter.acquire()
+    limiter.consume(1e9)
+    assert clock.sleeps == []
+
+
+def test_shared_limiter_is_reused_and_updated(monkeypatch):
+    monkeypatch.setattr(RateLimiter, "_shared", {})
+    limiter = RateLimiter.shared("dem", 16)
+    assert RateLimiter.shared("dem", 16) is limiter
+    assert RateLimiter.shared("dem", 4) is limiter
+    assert limiter.rate == 4 and limiter.capacity == 4
+    assert RateLimiter.shared("vector", 16) is not limiter
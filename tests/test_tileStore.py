@@ -0,0 +1,76 @@
+import os
+import pickle
+import sqlite3
+
+import pytest
+
+from utils import tileStore
+from utils.tileStore import (DirectoryTileStore, MBTilesTileStore, TileStore, close_tile_store,
+                             open_tile_store, read_tile)
+
+
+def test_incomplete_backend_fails_at_instantiation():
+    class ReadOnly(TileStore):
+        def exists(self, z, x, y):
+            return False
+
+        def get(self, z, x, y):
+            return None
+
+    with pytest.raises(TypeError):
+        ReadOnly()
+
+
+@pytest.mark.parametrize("store_class", [DirectoryTileStore, MBTilesTileStore])
+def test_round_trip(tmp_path, store_class):
+    store = store_class(str(tmp_path))
+    store.put(3, 2, 1, b"tile-a")
+    store.put(3, 2, 5, b"tile-b")
+    store.put(3, 4, 1, b"tile-c")
+    assert store.get(3, 2, 1) == b"tile-a"
+    assert store.exists(3, 4, 1) and not store.exists(3, 4, 2)
+    assert store.get(3, 4, 2) is None
+    assert store.columns(3) == {2: [1, 5], 4: [1]}
+    store.close()
+
+    reopened = store_class(str(tmp_path))
+    assert reopened.get(3, 2, 5) == b"tile-b"
+    reopened.close()
+
+
+def test_mbtiles_rows_use_the_tms_scheme(tmp_path):
+    store = MBTilesTileStore(str(tmp_path), batch_size=2)
+    store.put(3, 2, 1, b"north")
+    assert store.get(3, 2, 1) == b"north"
+    store.put(3, 2, 6, b"south")
+    store.close()
+
+    with sqlite3.connect(os.path.join(tmp_path, MBTilesTileStore.FILE_NAME)) as db:
+        rows = dict(db.execute("SELECT tile_row, tile_data FROM tiles WHERE zoom_level=3 AND tile_column=2"))
+    assert rows == {6: b"north", 1: b"south"}
+
+
+def test_mbtiles_pickles_without_pending_tiles(tmp_path):
+    store = MBTilesTileStore(str(tmp_path))
+    store.put(1, 0, 0, b"tile")
+    copy = pickle.loads(pickle.dumps(store))
+    assert copy.get(1, 0, 0) == b"tile"
+    store.close()
+    copy.close()
+
+
+def test_read_tile_creates_nothing(tmp_path, monkeypatch):
+    monkeypatch.setattr(tileStore.globalParam, "TILE_STORE", "mbtiles")
+    empty = tmp_path / "empty"
+    empty.mkdir()
+    assert read_tile(str(empty), 1, 0, 0) is None
+    assert os.listdir(empty) == []
+
+    root = str(tmp_path / "run")
+    store = open_tile_store(root, "mbtiles")
+    store.put(1, 0, 1, b"pending")
+    # A store opened by a running download serves tiles not flushed yet
+    assert read_tile(root, 1, 0, 1) == b"pending"
+    close_tile_store(root, "mbtiles")
+    assert read_tile(root, 1, 0, 1) == b"pending"
+    assert tileStore._open_stores == {}
@@ -0,0 +1,59 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from utils.tileStore import DirectoryTileStore
+from utils.utils import ConcatImage
+
+
+BOUNDARIES = {"northwest": [10, 20], "northeast": [12, 20], "southwest": [10, 21], "southeast": [12, 21]}
+
+
+def tile(value: int) -> bytes:
+    return cv2.imencode(".png", np.full((8, 8, 3), value, dtype=np.uint8))[1].tobytes()
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = DirectoryTileStore(str(tmp_path))
+    for x in range(10, 13):
+        for y in range(20, 22):
+            store.put(5, x, y, tile(10 * (x - 9) + (y - 19)))
+    return store
+
+
+def test_mosaic_places_every_tile(tmp_path, store):
+    image = ConcatImage(temp_path=str(tmp_path)).mosaic(store, 5, BOUNDARIES)
+    assert image.shape == (16, 24, 3)
+    for col in range(3):
+        for row in range(2):
+            assert (image[row * 8:(row + 1) * 8, col * 8:(col + 1) * 8] == 10 * (col + 1) + row + 1).all()
+
+
+def test_mosaic_leaves_corrupt_tiles_black(tmp_path, store):
+    # The first tile is the one the tile size used to be read from
+    store.put(5, 10, 20, b"not an image")
+    store.put(5, 12, 21, b"\x89PNG truncated")
+    image = ConcatImage(temp_path=str(tmp_path)).mosaic(store, 5, BOUNDARIES)
+    assert image.shape == (16, 24, 3)
+    assert (image[:8, :8] == 0).all()
+    assert (image[8:, 16:] == 0).all()
+    assert (image[8:, :8] == 12).all()
+    assert (image[:8, 16:] == 31).all()
+
+
+def test_mosaic_skips_incomplete_columns(tmp_path, store):
+    os.remove(store.path(5, 12, 21))
+    image = ConcatImage(temp_path=str(tmp_path)).mosaic(store, 5, BOUNDARIES)
+    assert image.shape == (16, 16, 3)
+
+
+def test_mosaic_without_decodable_tiles(tmp_path, store):
+    for x in range(10, 13):
+        for y in range(20, 22):
+            store.put(5, x, y, b"garbage")
+    with pytest.raises(ValueError):
+        ConcatImage(temp_path=str(tmp_path)).mosaic(store, 5, BOUNDARIES)
+    assert ConcatImage(temp_path=str(tmp_path)).mosaic(store, 6, BOUNDARIES) is None